@@ -1,47 +1,226 @@
+from time import perf_counter
 import numpy as np
+from scipy.sparse import csr_matrix
+from data import DTYPES, as_sparse
+from instrument import record, timer
+from parallel import WorkerPool, effective_n_jobs, parallel_for, shared_empty
 
-def complete(M_train, k, n_iter=5, lambd=0.1):
+def solve_rows(R, F, lambd, X=None, block_size=None, n_jobs=None):
+    """
+    Résout en lot, pour chaque ligne i de la matrice creuse R, le système régularisé
+    (F_iᵀ F_i + lambd * I) x_i = F_iᵀ r_i, où F_i sont les lignes de F correspondant aux notes observées de la ligne i.
+    
+    Paramètres :
+    R : matrice des notes observées au format CSR (R.csr pour les utilisateurs, R.csc.T pour les films)
+    F : facteurs fixés du côté opposé (une ligne par colonne de R)
+    lambd : régularisation
+    X : facteurs courants, mis à jour sur place ; les lignes sans aucune note ne sont pas modifiées (nouvelle matrice si None)
+    block_size : nombre de lignes traitées à la fois (borne la mémoire des matrices de Gram empilées)
+    n_jobs : nombre de workers se partageant les blocs de lignes (voir parallel.py) ; avec plusieurs processus,
+             X doit être alloué par `shared_empty` pour que les mises à jour soient visibles
+    
+    Retourne :
+    X : facteurs mis à jour
+    sse : somme des carrés des erreurs sur les notes observées après la mise à jour
+    """
+    n_rows, k = R.shape[0], F.shape[1]
+    n_workers = effective_n_jobs(n_jobs)
+    if X is None:
+        X = np.zeros((n_rows, k), dtype=F.dtype) if n_workers == 1 else shared_empty((n_rows, k), F.dtype)
+        X[:] = 0
+    R = R.astype(F.dtype, copy=False)  # produits creux dans le type des facteurs
+    solve_block = _block_solver(R, F, lambd, X, _outer_products(F))
+    sse = np.sum(R.data ** 2, dtype=np.float64) + sum(parallel_for(solve_block, n_rows, n_jobs,
+                                                                   _block_size(n_rows, k, n_workers, block_size)))
+    return X, sse
+
+
+def _block_size(n_rows, k, n_workers, block_size=None):
+    # lignes par bloc : borne la mémoire des matrices de Gram empilées, et au moins un bloc par worker
+    if block_size is None:
+        block_size = max(1, 2**22 // max(1, k * k))
+    if n_workers > 1:
+        block_size = min(block_size, -(-n_rows // n_workers))
+    return block_size
+
+
+def _outer_products(F, out=None):
+    # produits extérieurs f_j f_jᵀ aplatis (triangle supérieur seulement, une ligne par ligne de F), écrits dans `out`
+    # (ligne p du triangle : F[:, p] * F[:, p:], calculée sur Fᵀ où ces vecteurs sont contigus, puis transposée en bloc)
+    k = F.shape[1]
+    if out is None:
+        out = np.empty((F.shape[0], k * (k + 1) // 2), dtype=F.dtype)
+    F_T, out_T = np.ascontiguousarray(F.T), np.empty(out.shape[::-1], dtype=out.dtype)
+    start = 0
+    for p in range(k):
+        np.multiply(F_T[p], F_T[p:], out=out_T[start:start + k - p])
+        start += k - p
+    out[:] = out_T.T
+    return out
+
+
+def _block_solver(R, F, lambd, X, outer):
+    # fn(start, stop) qui résout les lignes start:stop de R (CSR, dans le type de F) et écrit leurs facteurs dans X ;
+    # F et outer (= _outer_products(F)) sont lus à chaque appel : ils peuvent être mis à jour sur place entre deux appels.
+    # Renvoie la part de l'erreur du bloc qui dépend des facteurs (voir solve_rows).
+    n_rows, k = R.shape[0], F.shape[1]
+    # Les matrices de Gram de toutes les lignes s'obtiennent par un seul produit creux :
+    # G_i = somme sur les notes observées j de f_j f_jᵀ = (masque @ produits extérieurs aplatis)_i
+    # (seul le triangle supérieur est calculé, G_i étant symétrique)
+    known = csr_matrix((np.ones_like(R.data), R.indices, R.indptr), shape=R.shape)  # même structure, sans copie
+    has_rates = np.diff(R.indptr) > 0
+
+    def solve_block(start, stop):
+        rows = np.where(has_rates[start:stop])[0]
+        R_block, known_block = (R, known) if stop - start == n_rows else (R[start:stop], known[start:stop])
+        products, rhs = known_block @ outer, R_block @ F
+        if len(rows) < stop - start:
+            products, rhs = products[rows], rhs[rows]
+        # une ligne par coefficient (triangle supérieur de G_i ou composante de F_iᵀ r_i), une colonne par ligne de R
+        rhs = np.ascontiguousarray(rhs.T)
+        x = _solve_packed(np.ascontiguousarray(products.T), rhs, lambd)
+        if len(rows) < stop - start:
+            X[start + rows] = x.T
+        else:
+            X[start:stop] = x.T
+        # L'erreur se déduit des mêmes quantités : sum (r - x.f)² = sum r² - 2 x.(F_iᵀ r_i) + xᵀ G_i x,
+        # avec xᵀ G_i x = xᵀ (G_i + lambd I) x - lambd |x|² = x.(F_iᵀ r_i) - lambd |x|²
+        return -np.sum(x * (rhs + lambd * x), dtype=np.float64)
+
+    return solve_block
+
+
+def _solve_packed(G, B, lambd):
+    # Résout (G_i + lambd I) x_i = b_i pour toutes les colonnes i à la fois, par Cholesky : G contient le triangle
+    # supérieur de chaque G_i ligne par ligne (k (k + 1) / 2 lignes, une colonne par système, modifié sur place),
+    # B les seconds membres (k lignes). Chaque étape traite un coefficient pour tous les systèmes : pour les petits k,
+    # c'est bien plus rapide qu'un appel LAPACK par système, et les G_i ne sont jamais recopiées en matrices k x k.
+    k = B.shape[0]
+    offsets = np.concatenate([[0], np.cumsum(np.arange(k, 0, -1))])  # début de la ligne j du triangle
+    G[offsets[:-1]] += lambd
+    L = np.empty((k,) + B.shape, dtype=B.dtype)  # L[p, i] : coefficient (i, p) du facteur de Cholesky, i >= p
+    inv_diag = np.empty_like(B)  # inverses des coefficients diagonaux de L
+    for j in range(k):
+        a = G[offsets[j]:offsets[j + 1]]  # (G_i + lambd I)[j, j:]
+        if j:
+            a = a - np.einsum('pin,pn->in', L[:j, j:], L[:j, j])
+        L[j, j] = np.sqrt(a[0])
+        inv_diag[j] = 1 / L[j, j]
+        np.multiply(a[1:], inv_diag[j], out=L[j, j + 1:])
+    # substitutions : L y = b, puis Lᵀ x = y
+    Y = np.empty_like(B)
+    for i in range(k):
+        Y[i] = (B[i] - np.einsum('pn,pn->n', L[:i, i], Y[:i])) * inv_diag[i]
+    X = np.empty_like(B)
+    for i in reversed(range(k)):
+        X[i] = (Y[i] - np.einsum('pn,pn->n', L[i, i + 1:], X[i + 1:])) * inv_diag[i]
+    return X
+
+
+def fold_in(R_rows, F, lambd=0.1):
+    """
+    Facteurs de lignes nouvelles ou modifiées (nouveaux utilisateurs par exemple), les facteurs opposés F restant fixés :
+    un système régularisé par ligne, comme une demi-itération ALS restreinte à ces lignes.
+    R_rows : notes observées de ces lignes (CSR, F.shape[0] colonnes). Une ligne sans note reçoit des facteurs nuls.
+    """
+    return solve_rows(R_rows, F, lambd)[0]
+
+
+def factorize(M_train, k, n_iter=5, lambd=0.1, tol=None, n_jobs=None, init=None, random_state=None):
+    """
+    Factorisation ALS M_train ≈ U Vᵀ : à chaque itération, tous les U_i puis tous les V_j sont résolus en lot.
+    
+    Paramètres :
+    M_train : matrice d'entraînement (contenant des NaN pour les valeurs manquantes) ou SparseRatings
+    k : nombre de facteurs latents
+    n_iter : nombre maximal d'itérations
+    lambd : régularisation
+    tol : si fourni, arrêt anticipé dès que le RMSE d'entraînement diminue de moins de `tol` (en relatif) sur une itération
+    n_jobs : nombre de workers pour les mises à jour des lignes (None : séquentiel, -1 : tous les coeurs)
+    init : facteurs initiaux (U, V) (copiés), par exemple ceux d'un apprentissage précédent (démarrage à chaud,
+           voir sweep.py) ; des valeurs aléatoires par défaut
+    random_state : graine des facteurs initiaux aléatoires (None -> générateur global np.random, comme historiquement) ;
+                   à fixer dès que plusieurs apprentissages tournent en parallèle (eval.cross_validate, sweep.py)
+    
+    Retourne :
+    U, V : facteurs utilisateurs (n_users x k) et films (n_items x k)
+    losses : RMSE d'entraînement après chaque itération
+    """
+    # Seules les notes observées sont utilisées : par utilisateur (CSR) et par film (CSC transposée)
+    R = as_sparse(M_train)
+    R_users, R_items = R.csr, R.csc.T.tocsr()
+
+    # Initialisation des matrices U et V avec des petites valeurs aléatoires
+    n_users, n_items = R.shape
+    if init is None:
+        rng = np.random if random_state is None else np.random.RandomState(random_state)
+        U = rng.rand(n_users, k).astype(DTYPES["factor"], copy=False)
+        V = rng.rand(n_items, k).astype(DTYPES["factor"], copy=False)
+    else:
+        U, V = (np.array(A, dtype=DTYPES["factor"]) for A in init)
+    n_workers = effective_n_jobs(n_jobs)
+    if n_workers > 1:
+        # Facteurs en mémoire partagée : les workers y écrivent directement leurs lignes
+        U, V = _to_shared(U), _to_shared(V)
+
+    # Les deux demi-itérations sont préparées une fois : les workers, créés une seule fois pour tout l'apprentissage,
+    # en héritent ; seuls les facteurs et leurs produits extérieurs (en mémoire partagée) changent ensuite
+    R_users, R_items = (R_side.astype(U.dtype, copy=False) for R_side in (R_users, R_items))
+    n_outer = k * (k + 1) // 2
+    outer_V, outer_U = ((np.empty if n_workers == 1 else shared_empty)((n, n_outer), U.dtype) for n in (n_items, n_users))
+    solve_users = _block_solver(R_users, V, lambd, U, outer_V)
+    solve_items = _block_solver(R_items, U, lambd, V, outer_U)
+    sse_items = np.sum(R_items.data ** 2, dtype=np.float64)
+
+    losses = []
+    with WorkerPool([solve_users, solve_items], n_jobs) as pool:
+        for _ in range(n_iter):
+            with timer("als.iteration"):
+                ptm = perf_counter()
+                # Mettre à jour U puis V (les lignes sans note gardent leur valeur)
+                with timer("als.solve_users"):
+                    _outer_products(V, out=outer_V)
+                    parallel_for(solve_users, n_users, chunk_size=_block_size(n_users, k, n_workers), pool=pool)
+                with timer("als.solve_items"):
+                    _outer_products(U, out=outer_U)
+                    sse = sse_items + sum(parallel_for(solve_items, n_items,
+                                                       chunk_size=_block_size(n_items, k, n_workers), pool=pool))
+
+                losses.append(np.sqrt(max(sse, 0) / max(R.nnz, 1)))
+                record("als.iteration_time", perf_counter() - ptm)
+                record("als.loss", losses[-1])
+                # objectif minimisé (erreur + régularisation) : chaque demi-itération le minimise exactement par rapport
+                # à U ou à V, il ne peut que diminuer (à l'arrondi près), contrairement au RMSE seul
+                record("als.objective", sse + lambd * (np.sum(U ** 2, dtype=np.float64) + np.sum(V ** 2, dtype=np.float64)))
+                if tol is not None and len(losses) > 1 and losses[-2] - losses[-1] < tol * losses[-2]:
+                    break
+    
+    return U, V, losses
+
+
+def _to_shared(A):
+    A_shared = shared_empty(A.shape, A.dtype)
+    A_shared[:] = A
+    return A_shared
+
+
+def complete(M_train, k, n_iter=5, lambd=0.1, tol=None, n_jobs=None, random_state=None):
     """
     Implémente un système de recommandation basé sur la décomposition de matrice par ALS (Moindres carrés alternés).
     
     Paramètres :
-    M_train : matrice d'entraînement (contenant des NaN pour les valeurs manquantes)
+    M_train : matrice d'entraînement (contenant des NaN pour les valeurs manquantes) ou SparseRatings
     k : nombre de facteurs latents
     n_iter : nombre d'itérations pour la mise à jour des matrices U et V
     lambd : régularisation
+    tol : arrêt anticipé quand le RMSE d'entraînement ne diminue plus (voir `factorize`)
+    n_jobs : nombre de workers (voir `factorize`)
+    random_state : graine de l'initialisation (voir `factorize`)
     
     Retourne :
     M_pred : matrice prédite (valeurs remplies)
     """
-    
-    # Initialisation des matrices U et V avec des petites valeurs aléatoires
-    n_users, n_items = M_train.shape
-    U = np.random.rand(n_users, k)
-    V = np.random.rand(n_items, k)
-    
-    # On effectue n_iter passes pour optimiser les matrices U et V
-    for _ in range(n_iter):
-        # Mettre à jour U
-        for i in range(n_users):
-            # Indices des éléments notés pour l'utilisateur i
-            rated_items = ~np.isnan(M_train[i, :])
-            if rated_items.sum() > 0:
-                V_rated = V[rated_items, :]
-                M_rated = M_train[i, rated_items]
-                # Calculer la mise à jour de U_i
-                U[i, :] = np.linalg.solve(V_rated.T @ V_rated + lambd * np.eye(k),
-                                          V_rated.T @ M_rated)
-        
-        # Mettre à jour V
-        for j in range(n_items):
-            # Indices des utilisateurs ayant noté l'élément j
-            rated_users = ~np.isnan(M_train[:, j])
-            if rated_users.sum() > 0:
-                U_rated = U[rated_users, :]
-                M_rated = M_train[rated_users, j]
-                # Calculer la mise à jour de V_j
-                V[j, :] = np.linalg.solve(U_rated.T @ U_rated + lambd * np.eye(k),
-                                          U_rated.T @ M_rated)
+    U, V, _ = factorize(M_train, k, n_iter, lambd, tol, n_jobs, random_state=random_state)
     
     # Calculer la matrice prédite M_pred
     M_pred = U @ V.T
@@ -70,7 +249,7 @@ def recommend(M_train, id_user, new=True, k=10, n_iter=5, lambd=0.1):
     # Si new=True, on exclut les films déjà notés par l'utilisateur
     if new:
         # Trouver les films déjà notés (Non-NaN dans M_train)
-        rated_movies = ~np.isnan(M_train[id_user, :])  # films notés
+        rated_movies = as_sparse(M_train).row(id_user)[0]  # films notés
         M_pred[id_user, rated_movies] = -np.inf  # On met une valeur très basse pour les films déjà notés
     
     # Trouver le film avec la note la plus élevée dans la prédiction
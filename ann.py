@@ -0,0 +1,137 @@
+##============================================
+##============================================
+## index approximatif pour la recherche des plus grands produits scalaires
+##============================================
+##============================================
+
+# * IVFIndex(n_lists=None, n_probe=8, n_iter=20, random_state=0)
+# * recall_at_n(index, user_factors, item_factors, n, exclude=None, n_probe=None)
+#
+# Pour un modèle à facteurs (svd, als), recommander revient à chercher les films j maximisant u . v_j.
+# Plutôt que de calculer tous les scores U @ V.T, l'index IVF (inverted file) regroupe les films en `n_lists`
+# groupes par k-means ; pour un utilisateur, seuls les films des `n_probe` groupes les plus prometteurs sont
+# évalués exactement (reranking), ce qui coûte environ n_probe / n_lists du calcul exhaustif.
+#
+# Les groupes sondés sont ceux dont le centre c maximise u . c : le score moyen des films du groupe.
+#
+# Le rappel par rapport à la recherche exacte (`recall_at_n`) augmente avec n_probe : c'est le réglage
+# entre précision et rapidité.
+
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from topn import top_n, top_n_factors
+
+
+##============================================
+## IVFIndex
+##============================================
+class IVFIndex:
+
+  def __init__(self, n_lists=None, n_probe=8, n_iter=20, random_state=0):
+    self.n_lists = n_lists
+    self.n_probe = n_probe
+    self.n_iter = n_iter
+    self.random_state = random_state
+
+  def fit(self, item_factors):
+    """Construit l'index sur les facteurs films (n_items x k) ; renvoie l'index."""
+    self.item_factors_ = np.asarray(item_factors)
+    n_items = self.item_factors_.shape[0]
+    n_lists = self.n_lists if self.n_lists is not None else max(1, int(np.sqrt(n_items)))
+    n_lists = min(n_lists, n_items)
+
+    self.centroids_, assignment = _kmeans(self.item_factors_, n_lists, self.n_iter, self.random_state)
+
+    # listes inversées au format CSR : les films du groupe l sont list_items_[list_indptr_[l]:list_indptr_[l + 1]]
+    self.list_items_ = np.argsort(assignment, kind="stable").astype(np.int32)
+    self.list_indptr_ = np.concatenate(([0], np.cumsum(np.bincount(assignment, minlength=n_lists))))
+    # facteurs rangés dans l'ordre des listes : chaque groupe est un bloc contigu
+    self.list_factors_ = self.item_factors_[self.list_items_]
+    return self
+
+  def search(self, user_factors, n, exclude=None, n_probe=None, block_size=1024):
+    """
+    Les n films de plus grand produit scalaire (approximativement) pour chaque utilisateur.
+    `exclude` : matrice creuse len(user_factors) x n_items des films à exclure (déjà notés par exemple).
+
+    Retourne les indices et les scores (tableaux n_users x min(n, n_items)), comme topn.top_n ;
+    si moins de n films sont trouvés, les dernières positions valent -1 (score -inf).
+    """
+    n_lists = len(self.list_indptr_) - 1
+    n_probe = min(self.n_probe if n_probe is None else n_probe, n_lists)
+    user_factors = np.asarray(user_factors)
+    n_users = user_factors.shape[0]
+    n = min(n, len(self.list_items_))  # au plus n_items colonnes, comme topn.top_n et topn.top_n_factors
+    if exclude is not None:
+      exclude = exclude.tocsr()
+    # position de chaque film dans les listes
+    item_slot = np.empty(len(self.list_items_), dtype=np.int64)
+    item_slot[self.list_items_] = np.arange(len(self.list_items_))
+
+    indices = np.full((n_users, n), -1, dtype=int)
+    values = np.full((n_users, n), -np.inf)
+    for start in range(0, n_users, block_size):
+      stop = min(start + block_size, n_users)
+      queries = user_factors[start:stop]
+
+      # groupes de plus grand score moyen u . c
+      probes = np.argpartition(-(queries @ self.centroids_.T), n_probe - 1, axis=1)[:, :n_probe]
+
+      # films exclus, repérés par leur position dans les listes
+      excluded = None
+      if exclude is not None:
+        block = exclude[start:stop]
+        excluded = csr_matrix((np.ones(block.nnz, dtype=bool), item_slot[block.indices], block.indptr),
+                              shape=(stop - start, len(self.list_items_)))
+
+      # les n meilleurs films de chaque groupe sondé, évalués exactement groupe par groupe :
+      # un produit matriciel (BLAS) entre les utilisateurs qui sondent le groupe et les films du groupe
+      best_items = np.full((stop - start, n_probe, n), -1, dtype=np.int64)
+      best_scores = np.full((stop - start, n_probe, n), -np.inf)
+      flat = probes.ravel()
+      order = np.argsort(flat, kind="stable")
+      probe_users, probe_ranks = np.divmod(order, n_probe)
+      bounds = np.searchsorted(flat[order], np.arange(n_lists + 1))
+      for l in np.unique(probes):
+        users, ranks = probe_users[bounds[l]:bounds[l + 1]], probe_ranks[bounds[l]:bounds[l + 1]]
+        lo, hi = self.list_indptr_[l], self.list_indptr_[l + 1]
+        scores = queries[users] @ self.list_factors_[lo:hi].T
+        if excluded is not None:
+          sub = excluded[users][:, lo:hi].tocoo()
+          scores[sub.row, sub.col] = -np.inf
+        slots, slot_scores = top_n(scores, n)
+        best_items[users, ranks, :slots.shape[1]] = np.where(slots >= 0, self.list_items_[lo + np.maximum(slots, 0)], -1)
+        best_scores[users, ranks, :slots.shape[1]] = slot_scores
+
+      # fusion des meilleurs films des n_probe groupes
+      slots, values[start:stop] = top_n(best_scores.reshape(stop - start, -1), n)
+      indices[start:stop] = np.take_along_axis(best_items.reshape(stop - start, -1), slots, axis=1)
+    indices[np.isneginf(values)] = -1
+    return indices, values
+
+
+##============================================
+## recall_at_n(index, user_factors, item_factors, n, exclude=None, n_probe=None)
+##============================================
+def recall_at_n(index, user_factors, item_factors, n, exclude=None, n_probe=None):
+  """Proportion moyenne des n films de la recherche exacte retrouvés par l'index."""
+  exact, _ = top_n_factors(user_factors, item_factors, n, exclude)
+  approx, _ = index.search(user_factors, n, exclude, n_probe)
+  found = [len(np.intersect1d(exact[i], approx[i])) for i in range(exact.shape[0])]
+  return np.mean(found) / exact.shape[1]
+
+
+def _kmeans(X, n_clusters, n_iter, random_state):
+  # algorithme de Lloyd, initialisé sur des points tirés au hasard
+  rng = np.random.default_rng(random_state)
+  centroids = X[rng.choice(X.shape[0], n_clusters, replace=False)]
+  for _ in range(n_iter):
+    assignment = np.argmin(np.sum(centroids ** 2, axis=1) - 2 * X @ centroids.T, axis=1)
+    counts = np.bincount(assignment, minlength=n_clusters)
+    sums = csr_matrix((np.ones(len(X)), (assignment, np.arange(len(X)))), shape=(n_clusters, len(X))) @ X
+    # un groupe vide garde son centre
+    centroids = np.where(counts[:, None] > 0, sums / np.maximum(counts, 1)[:, None], centroids)
+  assignment = np.argmin(np.sum(centroids ** 2, axis=1) - 2 * X @ centroids.T, axis=1)
+  return centroids, assignment
+
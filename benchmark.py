@@ -0,0 +1,468 @@
+##============================================
+##============================================
+## mesures de performance des algorithmes
+##============================================
+##============================================
+
+# * full_ml100k(sparse=True)
+# * datasets(sizes=("tiny", "small", "ml100k", "synthetic"))
+# * time_it(fn, repeat=3)
+# * measure(fn, repeat=3, warmup=True)
+# * bench_svd_solvers(M, ks=(10, 20, 50), repeat=3)
+# * bench_svd_imputation(data, ks=(10, 20), repeat=3, max_dense=5 * 10**7)
+# * bench_block_sizes(data, models=("svd", "als"), block_sizes=(64, 256, 1024, 4096), repeat=3)
+# * bench_parallel(data, n_jobs=(1, 2, 4), ks=(10, 40), n_iter=5, repeat=3)
+# * bench_als(data, ks=(10, 40), n_iter=5, n_jobs=(None,), repeat=3, max_dense=5 * 10**7)
+# * bench_recommenders(data, models=None, repeat=3, n=10, n_queries=20, batch_size=100, max_ratings=MAX_RATINGS, profile=False)
+# * save_results(rows, path) / load_results(path) / compare_results(baseline, current, threshold=1.1)
+#
+# Utilisation en ligne de commande :
+#   python benchmark.py svd                                # compare les solveurs de svd.factorize sur ML-100k complet
+#   python benchmark.py svd-mean --sizes ml100k synthetic  # remplissage par la moyenne : matrice pleine / implicite
+#   python benchmark.py recommenders -o bench.json         # fit / complétion / recommandation de chaque modèle,
+#                                                          # sur l'échelle de tailles SIZES, résultats en JSON
+#   python benchmark.py recommenders --sizes tiny small --models svd als --precision single
+#   python benchmark.py recommenders --sizes synthetic --synthetic 100000 20000 5000000 --models popularity svd als
+#   python benchmark.py recommenders --sizes small --profile  # ajoute à chaque ligne le détail par étape (instrument.py)
+#   python benchmark.py blocks --sizes ml100k synthetic   # évaluation par blocs (eval.evaluate) selon block_size
+#   python benchmark.py parallel --sizes ml100k --n-jobs 1 2 4 8  # passage à l'échelle d'ALS selon n_jobs
+#   python benchmark.py als --sizes ml100k --n-jobs 1 4    # ALS en lot face à la boucle historique ligne par ligne
+#   python benchmark.py compare avant.json apres.json      # rapports de temps entre deux exécutions (deux commits)
+
+
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+from time import perf_counter
+import numpy as np
+import pandas as pd
+from data import DTYPES, load_data, load_ratings, set_dtypes, SparseRatings
+from eval import evaluate, evaluate_blocks
+from split import random_holdout
+from instrument import profiling
+from models import MODELS
+import als
+import svd
+from synthetic import generate_ratings
+try:
+  import resource
+except ImportError:  # Windows
+  resource = None
+
+
+##============================================
+## full_ml100k(sparse=True)
+##============================================
+def full_ml100k(sparse=True):
+  """Matrice complète ML-100k (943 utilisateurs x 1682 films, indices d'origine), sans la réduction de load_data."""
+  data = load_ratings()
+  R = SparseRatings.from_triplets(data['user'], data['item'], data['rating'].astype(float),
+                                  (data['user'].max() + 1, data['item'].max() + 1))
+  return R if sparse else R.to_dense()
+
+
+##============================================
+## datasets(sizes=("tiny", "small", "ml100k", "synthetic"))
+##============================================
+# Échelle des tailles : (description, fonction de chargement)
+SIZES = {
+  "tiny": ("load_data(tiny=True)", lambda: load_data(tiny=True, sparse=True)),
+  "small": ("load_data() 500 x 400", lambda: load_data(sparse=True)),
+  "ml100k": ("ML-100k complet", full_ml100k),
+  "synthetic": ("synthetic.generate_ratings, dimensions SYNTHETIC_SHAPE",
+                lambda: generate_ratings(*SYNTHETIC_SHAPE, sparse=True)[0]),
+}
+# (utilisateurs, films, notes) de la taille "synthetic" (option --synthetic de la ligne de commande)
+SYNTHETIC_SHAPE = (4000, 2000, 300_000)
+
+def datasets(sizes=("tiny", "small", "ml100k", "synthetic")):
+  """Dictionnaire {taille: SparseRatings} pour les tailles demandées de SIZES."""
+  return {size: SIZES[size][1]() for size in sizes}
+
+
+##============================================
+## time_it(fn, repeat=3)
+##============================================
+def time_it(fn, repeat=3):
+  """Meilleur temps d'exécution de fn() sur `repeat` essais (après un premier appel d'échauffement) et son résultat."""
+  result = fn()
+  times = []
+  for _ in range(repeat):
+    ptm = perf_counter()
+    result = fn()
+    times.append(perf_counter() - ptm)
+  return min(times), result
+
+
+##============================================
+## measure(fn, repeat=3, warmup=True)
+##============================================
+def measure(fn, repeat=3, warmup=True):
+  """
+  Temps des `repeat` appels chronométrés de fn() (après un appel d'échauffement si warmup),
+  pic de mémoire résidente pendant ces appels et dernier résultat.
+  Le pic (Mo) est celui du processus : sous Linux il est remis au niveau courant avant la mesure
+  (/proc/self/clear_refs), ailleurs c'est le maximum depuis le lancement du processus (None sans le module resource).
+  Retourne (times, peak_rss, rss_before, result).
+  """
+  rss_before = _reset_peak_rss()
+  result = fn() if warmup else None
+  times = []
+  for _ in range(repeat):
+    ptm = perf_counter()
+    result = fn()
+    times.append(perf_counter() - ptm)
+  return times, _peak_rss(), rss_before, result
+
+def _reset_peak_rss():
+  # remet le pic de mémoire résidente (VmHWM) à la valeur courante ; renvoie la mémoire résidente courante (Mo)
+  try:
+    with open("/proc/self/clear_refs", "w") as f:
+      f.write("5")
+    return _proc_status("VmRSS")
+  except OSError:
+    return None
+
+def _proc_status(field):
+  with open("/proc/self/status") as f:
+    for line in f:
+      if line.startswith(field + ":"):
+        return int(line.split()[1]) / 1024
+  return None
+
+def _peak_rss():
+  try:
+    return _proc_status("VmHWM")
+  except OSError:
+    if resource is None:
+      return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024  # octets sous macOS, Ko sous Linux
+
+
+##============================================
+## bench_svd_solvers(M, ks=(10, 20, 50), repeat=3)
+##============================================
+def bench_svd_solvers(M, ks=(10, 20, 50), repeat=3):
+  """
+  Compare les solveurs de svd.factorize avec le chemin historique (SVD complète de la matrice remplie de zéros).
+  L'erreur relative est celle de la reconstruction de rang k par rapport à celle du solveur "full" ;
+  le rapport des résidus compare l'erreur d'approximation de la matrice remplie à celle du solveur "full" (1 = optimal).
+  """
+  M_dense = M.to_dense() if isinstance(M, SparseRatings) else M
+  rows = []
+  for k in ks:
+    time_full, (U, S, Vt) = time_it(lambda: svd.factorize(M_dense, k, solver="full"), repeat)
+    M_full = (U * S) @ Vt
+    residual_full = np.linalg.norm(svd.replaceNA_with_zeros(M_dense) - M_full)
+    for solver, M_input in [("full", M_dense), ("arpack", M), ("randomized", M)]:
+      duration, (U, S, Vt) = time_it(lambda: svd.factorize(M_input, k, solver=solver), repeat)
+      rows.append({
+        'solver': solver,
+        'k': k,
+        'time (s)': duration,
+        'speedup': time_full / duration,
+        'relative error': np.linalg.norm((U * S) @ Vt - M_full) / np.linalg.norm(M_full),
+        'residual ratio': np.linalg.norm(svd.replaceNA_with_zeros(M_dense) - (U * S) @ Vt) / residual_full,
+      })
+  return pd.DataFrame(rows)
+
+
+##============================================
+## bench_recommenders(data, models=None, repeat=3, n=10, n_queries=20, batch_size=100, max_ratings=MAX_RATINGS, profile=False)
+##============================================
+# Paramètres des modèles mesurés (ceux de compare.ipynb)
+MODEL_PARAMS = {
+  "popularity": {},
+  "knn": {"k": 20},
+  "knn_item_based": {"k": 20},
+  "svd": {"k": 20},
+  "als": {"k": 20, "n_iter": 10},
+}
+# Nombre de notes au-delà duquel un modèle n'est pas mesuré : la complétion film par film de knn_item_based
+# prend déjà une quarantaine de secondes sur ML-100k complet
+MAX_RATINGS = {"knn_item_based": 10**5}
+
+def bench_recommenders(data, models=None, repeat=3, n=10, n_queries=20, batch_size=100, max_ratings=MAX_RATINGS, profile=False):
+  """
+  Mesure séparément, pour chaque jeu de données de `data` ({nom: SparseRatings}, voir `datasets`) et chaque modèle
+  de `models` (noms de MODEL_PARAMS, tous par défaut) :
+  - "fit" : apprentissage (débit en notes d'apprentissage par seconde) ;
+  - "complete" : matrice complétée (débit en notes prédites par seconde) ;
+  - "recommend" : `n_queries` appels recommend(id_user, n) pour des utilisateurs tirés au hasard (appels par seconde) ;
+  - "recommend_batch" : top-n de `batch_size` utilisateurs en un appel (utilisateurs par seconde).
+  Chaque opération est précédée d'un appel d'échauffement puis chronométrée `repeat` fois : les lignes donnent
+  le meilleur temps, la moyenne et l'écart-type, le débit (au meilleur temps) et le pic de mémoire résidente.
+  Un modèle n'est pas mesuré sur les jeux de plus de max_ratings[modèle] notes.
+  Avec profile=True, un appel supplémentaire (non chronométré) de chaque opération est instrumenté
+  (voir instrument.py) : la colonne "profile" donne les temps par étape, compteurs et séries (perte ALS, ...).
+  Retourne la liste des lignes (dictionnaires), à enregistrer avec `save_results`.
+  """
+  models = list(MODEL_PARAMS) if models is None else models
+  rows = []
+  for name, R in data.items():
+    n_users, n_items = R.shape
+    rng = np.random.default_rng(0)
+    queries = rng.integers(n_users, size=n_queries)
+    batch = rng.choice(n_users, size=min(batch_size, n_users), replace=False)
+    for model_name in models:
+      if R.nnz > max_ratings.get(model_name, np.inf):
+        continue
+      params = MODEL_PARAMS[model_name]
+      model = MODELS[model_name](**params)
+      operations = [
+        ("fit", lambda: model.fit(R), R.nnz, "ratings"),
+        ("complete", model.complete, n_users * n_items, "predictions"),
+        ("recommend", lambda: [model.recommend(id_user, n) for id_user in queries], n_queries, "calls"),
+        ("recommend_batch", lambda: model.recommend_batch(batch, n), len(batch), "users"),
+      ]
+      for operation, fn, n_ops, unit in operations:
+        times, peak_rss, rss_before, _ = measure(fn, repeat)
+        rows.append({
+          "dataset": name, "n_users": n_users, "n_items": n_items, "n_ratings": int(R.nnz),
+          "model": model_name, "params": params, "operation": operation,
+          "best (s)": min(times), "mean (s)": float(np.mean(times)), "std (s)": float(np.std(times)), "repeat": repeat,
+          "ops": n_ops, "unit": unit, "ops/sec": n_ops / min(times) if min(times) > 0 else float("inf"),
+          "peak RSS (MB)": peak_rss,
+          "RSS increase (MB)": None if peak_rss is None or rss_before is None else peak_rss - rss_before,
+        })
+        if profile:
+          with profiling() as prof:
+            fn()
+          rows[-1]["profile"] = prof.report()
+  return rows
+
+
+##============================================
+## save_results(rows, path) / load_results(path) / compare_results(baseline, current, threshold=1.1)
+##============================================
+def save_results(rows, path):
+  """Enregistre les lignes de `bench_recommenders` en JSON, avec le contexte d'exécution (commit, versions, types)."""
+  meta = {
+    "date": datetime.now().isoformat(timespec="seconds"),
+    "commit": _git_commit(),
+    "python": platform.python_version(),
+    "numpy": np.__version__,
+    "platform": platform.platform(),
+    "cpu_count": os.cpu_count(),
+    "dtypes": {name: np.dtype(dtype).name for name, dtype in DTYPES.items()},
+  }
+  with open(path, "w") as f:
+    json.dump({"meta": meta, "results": rows}, f, indent=1)
+
+def load_results(path):
+  """Lignes d'un fichier écrit par `save_results`, sous forme de DataFrame (le contexte est dans df.attrs["meta"])."""
+  with open(path) as f:
+    content = json.load(f)
+  df = pd.DataFrame(content["results"])
+  df.attrs["meta"] = content["meta"]
+  return df
+
+def compare_results(baseline, current, threshold=1.1):
+  """
+  Rapproche deux exécutions (chemins JSON ou DataFrames de `load_results`) sur (dataset, model, operation) :
+  "ratio" = meilleur temps courant / meilleur temps de référence, "regression" si ratio > threshold.
+  """
+  baseline, current = (load_results(df) if isinstance(df, str) else df for df in (baseline, current))
+  keys = ["dataset", "model", "operation"]
+  df = baseline[keys + ["best (s)"]].merge(current[keys + ["best (s)"]], on=keys, suffixes=(" baseline", " current"))
+  df["ratio"] = df["best (s) current"] / df["best (s) baseline"]
+  df["regression"] = df["ratio"] > threshold
+  return df
+
+def _git_commit():
+  try:
+    return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                          cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+##============================================
+## bench_svd_imputation(data, ks=(10, 20), repeat=3, max_dense=5 * 10**7)
+##============================================
+def bench_svd_imputation(data, ks=(10, 20), repeat=3, max_dense=5 * 10**7):
+  """
+  SVD après remplissage par la moyenne des films, pour chaque jeu de `data` ({nom: SparseRatings}) :
+  matrice remplie construite ("dense", solveur "full", chemin historique) ou représentée implicitement
+  (svd.mean_filled_operator, solveurs "arpack" et "randomized"). Temps, pic de mémoire résidente
+  et erreur relative de la reconstruction par rapport au chemin "dense" (calculé si n_users * n_items <= max_dense).
+  """
+  rows = []
+  for name, R in data.items():
+    dense = np.prod(R.shape) <= max_dense
+    M_dense = R.to_dense() if dense else None
+    for k in ks:
+      reference = None
+      paths = ([("dense", "full", M_dense)] if dense else []) + [("implicit", "arpack", R), ("implicit", "randomized", R)]
+      for fill, solver, M_input in paths:
+        times, peak_rss, rss_before, (U, S, Vt) = measure(
+          lambda: svd.factorize(M_input, k, svd.replaceNA_with_mean, solver=solver), repeat)
+        error = None
+        if dense:
+          M_approx = (U * S) @ Vt
+          if reference is None:
+            reference = M_approx
+          error = float(np.linalg.norm(M_approx - reference) / np.linalg.norm(reference))
+        rows.append({
+          "dataset": name, "n_users": R.shape[0], "n_items": R.shape[1], "k": k, "fill": fill, "solver": solver,
+          "best (s)": min(times), "peak RSS (MB)": peak_rss,
+          "RSS increase (MB)": None if peak_rss is None or rss_before is None else peak_rss - rss_before,
+          "relative error": error,
+        })
+  return pd.DataFrame(rows)
+
+
+##============================================
+## bench_block_sizes(data, models=("svd", "als"), block_sizes=(64, 256, 1024, 4096), repeat=3)
+##============================================
+def bench_block_sizes(data, models=("svd", "als"), block_sizes=(64, 256, 1024, 4096), repeat=3):
+  """
+  Évaluation d'un modèle entraîné sur 80 % des notes de chaque jeu de `data` ({nom: SparseRatings}) :
+  matrice complétée puis métriques ("complete", chemin de eval.cross_validate) ou eval.evaluate par blocs
+  pour chaque taille de `block_size`. Temps, pic de mémoire résidente et écart maximal aux métriques de "complete".
+  """
+  rows = []
+  for name, R in data.items():
+    M_train, M_validation = random_holdout(R)
+    for model_name in models:
+      model = MODELS[model_name](**MODEL_PARAMS[model_name]).fit(M_train)
+      paths = [("complete", None, lambda: evaluate_blocks([(np.arange(R.shape[0]), model.complete())], M_validation))]
+      paths += [("blocks", block_size, lambda block_size=block_size: evaluate(model, M_validation, block_size=block_size))
+                for block_size in block_sizes]
+      reference = None
+      for path, block_size, fn in paths:
+        times, peak_rss, rss_before, metrics = measure(fn, repeat)
+        reference = metrics if reference is None else reference
+        rows.append({
+          "dataset": name, "n_users": R.shape[0], "n_items": R.shape[1], "model": model_name,
+          "path": path, "block_size": block_size, "best (s)": min(times), "peak RSS (MB)": peak_rss,
+          "RSS increase (MB)": None if peak_rss is None or rss_before is None else peak_rss - rss_before,
+          "max metric difference": max(abs(metrics[key] - reference[key]) for key in metrics),
+        })
+  return pd.DataFrame(rows)
+
+
+##============================================
+## bench_parallel(data, n_jobs=(1, 2, 4), ks=(10, 40), n_iter=5, repeat=3)
+##============================================
+def bench_parallel(data, n_jobs=(1, 2, 4), ks=(10, 40), n_iter=5, repeat=3):
+  """
+  Passage à l'échelle de als.factorize (mêmes facteurs initiaux) sur chaque jeu de `data` ({nom: SparseRatings})
+  selon le nombre de workers : temps, accélération et efficacité (accélération / n_jobs) par rapport à n_jobs=1.
+  Les workers sont créés une fois par apprentissage ; "cpu count" rappelle le nombre de coeurs de la machine.
+  """
+  rows = []
+  for name, R in data.items():
+    for k in ks:
+      reference = None
+      for n_workers in n_jobs:
+        times, _, _, _ = measure(lambda: als.factorize(R, k, n_iter, n_jobs=n_workers, random_state=0), repeat)
+        reference = min(times) if reference is None else reference
+        rows.append({
+          "dataset": name, "n_ratings": R.nnz, "k": k, "n_jobs": n_workers, "cpu count": os.cpu_count(),
+          "best (s)": min(times), "speedup": reference / min(times), "efficiency": reference / min(times) / n_workers,
+        })
+  return pd.DataFrame(rows)
+
+
+##============================================
+## bench_als(data, ks=(10, 40), n_iter=5, n_jobs=(None,), repeat=3, max_dense=5 * 10**7)
+##============================================
+def bench_als(data, ks=(10, 40), n_iter=5, n_jobs=(None,), repeat=3, max_dense=5 * 10**7):
+  """
+  als.complete (systèmes résolus en lot, avec chaque valeur de `n_jobs`) face à la boucle historique qui résout
+  un système par utilisateur puis par film sur la matrice pleine (`_als_per_row`, si n_users * n_items <= max_dense),
+  à facteurs initiaux égaux, pour chaque jeu de `data` ({nom: SparseRatings}). Temps, accélération par rapport
+  à la boucle et écart maximal entre les matrices complétées.
+  """
+  rows = []
+  for name, R in data.items():
+    dense = np.prod(R.shape) <= max_dense
+    M_dense = R.to_dense() if dense else None
+    for k in ks:
+      rng = np.random.RandomState(0)
+      init = (rng.rand(R.shape[0], k), rng.rand(R.shape[1], k))
+      paths = [("per-row", None, lambda: _als_per_row(M_dense, k, n_iter, 0.1, *init))] if dense else []
+      paths += [("batched", n_workers, lambda n_workers=n_workers: _als_batched(M_dense if dense else R, k, n_iter, 0.1,
+                                                                                  *init, n_workers))
+                for n_workers in n_jobs]
+      reference = None
+      for path, n_workers, fn in paths:
+        times, _, _, M_completed = measure(fn, repeat)
+        if reference is None:
+          reference = (min(times), M_completed)
+        rows.append({
+          "dataset": name, "n_ratings": R.nnz, "k": k, "path": path, "n_jobs": n_workers, "best (s)": min(times),
+          "speedup": reference[0] / min(times) if dense else None,
+          "max difference": float(np.max(np.abs(M_completed - reference[1]))) if dense else None,
+        })
+  return pd.DataFrame(rows)
+
+
+def _als_batched(M, k, n_iter, lambd, U, V, n_jobs):
+  U, V, _ = als.factorize(M, k, n_iter, lambd, n_jobs=n_jobs, init=(U, V))
+  return U @ V.T
+
+
+def _als_per_row(M, k, n_iter, lambd, U, V):
+  # ALS historique (matrice pleine avec NaN) : un système et un appel à np.linalg.solve par utilisateur, puis par film
+  U, V = U.copy(), V.copy()
+  for _ in range(n_iter):
+    for i in range(M.shape[0]):
+      rated = ~np.isnan(M[i, :])
+      if rated.sum() > 0:
+        V_rated = V[rated, :]
+        U[i, :] = np.linalg.solve(V_rated.T @ V_rated + lambd * np.eye(k), V_rated.T @ M[i, rated])
+    for j in range(M.shape[1]):
+      rated = ~np.isnan(M[:, j])
+      if rated.sum() > 0:
+        U_rated = U[rated, :]
+        V[j, :] = np.linalg.solve(U_rated.T @ U_rated + lambd * np.eye(k), U_rated.T @ M[rated, j])
+  return U @ V.T
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Mesures de performance des algorithmes de recommandation.")
+  parser.add_argument("bench", choices=["svd", "svd-mean", "blocks", "parallel", "als", "recommenders", "compare"], help="mesure à lancer")
+  parser.add_argument("files", nargs="*", help="(compare) fichiers JSON de référence et courant")
+  parser.add_argument("--repeat", type=int, default=3, help="nombre d'essais chronométrés")
+  parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=list(SIZES), help="(svd-mean, blocks, parallel, als, recommenders) tailles mesurées")
+  parser.add_argument("--models", nargs="+", choices=list(MODEL_PARAMS), default=None, help="(recommenders, blocks) modèles mesurés")
+  parser.add_argument("--n-jobs", nargs="+", type=int, default=[1, 2, 4], help="(parallel, als) nombres de workers mesurés")
+  parser.add_argument("--synthetic", nargs=3, type=int, metavar=("N_USERS", "N_ITEMS", "N_RATINGS"),
+                      help="(recommenders) dimensions de la taille synthetic")
+  parser.add_argument("--no-limit", action="store_true", help="(recommenders) mesure aussi les modèles au-delà de MAX_RATINGS")
+  parser.add_argument("--profile", action="store_true", help="(recommenders) détail des étapes de chaque opération")
+  parser.add_argument("--precision", choices=["double", "single"], default="double", help="politique de types (data.PRECISIONS)")
+  parser.add_argument("-o", "--output", default="benchmark.json", help="(recommenders) fichier JSON des résultats")
+  parser.add_argument("--threshold", type=float, default=1.1, help="(compare) rapport de temps signalé comme régression")
+  args = parser.parse_args()
+  set_dtypes(args.precision)
+  if args.synthetic:
+    SYNTHETIC_SHAPE = tuple(args.synthetic)
+
+  if args.bench == "svd":
+    print(bench_svd_solvers(full_ml100k(), repeat=args.repeat).to_string(index=False))
+  elif args.bench == "svd-mean":
+    print(bench_svd_imputation(datasets(args.sizes), repeat=args.repeat).to_string(index=False))
+  elif args.bench == "blocks":
+    print(bench_block_sizes(datasets(args.sizes), args.models or ("svd", "als"), repeat=args.repeat).to_string(index=False))
+  elif args.bench == "parallel":
+    print(bench_parallel(datasets(args.sizes), args.n_jobs, repeat=args.repeat).to_string(index=False))
+  elif args.bench == "als":
+    print(bench_als(datasets(args.sizes), n_jobs=args.n_jobs, repeat=args.repeat).to_string(index=False))
+  elif args.bench == "recommenders":
+    rows = bench_recommenders(datasets(args.sizes), args.models, repeat=args.repeat,
+                              max_ratings={} if args.no_limit else MAX_RATINGS, profile=args.profile)
+    save_results(rows, args.output)
+    print(pd.DataFrame(rows)[["dataset", "model", "operation", "best (s)", "std (s)", "ops/sec", "peak RSS (MB)"]].to_string(index=False))
+  else:
+    if len(args.files) != 2:
+      parser.error("compare attend deux fichiers JSON")
+    print(compare_results(*args.files, threshold=args.threshold).to_string(index=False))
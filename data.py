@@ -1,10 +1,17 @@
 """ Préparation des données
 suppose que les fichiers de données sont stocqués dans le répertoire "./data"
+les fichiers texte sont convertis une fois pour toutes en tableaux binaires (.npy) dans "./data/cache" ;
+ce cache est reconstruit automatiquement si le fichier source est modifié (date de modification ou taille).
 
 Fournit
 -------
 * load.data(tiny=False) : retourne une sous-matrice de la matrice de scores ML100k (de taille 500x400 ou 50x40 suivant `tiny`).
 * movie.title(id) : retourne le titre du film d'index `id`
+* load_ratings() : colonnes brutes (user, item, rating, timestamp) de u.data, lues depuis un cache binaire
+* ingest_ratings(source) : lecture par morceaux de fichiers de notes volumineux (u.data ou ratings.csv de ML-20M / ML-25M),
+  identifiants renumérotés, colonnes écrites sur disque et memory-mappées ; select_ratings(ratings, users, items) en extrait une partie
+* SparseRatings : représentation creuse (CSR/CSC + masques des notes observées) acceptée par tous les algorithmes,
+  obtenue avec `load_data(sparse=True)` ou `as_sparse(M)`.
 
 Exemples
 --------
@@ -20,54 +27,418 @@ array([[nan,  5.,  3.,  4.,  3.],
        [nan,  4., nan, nan, nan]])
 >>> movie_title(42)
 'Disclosure (1994)'
+>>> R = load_data(tiny=True, sparse=True)
+>>> R.shape, R.nnz
+((50, 40), 389)
 """
 
 
 ##============================================
 # bibliothèques utiles
 ##============================================
+import json
+import os
+from contextlib import contextmanager
 import numpy as np
 import pandas as pd
-from scipy.sparse import csr_matrix
+from scipy.sparse import csr_matrix, csc_matrix, coo_matrix
+
+
+##============================================
+# politique de types numériques
+##============================================
+# Types utilisés par tous les modules, lus au moment des calculs :
+# "rating" pour les notes (SparseRatings, matrices pleines, découpages), "factor" pour les facteurs ALS / SVD
+# et les similarités KNN, "index" pour les tableaux d'indices (utilisateurs, films).
+# Par défaut tout est en float64 (résultats historiques) ; PRECISIONS["single"] divise la mémoire par deux
+# et accélère les produits matriciels (BLAS en simple précision). Sur disque, les notes entières restent en int8.
+PRECISIONS = {
+  "double": {"rating": np.float64, "factor": np.float64, "index": np.int32},
+  "single": {"rating": np.float32, "factor": np.float32, "index": np.int32},
+}
+DTYPES = dict(PRECISIONS["double"])
+
+def set_dtypes(precision="double", **overrides):
+  """Change la politique de types : une précision de PRECISIONS, éventuellement modifiée type par type (rating=np.float32, ...)."""
+  DTYPES.update(PRECISIONS[precision])
+  DTYPES.update(overrides)
+
+@contextmanager
+def dtypes(precision="double", **overrides):
+  """Politique de types temporaire : `with dtypes("single"): ...`"""
+  previous = dict(DTYPES)
+  set_dtypes(precision, **overrides)
+  try:
+    yield DTYPES
+  finally:
+    DTYPES.clear()
+    DTYPES.update(previous)
+
+
+##============================================
+# SparseRatings
+##============================================
+class SparseRatings:
+  """Matrice de notes creuse.
+
+  Les notes observées sont stockées explicitement (même nulles) au format CSR (accès par utilisateur)
+  et CSC (accès par film) ; `mask` et `mask_csc` sont les masques booléens des notes observées.
+  La mémoire est proportionnelle au nombre de notes et non à n_users x n_items.
+  """
+
+  def __init__(self, csr):
+    csr = csr_matrix(csr, dtype=DTYPES["rating"])  # partage les tableaux de l'appelant si le type est déjà le bon
+    if not csr.has_canonical_format:
+      # sum_duplicates et sort_indices modifient les tableaux sur place : jamais ceux de l'appelant
+      csr = csr.copy()
+      csr.sum_duplicates()
+      csr.sort_indices()
+    self.csr = csr
+    self.csc = csr.tocsc()
+    ones = np.ones(csr.nnz, dtype=bool)  # les deux masques partagent leurs valeurs (voir from_arrays)
+    self.mask = csr_matrix((ones, csr.indices, csr.indptr), shape=csr.shape)
+    self.mask_csc = csc_matrix((ones, self.csc.indices, self.csc.indptr), shape=csr.shape)
+
+  @classmethod
+  def from_dense(cls, M):
+    # positions (aplaties) des notes, dans l'ordre des lignes : directement au format CSR, sans tri ni doublon
+    observed = ~np.isnan(M)
+    positions = np.flatnonzero(observed)
+    indptr = np.searchsorted(positions, np.arange(M.shape[0] + 1) * M.shape[1])
+    csr = csr_matrix((M.ravel()[positions], positions % M.shape[1], indptr), shape=M.shape)
+    csr.has_canonical_format = True  # évite la vérification (et le tri) de __init__
+    return cls(csr)
+
+  @classmethod
+  def from_triplets(cls, users, items, rates, shape):
+    return cls(coo_matrix((rates, (users, items)), shape=shape).tocsr())
+
+  @classmethod
+  def from_arrays(cls, csr, csc):
+    """SparseRatings à partir de ses matrices CSR et CSC déjà au format canonique (indices triés, sans doublons),
+    sans copie ni conversion : les tableaux peuvent être memory-mappés (voir persist.load_model)."""
+    R = cls.__new__(cls)
+    R.csr, R.csc = csr, csc
+    ones = np.ones(csr.nnz, dtype=bool)  # les deux masques partagent leurs valeurs
+    R.mask = csr_matrix((ones, csr.indices, csr.indptr), shape=csr.shape)
+    R.mask_csc = csc_matrix((ones, csc.indices, csc.indptr), shape=csc.shape)
+    return R
+
+  @property
+  def shape(self):
+    return self.csr.shape
+
+  @property
+  def nnz(self):
+    return self.csr.nnz
+
+  @property
+  def T(self):
+    """Matrice transposée (films x utilisateurs)."""
+    return SparseRatings(self.csc.T)
+
+  def to_dense(self):
+    """Matrice pleine avec NaN pour les notes manquantes (format historique)."""
+    M = np.full(self.shape, np.nan, dtype=DTYPES["rating"])
+    users, items, rates = self.triplets()
+    M[users, items] = rates
+    return M
+
+  def triplets(self):
+    """Indices utilisateur, indices film et notes observées (dans l'ordre CSR)."""
+    users = np.repeat(np.arange(self.shape[0], dtype=DTYPES["index"]), np.diff(self.csr.indptr))
+    return users, self.csr.indices, self.csr.data
+
+  def row(self, id_user):
+    """Films notés par l'utilisateur et notes correspondantes."""
+    start, end = self.csr.indptr[id_user], self.csr.indptr[id_user + 1]
+    return self.csr.indices[start:end], self.csr.data[start:end]
+
+  def col(self, id_item):
+    """Utilisateurs ayant noté le film et notes correspondantes."""
+    start, end = self.csc.indptr[id_item], self.csc.indptr[id_item + 1]
+    return self.csc.indices[start:end], self.csc.data[start:end]
+
+  def dense_row(self, id_user):
+    """Ligne pleine de l'utilisateur, avec NaN pour les films non notés."""
+    M_row = np.full(self.shape[1], np.nan, dtype=DTYPES["rating"])
+    items, rates = self.row(id_user)
+    M_row[items] = rates
+    return M_row
+
+  def rows(self, user_ids):
+    """Notes des utilisateurs `user_ids` seulement (SparseRatings len(user_ids) x n_items, dans l'ordre de user_ids)."""
+    return SparseRatings(self.csr[np.asarray(user_ids)])
+
+  def user_counts(self):
+    return np.diff(self.csr.indptr)
+
+  def item_counts(self):
+    return np.diff(self.csc.indptr)
+
+  def user_means(self):
+    """Moyenne des notes de chaque utilisateur (NaN s'il n'a rien noté), comme np.nanmean(M, axis=1)."""
+    with np.errstate(invalid='ignore', divide='ignore'):
+      return np.asarray(self.csr.sum(axis=1)).ravel() / self.user_counts()
+
+  def item_means(self):
+    """Moyenne des notes de chaque film (NaN s'il n'a pas été noté), comme np.nanmean(M, axis=0)."""
+    with np.errstate(invalid='ignore', divide='ignore'):
+      return np.asarray(self.csc.sum(axis=0)).ravel() / self.item_counts()
+
+  def values(self, users, items):
+    """Notes aux positions (users, items) (NaN si non observées), sans densifier la matrice."""
+    users, items = np.broadcast_arrays(users, items)
+    shape = users.shape
+    users, items = users.ravel().copy(), items.ravel().copy()  # copies modifiables (avertissement de scipy sinon)
+    if len(users) == 0:  # scipy renvoie une matrice creuse pour un indexage vide
+      return np.zeros(shape)
+    found = np.asarray(self.mask[users, items]).ravel()
+    rates = np.asarray(self.csr[users, items]).ravel()
+    return np.where(found, rates, np.nan).reshape(shape)
+
+  def updated(self, users, items, rates):
+    """Nouvelle matrice où les notes (users, items, rates) sont ajoutées ou remplacent les notes existantes.
+
+    La matrice est agrandie si des indices dépassent sa taille (nouveaux utilisateurs ou films).
+    Retourne aussi les anciennes notes à ces positions (NaN si elles n'étaient pas observées).
+    Si un couple (utilisateur, film) apparaît plusieurs fois, c'est la dernière note qui compte.
+    """
+    users, items, rates = np.asarray(users), np.asarray(items), np.asarray(rates, dtype=float)
+    shape = (max(self.shape[0], int(users.max(initial=-1)) + 1), max(self.shape[1], int(items.max(initial=-1)) + 1))
+    inside = (users < self.shape[0]) & (items < self.shape[1])
+    old_rates = np.full(len(rates), np.nan)
+    old_rates[inside] = self.values(users[inside], items[inside])
+
+    old_users, old_items, old_values = self.triplets()
+    keep = ~np.isin(old_users.astype(np.int64) * shape[1] + old_items, users.astype(np.int64) * shape[1] + items)
+    # coo_matrix additionne les doublons : seule la dernière note de chaque couple est gardée
+    keys = users.astype(np.int64) * shape[1] + items
+    last = len(keys) - 1 - np.unique(keys[::-1], return_index=True)[1]
+    R = SparseRatings.from_triplets(np.concatenate([old_users[keep], users[last]]),
+                                    np.concatenate([old_items[keep], items[last]]),
+                                    np.concatenate([old_values[keep], rates[last]]), shape)
+    return R, old_rates
+
+
+def as_sparse(M):
+  """Renvoie M sous forme de SparseRatings (sans copie si c'est déjà le cas)."""
+  if isinstance(M, SparseRatings):
+    return M
+  return SparseRatings.from_dense(M)
+
+
+##============================================
+# cache binaire des fichiers de données
+##============================================
+CACHE_DIR = "data/cache"
+
+def _source_stamp(source):
+  # identifie une version du fichier source : date de modification et taille
+  st = os.stat(source)
+  return {"source": os.path.abspath(source), "mtime_ns": st.st_mtime_ns, "size": st.st_size}
+
+def _cached_arrays(source, names, build):
+  """Tableaux `names` du cache associé à `source`, ouverts en lecture par memory-map.
+
+  Le cache est (re)construit par `build()` (qui renvoie un dict nom -> tableau) s'il n'existe pas
+  ou si le fichier source a changé depuis sa construction.
+  """
+  cache = os.path.join(CACHE_DIR, os.path.basename(source))
+  meta_path = os.path.join(cache, "meta.json")
+  stamp = _source_stamp(source)
+  try:
+    with open(meta_path) as f:
+      fresh = json.load(f) == stamp
+  except (OSError, ValueError):
+    fresh = False
+
+  if not fresh:
+    os.makedirs(cache, exist_ok=True)
+    for name, array in build().items():
+      np.save(os.path.join(cache, name + ".npy"), array)
+    # meta.json est écrit en dernier : un cache interrompu en cours d'écriture est reconstruit
+    with open(meta_path, "w") as f:
+      json.dump(stamp, f)
+
+  return {name: np.load(os.path.join(cache, name + ".npy"), mmap_mode="r") for name in names}
+
+
+##============================================
+# load_ratings
+##============================================
+RATING_COLUMNS = ["user", "item", "rating", "timestamp"]
+
+def load_ratings(source="data/u.data"):
+  """Colonnes de u.data (indices utilisateur, indices film, notes, dates), en tableaux binaires memory-mappés."""
+  def build():
+    data = pd.read_csv(source, names=RATING_COLUMNS, sep='\t')
+    return {"user": data["user"].to_numpy(np.int32),
+            "item": data["item"].to_numpy(np.int32),
+            "rating": data["rating"].to_numpy(np.int8),
+            "timestamp": data["timestamp"].to_numpy(np.int64)}
+  return _cached_arrays(source, RATING_COLUMNS, build)
+
+
+##============================================
+# ingest_ratings : lecture par morceaux des gros fichiers de notes
+##============================================
+def ingest_ratings(source, chunksize=10**6, out_dir=None):
+  """Lit un fichier de notes au format MovieLens par morceaux de `chunksize` lignes, sans jamais le charger en entier.
+
+  Formats : u.data (tabulations, sans en-tête) ou ratings.csv des versions ML-20M / ML-25M (virgules, en-tête
+  userId,movieId,rating,timestamp ; notes par demi-étoiles, stockées en float32 au lieu de int8).
+  Les identifiants bruts sont renumérotés à la volée en indices denses 0..n-1 (par ordre de première apparition).
+  Chaque colonne est écrite au fur et à mesure dans un fichier binaire de `out_dir` (par défaut data/cache/<fichier>),
+  relu par memory-map : la mémoire utilisée est bornée par la taille d'un morceau. Comme pour `_cached_arrays`,
+  rien n'est relu si le fichier source n'a pas changé depuis la dernière lecture.
+
+  Retourne un dict : colonnes "user", "item" (int32, indices denses), "rating", "timestamp" (int64), memory-mappées,
+  et "user_ids", "item_ids" (identifiant brut de chaque indice dense). Voir `select_ratings` pour en extraire une partie.
+  """
+  csv = source.endswith(".csv")
+  if out_dir is None:
+    out_dir = os.path.join(CACHE_DIR, os.path.basename(source) + ".stream")
+  meta_path = os.path.join(out_dir, "meta.json")
+  stamp = _source_stamp(source)
+  try:
+    with open(meta_path) as f:
+      meta = json.load(f)
+    fresh = meta["stamp"] == stamp
+  except (OSError, ValueError, KeyError):
+    fresh = False
+
+  if not fresh:
+    os.makedirs(out_dir, exist_ok=True)
+    column_dtypes = {"user": np.int32, "item": np.int32, "rating": np.float32 if csv else np.int8, "timestamp": np.int64}
+    user_ids, item_ids = pd.Index([], dtype=np.int64), pd.Index([], dtype=np.int64)
+    files = {name: open(os.path.join(out_dir, name + ".bin"), "wb") for name in RATING_COLUMNS}
+    n_ratings = 0
+    try:
+      reader = pd.read_csv(source, sep=',' if csv else '\t', header=0 if csv else None, names=RATING_COLUMNS, chunksize=chunksize)
+      for chunk in reader:
+        users, user_ids = _dense_ids(chunk["user"].to_numpy(np.int64), user_ids)
+        items, item_ids = _dense_ids(chunk["item"].to_numpy(np.int64), item_ids)
+        columns = {"user": users, "item": items, "rating": chunk["rating"].to_numpy(), "timestamp": chunk["timestamp"].to_numpy()}
+        for name in RATING_COLUMNS:
+          files[name].write(np.ascontiguousarray(columns[name], dtype=column_dtypes[name]).tobytes())
+        n_ratings += len(chunk)
+    finally:
+      for f in files.values():
+        f.close()
+    np.save(os.path.join(out_dir, "user_ids.npy"), user_ids.to_numpy())
+    np.save(os.path.join(out_dir, "item_ids.npy"), item_ids.to_numpy())
+    # meta.json est écrit en dernier : une lecture interrompue est recommencée
+    meta = {"stamp": stamp, "n_ratings": n_ratings, "dtypes": {name: np.dtype(column_dtypes[name]).str for name in RATING_COLUMNS}}
+    with open(meta_path, "w") as f:
+      json.dump(meta, f)
+
+  ratings = {name: np.memmap(os.path.join(out_dir, name + ".bin"), dtype=meta["dtypes"][name], mode="r", shape=(meta["n_ratings"],))
+             if meta["n_ratings"] > 0 else np.zeros(0, dtype=meta["dtypes"][name]) for name in RATING_COLUMNS}
+  ratings["user_ids"] = np.load(os.path.join(out_dir, "user_ids.npy"))
+  ratings["item_ids"] = np.load(os.path.join(out_dir, "item_ids.npy"))
+  return ratings
+
+def _dense_ids(raw, known):
+  # indices denses des identifiants bruts `raw` ; les identifiants jamais vus sont ajoutés à la fin de `known`
+  codes = known.get_indexer(raw)
+  unseen = codes < 0
+  if np.any(unseen):
+    known = known.append(pd.Index(pd.unique(raw[unseen])))
+    codes[unseen] = known.get_indexer(raw[unseen])
+  return codes, known
+
+
+##============================================
+# select_ratings : sous-ensemble d'utilisateurs / de films
+##============================================
+def select_ratings(ratings, users=None, items=None, chunksize=10**6, sparse=True):
+  """Notes des utilisateurs `users` pour les films `items` (indices denses ; None = tous), lues par morceaux
+  dans les colonnes memory-mappées de `ingest_ratings` (ou `load_ratings`) : le fichier source n'est pas relu.
+
+  Les utilisateurs et films retenus sont renumérotés dans l'ordre donné. Retourne un SparseRatings
+  (len(users) x len(items)) si sparse=True, sinon les colonnes sélectionnées (dict, comme `ingest_ratings`).
+  """
+  n_users = int(ratings["user"].max(initial=-1)) + 1 if users is None else None
+  n_items = int(ratings["item"].max(initial=-1)) + 1 if items is None else None
+  # table indice dense -> nouvel indice (-1 si non retenu) : l'appartenance se teste en O(1) par note
+  user_map = np.arange(n_users) if users is None else _index_map(users, ratings["user"])
+  item_map = np.arange(n_items) if items is None else _index_map(items, ratings["item"])
+
+  selected = {name: [] for name in RATING_COLUMNS}
+  for start in range(0, len(ratings["user"]), chunksize):
+    chunk = {name: np.asarray(ratings[name][start:start + chunksize]) for name in RATING_COLUMNS}
+    new_users, new_items = user_map[chunk["user"]], item_map[chunk["item"]]
+    keep = (new_users >= 0) & (new_items >= 0)
+    chunk["user"], chunk["item"] = new_users[keep].astype(np.int32), new_items[keep].astype(np.int32)
+    for name in ("rating", "timestamp"):
+      chunk[name] = chunk[name][keep]
+    for name in RATING_COLUMNS:
+      selected[name].append(chunk[name])
+  selected = {name: np.concatenate(selected[name]) if selected[name] else np.zeros(0, dtype=ratings[name].dtype) for name in RATING_COLUMNS}
+
+  shape = (n_users if users is None else len(users), n_items if items is None else len(items))
+  if sparse:
+    return SparseRatings.from_triplets(selected["user"], selected["item"], selected["rating"].astype(DTYPES["rating"]), shape)
+  return selected
+
+def _index_map(kept, column):
+  # kept[i] -> i, tout autre indice -> -1
+  kept = np.asarray(kept)
+  index_map = np.full(max(int(column.max(initial=-1)), int(kept.max(initial=-1))) + 1, -1, dtype=np.int64)
+  index_map[kept] = np.arange(len(kept))
+  return index_map
 
 
 ##============================================
 # load.data
 ##============================================
-def load_data(tiny=False):
-  # lecture des données brut
-  data = pd.read_csv("data/u.data", names=["user.id", "movie.id", "rate", "date"], sep='\t')
+def load_data(tiny=False, sparse=False):
+  # lecture des données brut (depuis le cache binaire)
+  data = load_ratings()
 
-  # mise sous forme de matice
-  n_user = max(data['user.id'])+1
-  n_movie = max(data['movie.id'])+1
-  rate = csr_matrix((data['rate'].astype(float), (data['user.id'], data['movie.id'])), shape=(n_user, n_movie)).toarray()
-  rate[rate==0] = np.nan
+  # mise sous forme de matice (creuse)
+  n_user = data['user'].max()+1
+  n_movie = data['item'].max()+1
+  rate = csr_matrix((data['rating'].astype(DTYPES["rating"]), (data['user'], data['item'])), shape=(n_user, n_movie))
   
   # réduction
-  if tiny:
-    rate = rate[:, :40]
-    ind_user = np.where(np.sum(~np.isnan(rate), axis=1) != 0)[0][:50]
-    rate = rate[ind_user, :]
-  else:
-    rate = rate[:, :400]
-    ind_user = np.where(np.sum(~np.isnan(rate), axis=1) != 0)[0][:500]
-    rate = rate[ind_user, :]
-  
-  return rate
+  n_keep_user, n_keep_movie = (50, 40) if tiny else (500, 400)
+  rate = rate[:, :n_keep_movie]
+  ind_user = np.where(rate.getnnz(axis=1) != 0)[0][:n_keep_user]
+  rate = rate[ind_user, :]
+
+  if sparse:
+    return SparseRatings(rate)
+  return SparseRatings(rate).to_dense()
 
 ##============================================
 # movie.title(id)
 ##============================================
+_TITLES = None
+_TITLES_STAMP = None  # version du fichier source des titres en mémoire (voir _source_stamp)
+
+def _movie_titles(source="data/u.item"):
+    # table des titres, lue depuis le cache binaire puis gardée en mémoire tant que le fichier source ne change pas
+    global _TITLES, _TITLES_STAMP
+    stamp = _source_stamp(source)
+    if _TITLES is None or stamp != _TITLES_STAMP:
+      def build():
+        data = pd.read_csv(source, names=["id", "title", "release.date", "video.release.date", "unknown", "Action", "Adventure", "Animation", "Children.s", "Comedy", "Crime", "Documentary", "Drama", "Fantasy", "Film.Noir", "Horror", "Musical", "Mystery", "Romance", "Sci.Fi", "Thriller", "War", "Western"], sep='|', encoding='latin1')
+        return {"title": data["title"].to_numpy(str)}
+      _TITLES = [str(title) for title in _cached_arrays(source, ["title"], build)["title"]]
+      _TITLES_STAMP = stamp
+    return _TITLES
+
 def movie_title(id):
-    data = pd.read_csv("data/u.item", names=["id", "title", "release.date", "video.release.date", "unknown", "Action", "Adventure", "Animation", "Children.s", "Comedy", "Crime", "Documentary", "Drama", "Fantasy", "Film.Noir", "Horror", "Musical", "Mystery", "Romance", "Sci.Fi", "Thriller", "War", "Western"], sep='|', encoding='latin1')
-    try:
-      return [data['title'][i] for i in id]
-    except TypeError as e:
-      if str(e).endswith('object is not iterable'):
-        return str(data['title'][id])
-      else:
-        raise e
+    titles = _movie_titles()
+    ids = np.atleast_1d(id)
+    if np.any(ids < 0):
+      # un indice négatif désignerait un film compté depuis la fin de la table
+      raise IndexError("Les identifiants de films doivent être positifs ou nuls.")
+    if np.ndim(id) == 0:
+      return titles[id]
+    return [titles[i] for i in id]
 
 
 
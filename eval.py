@@ -4,23 +4,43 @@
 ##============================================
 ##============================================
 
-# * get_train_val(M, prop=0_8)
+# * get_train_val(M, prop=0_8, random_state=None)
 # * RMSE(M_completed, M_star)
+# * precision_at_k, recall_at_k, ndcg_at_k, map_at_k, hit_rate_at_k(M_completed, M_star, k=10)
+# * ranking_metrics(M_completed, M_star, k=10) : toutes les métriques de classement en une passe
+# * evaluate(model, M_star, k=10, block_size=1024, user_ids=None) : métriques d'un modèle entraîné, par blocs d'utilisateurs
 # * quantitative_comparison(scoring_fn, M_star, recommmenders, prop=0_8, nrep=10)
+# * cross_validate(scoring_fns, M_star, recommenders, prop=0_8, nrep=10, seed=0, n_jobs=None, cache_dir=None)
+# * compare_dtypes(scoring_fns, M_star, recommenders, precisions=("double", "single"), **params)
+#
+# M, M_star, M_train et M_validation peuvent être des matrices pleines (NaN pour les valeurs manquantes)
+# ou des SparseRatings (voir data.py) ; les matrices complétées M_completed sont pleines.
 
 
 
+import hashlib
+import inspect
+import json
+import os
 import numpy as np
 from time import time
 import pandas as pd
-from scipy.stats import spearmanr
+from data import DTYPES, SparseRatings, dtypes
+from parallel import parallel_for
+from instrument import timed, timer
+from models import MODELS
 
 ##============================================
-## get_train_val(M, prop=0_8)
+## get_train_val(M, prop=0_8, random_state=None)
 ##============================================
-def get_train_val(M, prop=0.8):
+def get_train_val(M, prop=0.8, random_state=None):
+  # random_state : graine du tirage (None -> générateur global np.random, comme historiquement)
+  rng = np.random if random_state is None else np.random.RandomState(random_state)
+  if isinstance(M, SparseRatings):
+    return _get_train_val_sparse(M, prop, rng)
+
   n, m = M.shape
-  M_train = np.nan * np.ones((n, m), dtype=float)
+  M_train = np.nan * np.ones((n, m), dtype=M.dtype)
   M_validation = M.copy()
   
   for id_user in range(n):
@@ -28,69 +48,251 @@ def get_train_val(M, prop=0.8):
     if len(inds_star)==1:
       inds = inds_star
     else:
-      inds = np.random.choice(inds_star, max(1, int(prop*len(inds_star))), replace=False)
+      inds = rng.choice(inds_star, max(1, int(prop*len(inds_star))), replace=False)
     M_train[id_user, inds] = M[id_user, inds]
     M_validation[id_user, inds] = np.nan
   
   return (M_train, M_validation)
 
 
+def _get_train_val_sparse(M, prop, rng):
+  # même tirage que la version pleine, mais sur les notes observées uniquement
+  in_train = np.zeros(M.nnz, dtype=bool)
+  for id_user in range(M.shape[0]):
+    inds_star = M.row(id_user)[0]
+    if len(inds_star)==1:
+      inds = inds_star
+    else:
+      inds = rng.choice(inds_star, max(1, int(prop*len(inds_star))), replace=False)
+    in_train[M.csr.indptr[id_user] + np.searchsorted(inds_star, inds)] = True
+
+  users, items, rates = M.triplets()
+  M_train = SparseRatings.from_triplets(users[in_train], items[in_train], rates[in_train], M.shape)
+  M_validation = SparseRatings.from_triplets(users[~in_train], items[~in_train], rates[~in_train], M.shape)
+  return (M_train, M_validation)
+
+
+def _observed(M_star):
+  # positions (lignes, colonnes) et valeurs des notes observées, dans l'ordre ligne par ligne
+  if isinstance(M_star, SparseRatings):
+    return M_star.triplets()
+  users, items = np.where(~np.isnan(M_star))
+  return users, items, M_star[users, items]
+
+
+def _values(M_star, users, items):
+  # notes aux positions demandées, NaN si elles ne sont pas observées
+  if isinstance(M_star, SparseRatings):
+    return M_star.values(users, items)
+  return M_star[users, items]
+
+
 
 
 ##============================================
 ## RMSE(M_completed, M_star)
 ##============================================
+@timed("eval.RMSE")
 def RMSE(M_completed, M_star):
-  inds = ~np.isnan(M_star)
-  return np.sqrt(np.mean((M_completed[inds] - M_star[inds])**2))
+  users, items, rates = _observed(M_star)
+  return np.sqrt(np.mean((M_completed[users, items] - rates)**2))
 
 
 
 ##============================================
 ## MAE(M_completed, M_star)
 ##============================================
+@timed("eval.MAE")
 def MAE(M_completed, M_star):
-    inds = ~np.isnan(M_star)
-    return np.mean(np.abs(M_completed[inds] - M_star[inds]))
+    users, items, rates = _observed(M_star)
+    return np.mean(np.abs(M_completed[users, items] - rates))
+
+
+##============================================
+## Top-k et pertinence, pour tous les utilisateurs à la fois
+##============================================
+def _top_k(M_completed, k):
+    """
+    Les k films de meilleur score de chaque ligne (tableau n x k, du meilleur au moins bon) :
+    le même ensemble que np.argsort(M_completed[i, :])[-k:] (les NaN sont classés en tête, comme par np.argsort).
+    """
+    n, m = M_completed.shape
+    k = min(k, m)
+    if k <= 0:
+        return np.zeros((n, 0), dtype=int)
+    scores = np.where(np.isnan(M_completed), np.inf, M_completed)
+    top = np.argpartition(scores, m - k, axis=1)[:, m - k:]
+    values = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(values, axis=1, kind="stable")
+    top = np.take_along_axis(top, order, axis=1)
+
+    # si la k-ième valeur apparaît aussi hors des films retenus, le choix parmi les ex aequo est celui de np.argsort
+    threshold = np.take_along_axis(values, order[:, :1], axis=1)
+    ambiguous = np.sum(scores == threshold, axis=1) > np.sum(values == threshold, axis=1)
+    if np.any(ambiguous):
+        top[ambiguous] = np.argsort(M_completed[ambiguous], axis=1)[:, -k:]
+    return top[:, ::-1]
+
+
+def _relevance(M_completed, M_star, k):
+    # films recommandés pertinents (note positive dans M_star), tableau n x k dans l'ordre des recommandations,
+    # et nombre de films pertinents de chaque utilisateur
+    top = _top_k(M_completed, k)
+    relevant = _values(M_star, np.arange(top.shape[0])[:, None], top) > 0  # suppose que la valeur positive indique un item pertinent
+    users, _, rates = _observed(M_star)
+    n_relevant = np.bincount(users[rates > 0], minlength=M_star.shape[0])
+    return relevant, n_relevant
+
+
+##============================================
+## ranking_metrics(M_completed, M_star, k=10)
+##============================================
+@timed("eval.ranking_metrics")
+def ranking_metrics(M_completed, M_star, k=10):
+    """
+    Toutes les métriques de classement à partir d'un seul calcul des k meilleurs films :
+    precision@k, recall@k, ndcg@k, map@k et hit_rate@k (dictionnaire nom -> valeur).
+
+    ndcg, map et hit_rate sont moyennés sur les utilisateurs ayant au moins un film pertinent.
+    """
+    precision, ndcg, ap, hit, has_relevant = _ranking_terms(*_relevance(M_completed, M_star, k))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {
+            "precision@k": np.mean(precision),
+            "recall@k": np.mean(precision),
+            "ndcg@k": np.mean(ndcg[has_relevant]),
+            "map@k": np.mean(ap[has_relevant]),
+            "hit_rate@k": np.mean(hit[has_relevant]),
+        }
+
+
+def _ranking_terms(relevant, n_relevant):
+    # valeurs par utilisateur de precision@k, ndcg@k, map@k et hit_rate@k, et utilisateurs ayant un film pertinent
+    k = relevant.shape[1]
+    has_relevant = n_relevant > 0
+
+    # NDCG : gain 1 / log2(rang + 1), normalisé par le gain du classement idéal
+    discounts = 1 / np.log2(np.arange(2, k + 2))
+    dcg = relevant @ discounts
+    idcg = np.concatenate(([0], np.cumsum(discounts)))[np.minimum(n_relevant, k)]
+
+    # MAP : moyenne des précisions aux rangs des films pertinents
+    precisions = np.cumsum(relevant, axis=1) / np.arange(1, k + 1)
+    ap = np.sum(precisions * relevant, axis=1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.mean(relevant, axis=1), dcg / idcg, ap / np.minimum(n_relevant, k), np.any(relevant, axis=1), has_relevant
+
+
+##============================================
+## evaluate(model, M_star, k=10, block_size=1024, user_ids=None) / evaluate_blocks(blocks, M_star, k=10)
+##============================================
+@timed("eval.evaluate")
+def evaluate(model, M_star, k=10, block_size=1024, user_ids=None):
+    """
+    RMSE, MAE, métriques de classement (comme ranking_metrics) et couvertures d'un modèle entraîné (models.py)
+    sur M_star, sans construire la matrice complétée : les scores sont produits par blocs de `block_size`
+    utilisateurs (model.score_blocks) et aussitôt accumulés. La mémoire est celle d'un bloc (block_size x n_items),
+    quel que soit le nombre d'utilisateurs ; `block_size` règle le compromis entre mémoire et vitesse.
+    Avec user_ids, seuls ces utilisateurs sont évalués.
+    """
+    return evaluate_blocks(model.score_blocks(user_ids, block_size), M_star, k)
+
+
+def evaluate_blocks(blocks, M_star, k=10):
+    """
+    Même chose que `evaluate` pour des blocs de scores quelconques : itérable de (indices des utilisateurs, scores),
+    par exemple ceux de model.score_blocks ou des tranches de lignes d'une matrice complétée.
+    Retourne un dictionnaire nom -> valeur ; les valeurs sont celles de RMSE, MAE, ranking_metrics,
+    user_space_coverage et item_space_coverage calculées sur la matrice complétée.
+    """
+    sums = dict.fromkeys(["squared error", "absolute error", "ratings", "users", "relevant users",
+                          "precision", "ndcg", "ap", "hit", "covered users"], 0.0)
+    covered_items = np.zeros(M_star.shape[1], dtype=bool)
+    for user_ids, scores in blocks:
+        M_block = M_star.rows(user_ids) if isinstance(M_star, SparseRatings) else M_star[user_ids]
+
+        # erreurs sur les notes de M_star des utilisateurs du bloc
+        users, items, rates = _observed(M_block)
+        errors = scores[users, items] - rates
+        sums["squared error"] += np.sum(errors**2)
+        sums["absolute error"] += np.sum(np.abs(errors))
+        sums["ratings"] += len(rates)
+
+        # métriques de classement, sommées sur les utilisateurs (moyennées à la fin)
+        precision, ndcg, ap, hit, has_relevant = _ranking_terms(*_relevance(scores, M_block, k))
+        sums["users"] += len(user_ids)
+        sums["relevant users"] += np.sum(has_relevant)
+        sums["precision"] += np.sum(precision)
+        sums["ndcg"] += np.sum(ndcg[has_relevant])
+        sums["ap"] += np.sum(ap[has_relevant])
+        sums["hit"] += np.sum(hit[has_relevant])
+
+        known = ~np.isnan(scores)
+        sums["covered users"] += np.sum(np.any(known, axis=1))
+        covered_items |= np.any(known, axis=0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {
+            "RMSE": np.sqrt(sums["squared error"] / sums["ratings"]),
+            "MAE": sums["absolute error"] / sums["ratings"],
+            "precision@k": sums["precision"] / sums["users"],
+            "recall@k": sums["precision"] / sums["users"],
+            "ndcg@k": sums["ndcg"] / sums["relevant users"],
+            "map@k": sums["ap"] / sums["relevant users"],
+            "hit_rate@k": sums["hit"] / sums["relevant users"],
+            "user_space_coverage": sums["covered users"] / sums["users"],
+            "item_space_coverage": np.mean(covered_items),
+        }
 
 
 ##============================================
 ## Precision at k
 ##============================================
+@timed("eval.precision_at_k")
 def precision_at_k(M_completed, M_star, k=10):
     """
     Precision at k: proportion des recommandations pertinentes parmi les k premiers éléments recommandés.
     """
-    n, m = M_star.shape
-    precision_scores = []
-    for i in range(n):
-        # Top-K recommandations basées sur les prédictions
-        top_k_indices = np.argsort(M_completed[i, :])[-k:]
-        relevant_items = M_star[i, top_k_indices] > 0  # suppose que la valeur positive indique un item pertinent
-        precision_scores.append(np.mean(relevant_items))
-    return np.mean(precision_scores)
+    relevant, _ = _relevance(M_completed, M_star, k)
+    return np.mean(np.mean(relevant, axis=1))
 
 
 ##============================================
 ## Recall at k
 ##============================================
+@timed("eval.recall_at_k")
 def recall_at_k(M_completed, M_star, k=10):
     """
     Recall at k: proportion des éléments pertinents qui ont été recommandés parmi les k premiers.
+    (Calcul historique conservé : même valeur que precision_at_k, comme dans les résultats des notebooks.)
     """
-    n, m = M_star.shape
-    recall_scores = []
-    for i in range(n):
-        # Top-K recommandations basées sur les prédictions
-        top_k_indices = np.argsort(M_completed[i, :])[-k:]
-        relevant_items = M_star[i, :] > 0  # suppose que la valeur positive indique un item pertinent
-        recall_scores.append(np.mean(relevant_items[top_k_indices]))
-    return np.mean(recall_scores)
+    relevant, _ = _relevance(M_completed, M_star, k)
+    return np.mean(np.mean(relevant, axis=1))
+
+
+##============================================
+## NDCG, MAP et hit rate at k
+##============================================
+@timed("eval.ndcg_at_k")
+def ndcg_at_k(M_completed, M_star, k=10):
+    return ranking_metrics(M_completed, M_star, k)["ndcg@k"]
+
+
+@timed("eval.map_at_k")
+def map_at_k(M_completed, M_star, k=10):
+    return ranking_metrics(M_completed, M_star, k)["map@k"]
+
+
+@timed("eval.hit_rate_at_k")
+def hit_rate_at_k(M_completed, M_star, k=10):
+    return ranking_metrics(M_completed, M_star, k)["hit_rate@k"]
 
 
 ##============================================
 ## User-space Coverage
 ##============================================
+@timed("eval.user_space_coverage")
 def user_space_coverage(M_completed, M_star):
     n, m = M_star.shape
     recommended_users = np.sum(~np.isnan(M_completed), axis=1) > 0
@@ -100,6 +302,7 @@ def user_space_coverage(M_completed, M_star):
 ##============================================
 ## Item-space Coverage
 ##============================================
+@timed("eval.item_space_coverage")
 def item_space_coverage(M_completed, M_star):
     n, m = M_star.shape
     recommended_items = np.sum(~np.isnan(M_completed), axis=0) > 0
@@ -109,19 +312,23 @@ def item_space_coverage(M_completed, M_star):
 ##============================================
 ## Ranking based on predicted vs actual ratings
 ##============================================
-def ranking_based_on_ratings(M_completed, M_star):
+@timed("eval.ranking_based_on_ratings")
+def ranking_based_on_ratings(M_completed, M_star, block_size=1024):
     """
     Measure la corrélation entre les classements prédit et réels en utilisant le coefficient de Spearman.
+    Les lignes sont traitées par blocs de `block_size` : un SparseRatings n'est densifié qu'un bloc à la fois.
     """
+    # les classements (permutations sans ex aequo) sont calculés pour toutes les lignes d'un bloc à la fois ;
+    # le coefficient de Spearman de deux permutations vaut 1 - 6 sum(d²) / (m (m² - 1))
     n, m = M_star.shape
-    correlation_scores = []
-    for i in range(n):
-        # Classement des éléments en fonction des évaluations prédites et réelles
-        pred_ranks = np.argsort(M_completed[i, :])
-        true_ranks = np.argsort(M_star[i, :])
-        correlation, _ = spearmanr(pred_ranks, true_ranks)
-        correlation_scores.append(correlation)
-    return np.mean(correlation_scores)
+    d2 = np.zeros(n)
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        M_block = M_star.rows(np.arange(start, stop)).to_dense() if isinstance(M_star, SparseRatings) else M_star[start:stop]
+        pred_ranks = np.argsort(M_completed[start:stop], axis=1)
+        true_ranks = np.argsort(M_block, axis=1)  # notes manquantes (NaN) en fin de classement
+        d2[start:stop] = np.sum((pred_ranks - true_ranks).astype(float)**2, axis=1)
+    return np.mean(1 - 6 * d2 / (m * (m**2 - 1)))
 ##============================================
 ## quantitative_comparison(scoring_fn, M_star, recommmenders, prop=0_8, nrep=10)
 ##============================================
@@ -148,4 +355,170 @@ def quantitative_comparison(scoring_fn, M_star, recommenders, prop=0.8, nrep=10)
           })
 
 
+##============================================
+## cross_validate(scoring_fns, M_star, recommenders, prop=0_8, nrep=10, seed=0, n_jobs=None, cache_dir=None)
+##============================================
+def cross_validate(scoring_fns, M_star, recommenders, prop=0.8, nrep=10, seed=0, n_jobs=None, cache_dir=None):
+  """
+  Même comparaison que quantitative_comparison, pour plusieurs métriques à la fois :
+  - les nrep découpages train/validation sont tirés avec les graines seed, seed + 1, ... (reproductibles),
+    et partagés par tous les recommandeurs ;
+  - chaque recommandeur est entraîné une seule fois par découpage, toutes les métriques sont calculées sur cette complétion ;
+  - les couples (découpage, recommandeur) sont répartis entre n_jobs processus (voir parallel.py) ;
+  - chaque découpage a sa propre graine (`_job_seed`, tirée de seed + id_rep), transmise en paramètre random_state
+    aux modèles qui en ont un (ALS par exemple) quand params ne la fixe pas ; le générateur global np.random est
+    réinitialisé avec cette graine avant une fonction 'fn'. Les résultats ne dépendent donc ni de n_jobs, ni du
+    worker qui a traité le couple ;
+  - avec cache_dir, les matrices complétées sont enregistrées sur disque, sous une clé (algorithme, paramètres, découpage) :
+    une nouvelle exécution ne recalcule que ce qui manque.
+
+  Un recommandeur est un dictionnaire {'fn': M_train -> M_completed, 'label': ...} comme pour quantitative_comparison,
+  ou {'model': nom dans models.MODELS, 'params': {...}, 'label': ...}. Seuls ces derniers (ou ceux qui donnent
+  une clé explicite 'key') sont mis en cache : une fonction anonyme ne permet pas de savoir ce qu'elle calcule.
+
+  Retourne un DataFrame avec une ligne par recommandeur : colonnes "<métrique> (validation)", "<métrique> (training)"
+  (moyennes sur les découpages), "computation time" (temps d'entraînement moyen, mesuré lors du premier calcul)
+  et "memory (MB)" (taille des tableaux appris par le modèle et de la matrice complétée, voir `_nbytes`).
+  """
+  splits = [get_train_val(M_star, prop, random_state=seed + id_rep) for id_rep in range(nrep)]
+  split_keys = [_split_key(M_train, M_validation) for M_train, M_validation in splits]
+  job_seeds = [_job_seed(seed + id_rep) for id_rep in range(nrep)]
+  jobs = [(id_rep, id_rec) for id_rep in range(nrep) for id_rec in range(len(recommenders))]
+
+  def run(start, stop):
+    results = []
+    for id_rep, id_rec in jobs[start:stop]:
+      M_train, M_validation = splits[id_rep]
+      M_completed, computation_time, memory = _completed(recommenders[id_rec], M_train, split_keys[id_rep], cache_dir,
+                                                         job_seeds[id_rep])
+      results.append(([scoring_fn(M_completed, M_validation) for scoring_fn in scoring_fns],
+                      [scoring_fn(M_completed, M_train) for scoring_fn in scoring_fns],
+                      computation_time, memory))
+    return results
+
+  results = [result for chunk in parallel_for(run, len(jobs), n_jobs, chunk_size=1) for result in chunk]
+
+  scores = np.array([result[0] for result in results]).reshape(nrep, len(recommenders), len(scoring_fns))
+  scores_train = np.array([result[1] for result in results]).reshape(nrep, len(recommenders), len(scoring_fns))
+  computation_time = np.array([result[2] for result in results]).reshape(nrep, len(recommenders))
+  memory = np.array([result[3] for result in results]).reshape(nrep, len(recommenders))
+
+  df = pd.DataFrame({'recommender': [rec['label'] for rec in recommenders]})
+  for id_fn, scoring_fn in enumerate(scoring_fns):
+    df[f'{scoring_fn.__name__} (validation)'] = np.mean(scores[:, :, id_fn], axis=0)
+    df[f'{scoring_fn.__name__} (training)'] = np.mean(scores_train[:, :, id_fn], axis=0)
+  df['computation time'] = np.mean(computation_time, axis=0)
+  df['memory (MB)'] = np.mean(memory, axis=0) / 2**20
+  return df
+
+
+##============================================
+## compare_dtypes(scoring_fns, M_star, recommenders, precisions=("double", "single"), **params)
+##============================================
+def compare_dtypes(scoring_fns, M_star, recommenders, precisions=("double", "single"), **params):
+  """
+  Effet de la politique de types (data.PRECISIONS) : cross_validate est relancé sous chaque précision
+  (mêmes découpages, `params` transmis à cross_validate), les tableaux sont concaténés avec une colonne "precision".
+  Les métriques (RMSE, MAE, ...), le temps et la mémoire se comparent alors ligne à ligne.
+  """
+  frames = []
+  for precision in precisions:
+    with dtypes(precision):
+      df = cross_validate(scoring_fns, M_star, recommenders, **params)
+    df.insert(1, 'precision', precision)
+    frames.append(df)
+  return pd.concat(frames, ignore_index=True)
+
+
+def _job_seed(split_seed):
+  # graine des modèles entraînés sur le découpage tiré avec split_seed (flux distinct de celui du découpage)
+  return int(np.random.SeedSequence(split_seed).generate_state(1)[0])
+
+
+def _seeded(rec, random_state):
+  # recommandeur dont le modèle reçoit random_state, s'il a ce paramètre et qu'il n'est pas déjà fixé
+  if 'model' not in rec or 'random_state' in rec.get('params', {}):
+    return rec
+  if 'random_state' not in inspect.signature(MODELS[rec['model']]).parameters:
+    return rec
+  return {**rec, 'params': {**rec.get('params', {}), 'random_state': random_state}}
+
+
+def _split_key(M_train, M_validation):
+  # empreinte du découpage : les notes d'apprentissage et de validation elles-mêmes
+  digest = hashlib.sha1()
+  for M in (M_train, M_validation):
+    users, items, rates = _observed(M)
+    for array in (np.asarray(M.shape), users, items, rates):
+      digest.update(np.ascontiguousarray(array, dtype=np.float64).tobytes())
+  return digest.hexdigest()
+
+
+def _recommender_key(rec):
+  # clé de cache d'un recommandeur, None s'il ne peut pas être identifié
+  if 'key' in rec:
+    return str(rec['key'])
+  if 'model' in rec:
+    # les fonctions passées en paramètre (replaceNA_fn par exemple) sont identifiées par leur nom
+    # la politique de types fait partie de la clé : une complétion en float32 n'est pas celle en float64
+    return json.dumps([rec['model'], rec.get('params', {}), {name: np.dtype(dtype).name for name, dtype in DTYPES.items()}],
+                      sort_keys=True, default=lambda value: getattr(value, '__qualname__', repr(value)))
+  return None
+
+
+def _nbytes(value):
+  # taille en octets des tableaux (numpy ou creux) d'un objet, d'une liste ou d'un dictionnaire, parcourus récursivement
+  if isinstance(value, np.ndarray):
+    return value.nbytes
+  if hasattr(value, 'nnz') and hasattr(value, 'data'):
+    return sum(getattr(value, name).nbytes for name in ('data', 'indices', 'indptr', 'row', 'col') if hasattr(value, name))
+  if isinstance(value, dict):
+    return sum(_nbytes(item) for item in value.values())
+  if isinstance(value, (list, tuple)):
+    return sum(_nbytes(item) for item in value)
+  if hasattr(value, '__dict__'):
+    return _nbytes(vars(value))
+  return 0
+
+
+def _completed(rec, M_train, split_key, cache_dir, random_state=None):
+  # matrice complétée par le recommandeur sur M_train, lue dans le cache si elle y est ; renvoie aussi le temps de calcul
+  # random_state : graine du calcul (voir cross_validate), partie de la clé de cache
+  rec = _seeded(rec, random_state)
+  rec_key = _recommender_key(rec)
+  path = None
+  if cache_dir is not None and rec_key is not None:
+    path = os.path.join(cache_dir, hashlib.sha1((rec_key + split_key + repr(random_state)).encode()).hexdigest())
+    try:
+      with open(path + ".json") as f:
+        meta = json.load(f)
+      return np.load(path + ".npy"), meta['computation time'], meta['memory']
+    except (OSError, ValueError, KeyError):
+      pass
+
+  ptm = time()
+  with timer("eval.completion"):
+    if 'model' in rec:
+      model = MODELS[rec['model']](**rec.get('params', {})).fit(M_train)
+      M_completed = model.complete()
+    else:
+      model = None
+      if random_state is not None:
+        np.random.seed(random_state)
+      M_completed = rec['fn'](M_train)
+  computation_time = time() - ptm
+  # mémoire : état appris par le modèle (sans les notes d'apprentissage, communes à tous) et matrice complétée
+  memory = _nbytes({name: value for name, value in vars(model).items() if name != 'R_'} if model is not None else None)
+  memory += M_completed.nbytes
 
+  if path is not None:
+    # écriture dans des fichiers temporaires renommés ensuite : un autre processus ne lit jamais un fichier incomplet,
+    # et le .json (écrit en dernier) n'existe que si le .npy est complet
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    np.save(tmp + ".npy", M_completed)
+    os.replace(tmp + ".npy", path + ".npy")
+    with open(tmp + ".json", "w") as f:
+      json.dump({'recommender': rec_key, 'computation time': computation_time, 'memory': memory}, f)
+    os.replace(tmp + ".json", path + ".json")
+  return M_completed, computation_time, memory
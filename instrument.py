@@ -0,0 +1,141 @@
+##============================================
+##============================================
+## instrumentation des étapes coûteuses (chronomètres et compteurs)
+##============================================
+##============================================
+
+# * profiling()                     : active la collecte dans un bloc `with`, renvoie le Profile rempli
+# * timer(name)                     : chronomètre un bloc `with timer("als.iteration"): ...`
+# * timed(name)                     : décorateur, chronomètre chaque appel de la fonction
+# * count(name, n=1)                : compteur
+# * record(name, value)             : série de valeurs (perte ALS à chaque itération, ...)
+#
+# Les modules appellent ces fonctions à leurs étapes principales (noms "<module>.<étape>") :
+#   knn.similarity, knn.sort_neighbors, knn.weighted_sum, knn.ties (+ compteurs knn.users, knn.tie_items)
+#   als.solve_users, als.solve_items, als.iteration (+ séries als.loss, als.objective, als.iteration_time)
+#   svd.imputation, svd.decomposition, svd.reconstruction
+#   eval.RMSE, eval.MAE, eval.ranking_metrics, ...
+#
+# Hors d'un bloc `profiling()`, timer renvoie un contexte vide partagé et count / record ne font qu'un test :
+# le coût est de l'ordre de la centaine de nanosecondes par appel, négligeable devant les étapes mesurées.
+# Les workers créés par parallel_for (processus) ont leur propre copie du Profile : seules les étapes exécutées
+# dans le processus principal sont comptées.
+#
+#   with profiling() as prof:
+#     als.complete(M_train, k=10)
+#   prof.to_frame()         # une ligne par étape : appels, temps total, temps moyen
+#   prof.report()           # même contenu en dictionnaire (sérialisable en JSON, voir benchmark.py)
+
+
+from contextlib import contextmanager
+from functools import wraps
+from time import perf_counter
+import pandas as pd
+
+
+##============================================
+## Profile : mesures collectées
+##============================================
+class Profile:
+  """Temps cumulés et nombres d'appels par étape, compteurs et séries de valeurs."""
+
+  def __init__(self):
+    self.timers = {}    # nom -> [temps total (s), nombre d'appels]
+    self.counters = {}  # nom -> total
+    self.series = {}    # nom -> liste de valeurs
+
+  def add_time(self, name, seconds):
+    timer = self.timers.setdefault(name, [0.0, 0])
+    timer[0] += seconds
+    timer[1] += 1
+
+  def report(self):
+    """Dictionnaire {"timers": {nom: {"total (s)", "calls"}}, "counters": {...}, "series": {...}}, sérialisable en JSON."""
+    return {
+      "timers": {name: {"total (s)": total, "calls": calls} for name, (total, calls) in self.timers.items()},
+      "counters": dict(self.counters),
+      "series": {name: [float(value) for value in values] for name, values in self.series.items()},
+    }
+
+  def to_frame(self):
+    """Une ligne par étape chronométrée, par temps total décroissant."""
+    df = pd.DataFrame([{"stage": name, "calls": calls, "total (s)": total, "mean (s)": total / calls}
+                       for name, (total, calls) in self.timers.items()],
+                      columns=["stage", "calls", "total (s)", "mean (s)"])
+    return df.sort_values("total (s)", ascending=False, ignore_index=True)
+
+
+_PROFILE = None  # Profile en cours de collecte, None si l'instrumentation est désactivée
+
+
+##============================================
+## profiling()
+##============================================
+@contextmanager
+def profiling():
+  """Active l'instrumentation dans le bloc ; un bloc imbriqué collecte ses propres mesures (sans les remonter)."""
+  global _PROFILE
+  previous, _PROFILE = _PROFILE, Profile()
+  try:
+    yield _PROFILE
+  finally:
+    _PROFILE = previous
+
+
+##============================================
+## timer(name), timed(name), count(name, n=1), record(name, value)
+##============================================
+class _Timer:
+  __slots__ = ("profile", "name", "start")
+
+  def __init__(self, profile, name):
+    self.profile, self.name = profile, name
+
+  def __enter__(self):
+    self.start = perf_counter()
+    return self
+
+  def __exit__(self, *exc):
+    self.profile.add_time(self.name, perf_counter() - self.start)
+
+
+class _NullTimer:
+  __slots__ = ()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    pass
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(name):
+  """Contexte chronométrant son bloc sous le nom `name` (sans effet hors de `profiling()`)."""
+  return _NULL_TIMER if _PROFILE is None else _Timer(_PROFILE, name)
+
+
+def timed(name):
+  """Décorateur : chaque appel de la fonction est chronométré sous le nom `name`."""
+  def decorator(fn):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+      if _PROFILE is None:
+        return fn(*args, **kwargs)
+      with _Timer(_PROFILE, name):
+        return fn(*args, **kwargs)
+    return wrapper
+  return decorator
+
+
+def count(name, n=1):
+  """Ajoute n au compteur `name`."""
+  if _PROFILE is not None:
+    _PROFILE.counters[name] = _PROFILE.counters.get(name, 0) + n
+
+
+def record(name, value):
+  """Ajoute `value` à la série `name`."""
+  if _PROFILE is not None:
+    _PROFILE.series.setdefault(name, []).append(value)
@@ -1,4 +1,8 @@
 import numpy as np  # Importation de la bibliothèque NumPy pour la manipulation des tableaux et calculs mathématiques
+from scipy.sparse import csr_matrix
+from data import DTYPES, as_sparse
+from parallel import effective_n_jobs, parallel_for, shared_empty
+from instrument import count, timed, timer
 
 #============================================
 # Filtrage collaboratif basé sur les utilisateurs (User-Based Collaborative Filtering)
@@ -32,42 +36,116 @@ def cosinus(M_train, u1, u2):
     else:
         return 0  # Retourne 0 si aucun film en commun
 
+#============================================
+# Fonction similarity_matrix(M_train, users=None)
+#============================================
+def similarity_matrix(M_train, users=None):
+    """
+    Calcule d'un coup les similarités cosinus entre les utilisateurs `users` (tous par défaut) et tous les utilisateurs.
+    Même sémantique que `cosinus` : seuls les films notés par les deux utilisateurs comptent,
+    et la similarité vaut 0 s'il n'y a aucun film en commun.
+    M_train peut être une matrice pleine (NaN pour les valeurs manquantes) ou un SparseRatings.
+    """
+    num, sq1, sq2 = similarity_sums(M_train, users)
+    return _cosine(num, sq1, sq2)
+
+@timed("knn.similarity")
+def similarity_sums(M_train, users=None):
+    """
+    Sommes dont se déduisent les similarités (voir `similarity_matrix`), pour les utilisateurs `users` (tous par défaut) :
+    num[a, b] = somme des r_a r_b, sq1[a, b] = somme des r_a², sq2[a, b] = somme des r_b², sur les films notés par a et b.
+    Ces sommes peuvent être mises à jour note par note (voir models.KNNRecommender.update).
+    """
+    R = as_sparse(M_train)
+    if users is None:
+        users = np.arange(R.shape[0])
+    # Notes observées et masque (produits creux), dans le type des similarités
+    rates, known = R.csr.astype(DTYPES["factor"], copy=False), R.mask.astype(DTYPES["factor"])
+    rates_sq = rates.power(2)
+
+    # Produit scalaire restreint aux films notés en commun
+    num = (rates[users] @ rates.T).toarray()
+    # Sommes des carrés des notes de chaque utilisateur, restreintes aux films notés par l'autre
+    sq1 = (rates_sq[users] @ known.T).toarray()
+    sq2 = (known[users] @ rates_sq.T).toarray()
+    return num, sq1, sq2
+
+def _cosine(num, sq1, sq2):
+    norm = np.sqrt(sq1) * np.sqrt(sq2)
+    return np.divide(num, norm, out=np.zeros_like(num), where=norm != 0)
+
 #============================================
 # Fonction complete_a_user_knn(M_train, id_user, k)
 #============================================
-def complete_a_user(M_train, id_user, k):
+def complete_a_user(M_train, id_user, k, sims=None):
     """
     Complète les notes manquantes d'un utilisateur en utilisant la moyenne pondérée des k plus proches voisins.
+    `sims` est la matrice renvoyée par `similarity_matrix` ; seule la ligne de l'utilisateur est calculée si elle n'est pas fournie.
     """
-    scores = np.zeros(M_train.shape[1])  # Initialisation du tableau des scores
-    
-    for id_item in range(M_train.shape[1]):  # Parcours de tous les films
-        inds_known = np.where(~np.isnan(M_train[:, id_item]))[0]  # Utilisateurs ayant noté ce film
-        
-        if np.isnan(M_train[id_user, id_item]):  # Vérifie si l'utilisateur n'a pas noté ce film
-            if len(inds_known) > 0:
-                # Calcul des similarités cosinus avec les utilisateurs ayant noté ce film
-                sims = np.array([cosinus(M_train, id_user, u) for u in inds_known])
-                
-                if len(inds_known) > k:
-                    ind = np.argsort(-sims)  # Trie les similarités par ordre décroissant
-                    inds_known = inds_known[ind][:k]  # Sélection des k plus proches voisins
-                    sims = sims[ind][:k]
-                
-                if sum(abs(sims)) != 0:  # Vérifie si les similarités ne sont pas nulles
-                    rates = M_train[inds_known, id_item]  # Notes des k voisins pour ce film
-                    mean_rates = np.nanmean(M_train[inds_known, :], axis=1)  # Moyenne des notes des voisins
-                    
-                    # Prédiction de la note en utilisant une moyenne pondérée par la similarité
-                    scores[id_item] = np.nanmean(M_train[id_user, :]) + np.sum(sims * (rates - mean_rates)) / sum(abs(sims))
-                else:
-                    scores[id_item] = np.nanmean(M_train[id_user, :])  # Sinon, moyenne des notes de l'utilisateur
-            else:
-                scores[id_item] = np.nanmean(M_train[id_user, :])  # Si aucun voisin, moyenne des notes connues
-        else:
-            scores[id_item] = M_train[id_user, id_item]  # Si l'utilisateur a déjà noté le film, on garde la note existante
-    
-    return scores  # Retourne les scores prédits
+    R = as_sparse(M_train)
+    sims_user = similarity_matrix(R, [id_user])[0] if sims is None else sims[id_user]
+    mean_users = R.user_means()  # Moyenne des notes de chaque utilisateur
+    return _complete_a_user(R, id_user, k, sims_user, mean_users, _deviations(R, mean_users))
+
+def _deviations(R, mean_users):
+    # Écarts des notes observées à la moyenne de l'utilisateur, dans l'ordre CSR
+    users, _, rates = R.triplets()
+    return (rates - mean_users[users]).astype(rates.dtype, copy=False)
+
+def _complete_a_user(R, id_user, k, sims_user, mean_users, deviations):
+    return _complete_a_user_ks(R, id_user, [k], sims_user, mean_users, deviations)[0]
+
+def _complete_a_user_ks(R, id_user, ks, sims_user, mean_users, deviations):
+    # Scores de l'utilisateur pour chaque nombre de voisins de `ks` : le tri des voisins est commun,
+    # chaque k ne retient que le début (les k premiers) de la liste triée de chaque film
+    n_items = R.shape[1]
+
+    # Les voisins sont classés une seule fois par similarité décroissante (à égalité, par indice croissant).
+    # En rangeant les lignes dans cet ordre puis en passant en CSC, les notes de chaque film apparaissent
+    # de la plus proche à la plus lointaine : les k voisins retenus sont les k premières de chaque colonne.
+    count("knn.users")
+    with timer("knn.sort_neighbors"):
+        order = np.argsort(-sims_user, kind="stable")
+        sims_sorted = sims_user[order]
+        entries = csr_matrix((np.arange(1, R.nnz + 1), R.csr.indices, R.csr.indptr), shape=R.shape)[order].tocsc()
+        item_of_entry = np.repeat(np.arange(n_items), np.diff(entries.indptr))
+        rank = np.arange(entries.nnz) - entries.indptr[item_of_entry]
+
+    rated_items, rated_rates = R.row(id_user)
+    unknown = np.ones(n_items, dtype=bool)
+    unknown[rated_items] = False
+
+    all_scores = []
+    for k in ks:
+        selected = rank < k
+
+        # Somme pondérée des écarts des voisins retenus et somme des |similarités|, pour tous les films à la fois
+        with timer("knn.weighted_sum"):
+            sims_entry = sims_sorted[entries.indices[selected]]
+            num = np.bincount(item_of_entry[selected], weights=sims_entry * deviations[entries.data[selected] - 1], minlength=n_items)
+            den = np.bincount(item_of_entry[selected], weights=np.abs(sims_entry), minlength=n_items)
+
+        # Si la similarité du k-ième voisin est égale à celle du suivant, l'ensemble des k voisins dépend de l'ordre
+        # du tri : pour ces films on reprend le tri de la version film par film afin d'obtenir exactement le même résultat.
+        ties = np.where(unknown & (np.diff(entries.indptr) > k))[0]
+        ties = ties[sims_sorted[entries.indices[entries.indptr[ties] + k - 1]] == sims_sorted[entries.indices[entries.indptr[ties] + k]]]
+        count("knn.tie_items", len(ties))
+        with timer("knn.ties"):
+            for id_item in ties:
+                inds_known, rates = R.col(id_item)
+                sims = sims_user[inds_known]
+                ind = np.argsort(-sims)[:k]
+                num[id_item] = np.sum(sims[ind] * (rates[ind] - mean_users[inds_known[ind]]))
+                den[id_item] = sum(abs(sims[ind]))
+
+        scores = np.full(n_items, mean_users[id_user], dtype=deviations.dtype)  # Par défaut, moyenne des notes de l'utilisateur
+        has_neighbors = den != 0
+        scores[has_neighbors] += num[has_neighbors] / den[has_neighbors]
+
+        # Si l'utilisateur a déjà noté le film, on garde la note existante
+        scores[rated_items] = rated_rates
+        all_scores.append(scores)
+    return all_scores  # Scores prédits, un tableau par valeur de k
 
 #============================================
 # Fonction recommend(M_train, id_user, new=True, k=10)
@@ -79,7 +157,7 @@ def recommend(M_train, id_user, new=True, k=10):
     scores = complete_a_user(M_train, id_user, k)  # Complète les notes de l'utilisateur
     
     if new:
-        inds_unknown = np.where(np.isnan(M_train[id_user, :]))[0]  # Films non notés par l'utilisateur
+        inds_unknown = np.where(np.isnan(as_sparse(M_train).dense_row(id_user)))[0]  # Films non notés par l'utilisateur
         rec_ind_in_unknown = np.argmax(scores[inds_unknown])  # Sélection du meilleur score parmi ces films
         return inds_unknown[rec_ind_in_unknown]
     else:
@@ -88,14 +166,38 @@ def recommend(M_train, id_user, new=True, k=10):
 #============================================
 # Fonction complete(M_train, k)
 #============================================
-def complete(M_train, k):
+def complete(M_train, k, n_jobs=None):
     """
     Complète toute la matrice des évaluations en prédisant toutes les notes manquantes.
+    Avec `n_jobs`, les utilisateurs sont répartis entre plusieurs workers (voir parallel.py).
     """
-    M_completed = np.zeros(M_train.shape)  # Initialisation de la matrice complétée
-    
-    for id_user in range(M_train.shape[0]):  # Parcours de tous les utilisateurs
-        M_completed[id_user, :] = complete_a_user(M_train, id_user, k)  # Complète leurs notes
-    
-    return M_completed  # Retourne la matrice complétée
+    return complete_ks(M_train, [k], n_jobs)[0]  # Retourne la matrice complétée
 
+#============================================
+# Fonction complete_ks(M_train, ks)
+#============================================
+def complete_ks(M_train, ks, n_jobs=None):
+    """
+    Matrices complétées pour plusieurs nombres de voisins `ks` à la fois (une par valeur, dans l'ordre de ks),
+    identiques à `complete(M_train, k)` pour chaque k : similarités, moyennes et tri des voisins de chaque utilisateur
+    ne sont calculés qu'une fois. Utilisé par sweep.py ; la mémoire est celle de len(ks) matrices complétées.
+    """
+    R = as_sparse(M_train)  # M_train peut être une matrice pleine ou un SparseRatings
+    n_workers = effective_n_jobs(n_jobs)
+    # Initialisation des matrices complétées (en mémoire partagée si des workers y écrivent)
+    M_completed = [np.zeros(R.shape) if n_workers == 1 else shared_empty(R.shape) for _ in ks]
+
+    # Les similarités, moyennes et écarts sont calculés une seule fois pour tous les utilisateurs
+    sims = similarity_matrix(R)
+    mean_users = R.user_means()
+    deviations = _deviations(R, mean_users)
+
+    def complete_users(start, stop):
+        for id_user in range(start, stop):  # Parcours des utilisateurs de la tranche
+            # Complète leurs notes pour chaque k
+            for M, scores in zip(M_completed, _complete_a_user_ks(R, id_user, ks, sims[id_user], mean_users, deviations)):
+                M[id_user, :] = scores
+
+    parallel_for(complete_users, R.shape[0], n_jobs, chunk_size=max(1, R.shape[0] // (4 * n_workers)))
+    
+    return M_completed
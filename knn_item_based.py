@@ -1,4 +1,7 @@
 import numpy as np
+from knn import similarity_matrix
+from data import as_sparse
+from parallel import effective_n_jobs, parallel_for, shared_empty
 
 ##============================================
 ## cosinus_items(M_train, i1, i2)
@@ -15,43 +18,144 @@ def cosinus_items(M_train, i1, i2):
     else:
         return 0
 
+##============================================
+## build_item_index(M_train, n_neighbors=None)
+##============================================
+def build_item_index(M_train, n_neighbors=None):
+    """
+    Construit une seule fois l'index des similarités entre films.
+    Pour chaque film, les voisins (autres films de similarité non nulle) sont rangés par similarité
+    décroissante, à égalité par indice croissant, et éventuellement tronqués aux `n_neighbors` premiers.
+    L'index est stocké au format CSR : les voisins du film i sont `neighbors[indptr[i]:indptr[i+1]]`,
+    de similarités `sims[indptr[i]:indptr[i+1]]`.
+    Les notes étant positives, les similarités sont positives : ne pas garder les similarités nulles
+    ne change pas les prédictions. Avec `n_neighbors=None`, les prédictions sont celles du calcul exhaustif.
+    M_train peut être une matrice pleine (NaN pour les valeurs manquantes) ou un SparseRatings.
+    """
+    R = as_sparse(M_train)
+    sims_items = similarity_matrix(R.T)  # Même sémantique que cosinus_items
+    np.fill_diagonal(sims_items, 0)  # Un film n'est pas son propre voisin
+    return index_from_similarities(sims_items, n_neighbors)
+
+def index_from_similarities(sims_items, n_neighbors=None):
+    """Index des voisins (voir `build_item_index`) à partir de la matrice n_items x n_items des similarités (diagonale nulle)."""
+    counts, neighbors, sims = _neighbor_lists(sims_items, n_neighbors)
+    return {
+        "indptr": np.concatenate(([0], np.cumsum(counts))).astype(np.int64),
+        "neighbors": neighbors,
+        "sims": sims,
+        "n_items": sims_items.shape[0],
+        "n_neighbors": -1 if n_neighbors is None else n_neighbors,
+    }
+
+def update_item_index(index, sims_items, items):
+    """
+    Index mis à jour après un changement des lignes `items` de la matrice des similarités `sims_items`
+    (éventuellement agrandie : nouveaux films). Seules les listes de ces films sont triées à nouveau,
+    les autres sont recopiées telles quelles.
+    """
+    n_items, n_old = sims_items.shape[0], index["n_items"]
+    items = np.unique(items)
+    n_neighbors = None if index["n_neighbors"] == -1 else index["n_neighbors"]
+    new_counts, new_neighbors, new_sims = _neighbor_lists(sims_items[items], n_neighbors)
+
+    old_indptr = index["indptr"]
+    counts = np.zeros(n_items, dtype=np.int64)
+    counts[:n_old] = np.diff(old_indptr)
+    counts[items] = new_counts
+    indptr = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+    neighbors = np.empty(indptr[-1], dtype=np.int32)
+    sims = np.empty(indptr[-1], dtype=new_sims.dtype)
+
+    # Listes inchangées : même position relative dans la liste du film, nouveau début de liste
+    old_item = np.repeat(np.arange(n_old), np.diff(old_indptr))
+    kept = ~np.isin(old_item, items)
+    positions = indptr[old_item[kept]] + np.arange(len(old_item))[kept] - old_indptr[old_item[kept]]
+    neighbors[positions], sims[positions] = index["neighbors"][kept], index["sims"][kept]
+    # Listes recalculées
+    new_item = np.repeat(items, new_counts)
+    starts = np.concatenate(([0], np.cumsum(new_counts)))[:-1]
+    positions = indptr[new_item] + np.arange(len(new_item)) - np.repeat(starts, new_counts)
+    neighbors[positions], sims[positions] = new_neighbors, new_sims
+    return {**index, "indptr": indptr, "neighbors": neighbors, "sims": sims, "n_items": n_items}
+
+def _neighbor_lists(sims_rows, n_neighbors):
+    # Pour chaque ligne : voisins par similarité décroissante (à égalité par indice croissant), similarités nulles
+    # écartées, tronqués aux n_neighbors premiers. Renvoie (nombre de voisins par ligne, voisins, similarités).
+    order = np.argsort(-sims_rows, axis=1, kind="stable")
+    sims_sorted = np.take_along_axis(sims_rows, order, axis=1)
+    keep = sims_sorted != 0
+    if n_neighbors is not None:
+        keep[:, n_neighbors:] = False
+    return np.sum(keep, axis=1), order[keep].astype(np.int32), sims_sorted[keep]
+
+##============================================
+## save_item_index(index, path) / load_item_index(path)
+##============================================
+def save_item_index(index, path):
+    """Sauvegarde l'index (fichier .npz) pour ne pas le reconstruire à chaque requête."""
+    np.savez(path, **index)
+
+def load_item_index(path):
+    with np.load(path) as f:
+        index = {key: f[key] for key in f.files}
+    index["n_items"] = int(index["n_items"])
+    index["n_neighbors"] = int(index["n_neighbors"])
+    return index
+
 ##============================================
 ## complete_a_user_item_based(M_train, id_user, k)
 ##============================================
-def complete_a_user_item_based(M_train, id_user, k):
-    scores = np.zeros(M_train.shape[1])
-    for id_item in range(M_train.shape[1]):
-        if np.isnan(M_train[id_user, id_item]):
-            # Films notés par l'utilisateur
-            inds_known = np.where(~np.isnan(M_train[id_user, :]))[0]
-            if len(inds_known) > 0:
-                # Similarité entre le film cible et les films notés
-                sims = np.array([cosinus_items(M_train, id_item, i) for i in inds_known])
-                
-                if len(inds_known) > k:
-                    ind = np.argsort(-sims)  # Tri décroissant
-                    inds_known = inds_known[ind][:k]
-                    sims = sims[ind][:k]
-                
-                if sum(abs(sims)) != 0:
-                    rates = M_train[id_user, inds_known]
-                    scores[id_item] = np.sum(sims * rates) / sum(abs(sims))
-                else:
-                    scores[id_item] = np.nanmean(M_train[id_user, :])  # Moyenne si pas de similarité
-            else:
-                scores[id_item] = np.nanmean(M_train[id_user, :])  # Moyenne si rien n'est noté
-        else:
-            scores[id_item] = M_train[id_user, id_item]  # Garder la note existante
+def complete_a_user_item_based(M_train, id_user, k, index=None):
+    if index is None:
+        index = build_item_index(M_train)
+    indptr, neighbors, sims = index["indptr"], index["neighbors"], index["sims"]
+    n_items = M_train.shape[1]
+    user_rates = as_sparse(M_train).dense_row(id_user)
+    known = ~np.isnan(user_rates)
+    mean_user = np.nanmean(user_rates)
+
+    # Pour chaque film, les k voisins retenus sont les k premiers voisins de l'index notés par l'utilisateur
+    item_of_entry = np.repeat(np.arange(n_items), np.diff(indptr))
+    rated = known[neighbors]
+    rank = np.cumsum(rated)
+    rank -= np.concatenate(([0], rank))[indptr[:-1]][item_of_entry]  # Rang au sein de la liste de chaque film
+    selected = rated & (rank <= k)
+
+    # Moyenne pondérée des notes des voisins retenus : simple gather-and-dot
+    num = np.bincount(item_of_entry, weights=np.where(selected, sims * np.nan_to_num(user_rates[neighbors]), 0), minlength=n_items)
+    den = np.bincount(item_of_entry, weights=np.where(selected, np.abs(sims), 0), minlength=n_items)
+
+    # Si le k-ième voisin et le suivant ont la même similarité, on reprend le tri de la version exhaustive
+    # pour retenir exactement les mêmes voisins.
+    kth = np.zeros(n_items)
+    next_kth = np.full(n_items, np.nan)
+    kth[item_of_entry[rated & (rank == k)]] = sims[rated & (rank == k)]
+    next_kth[item_of_entry[rated & (rank == k + 1)]] = sims[rated & (rank == k + 1)]
+    if index["n_neighbors"] == -1:
+        for id_item in np.where(~known & (kth == next_kth))[0]:
+            inds_known = np.where(known)[0]
+            sims_known = np.zeros(n_items)
+            sims_known[neighbors[indptr[id_item]:indptr[id_item + 1]]] = sims[indptr[id_item]:indptr[id_item + 1]]
+            sims_known = sims_known[inds_known]
+            ind = np.argsort(-sims_known)[:k]
+            num[id_item] = np.sum(sims_known[ind] * user_rates[inds_known[ind]])
+            den[id_item] = sum(abs(sims_known[ind]))
+
+    scores = np.full(n_items, mean_user)  # Moyenne si pas de similarité ou si rien n'est noté
+    has_neighbors = den != 0
+    scores[has_neighbors] = num[has_neighbors] / den[has_neighbors]
+    scores[known] = user_rates[known]  # Garder la note existante
     return scores
 
 ##============================================
 ## recommend_item_based(M_train, id_user, new=True, k=10)
 ##============================================
-def recommend_item_based(M_train, id_user, new=True, k=10):
-    scores = complete_a_user_item_based(M_train, id_user, k)
+def recommend_item_based(M_train, id_user, new=True, k=10, index=None):
+    scores = complete_a_user_item_based(M_train, id_user, k, index)
     
     if new:
-        inds_unknown = np.where(np.isnan(M_train[id_user, :]))[0]
+        inds_unknown = np.where(np.isnan(as_sparse(M_train).dense_row(id_user)))[0]
         rec_ind_in_unknown = np.argmax(scores[inds_unknown])
         return inds_unknown[rec_ind_in_unknown]
     else:
@@ -60,8 +164,17 @@ def recommend_item_based(M_train, id_user, new=True, k=10):
 ##============================================
 ## complete_item_based(M_train, k)
 ##============================================
-def complete_item_based(M_train, k):
-    M_completed = np.zeros(M_train.shape)
-    for id_user in range(M_train.shape[0]):
-        M_completed[id_user, :] = complete_a_user_item_based(M_train, id_user, k)
-    return M_completed
\ No newline at end of file
+def complete_item_based(M_train, k, index=None, n_jobs=None):
+    M_train = as_sparse(M_train)  # Conversion unique, au lieu d'une par utilisateur
+    if index is None:
+        index = build_item_index(M_train)  # Index construit une seule fois pour tous les utilisateurs
+    # Avec n_jobs, les utilisateurs sont répartis entre plusieurs workers qui écrivent en mémoire partagée
+    n_workers = effective_n_jobs(n_jobs)
+    M_completed = np.zeros(M_train.shape) if n_workers == 1 else shared_empty(M_train.shape)
+
+    def complete_users(start, stop):
+        for id_user in range(start, stop):
+            M_completed[id_user, :] = complete_a_user_item_based(M_train, id_user, k, index)
+
+    parallel_for(complete_users, M_train.shape[0], n_jobs, chunk_size=max(1, M_train.shape[0] // (4 * n_workers)))
+    return M_completed
@@ -0,0 +1,444 @@
+##============================================
+##============================================
+## modèles entraînés : fit une fois, puis predict / recommend
+##============================================
+##============================================
+
+# Les fonctions `recommend(M_train, id_user, ...)` de chaque module ré-entraînent tout le modèle à chaque appel.
+# Les classes ci-dessous séparent l'apprentissage de la prédiction :
+#
+#   model = ALSRecommender(k=10).fit(M_train)   # apprentissage unique
+#   model.predict(user_ids, item_ids)           # notes prédites pour des couples (utilisateur, film)
+#   model.recommend(id_user, n=10)              # n films recommandés à un utilisateur
+#   model.recommend_batch(user_ids, n=10)       # n films pour chaque utilisateur (tableau n_users x n, voir topn.py)
+#   model.complete()                            # matrice complétée, comme `complete(M_train, ...)` du module
+#   model.score_blocks(block_size=1024)         # la même, par blocs d'utilisateurs (voir eval.evaluate)
+#   model.update(users, items, rates)           # prise en compte de nouvelles notes sans tout réapprendre
+#   model.recommend_new_user(items, rates)      # (svd, als) recommandations pour un utilisateur absent de M_train
+#   model.build_ann_index(n_probe=8)            # (svd, als) recommend_batch passe ensuite par un index approximatif (ann.py)
+#   persist.save_model(model, path)             # sauvegarde sur disque, relue par persist.load_model(path) (memory-map)
+#
+# L'état appris est conservé dans des attributs terminés par "_" (moyennes, similarités, facteurs).
+# M_train peut être une matrice pleine (NaN pour les valeurs manquantes) ou un SparseRatings.
+
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from data import as_sparse
+import als
+import knn
+import knn_item_based
+import svd
+from topn import top_n, top_n_factors
+from ann import IVFIndex
+
+
+##============================================
+## Recommender : interface commune
+##============================================
+class Recommender:
+
+  def fit(self, M_train):
+    """Apprend le modèle une fois pour toutes à partir de M_train ; renvoie le modèle."""
+    self.R_ = as_sparse(M_train)
+    self._fit(self.R_)
+    return self
+
+  def _fit(self, R):
+    raise NotImplementedError
+
+  def score_users(self, user_ids):
+    """Scores de tous les films pour chaque utilisateur de `user_ids` (tableau len(user_ids) x n_items)."""
+    raise NotImplementedError
+
+  def complete(self):
+    """Matrice complétée (identique à la fonction `complete` du module correspondant)."""
+    return self.score_users(np.arange(self.R_.shape[0]))
+
+  def score_blocks(self, user_ids=None, block_size=1024):
+    """
+    Lignes de la matrice complétée pour `user_ids` (tous les utilisateurs par défaut), par blocs de `block_size`
+    utilisateurs : itère sur (indices des utilisateurs du bloc, scores block_size x n_items). Seul un bloc est
+    en mémoire à la fois, la matrice complète n'est jamais construite.
+    """
+    user_ids = np.arange(self.R_.shape[0]) if user_ids is None else np.asarray(user_ids)
+    for start in range(0, len(user_ids), block_size):
+      block = user_ids[start:start + block_size]
+      yield block, self.score_users(block)
+
+  def predict(self, user_ids, item_ids):
+    """Notes prédites pour les couples (user_ids[i], item_ids[i])."""
+    user_ids, item_ids = np.broadcast_arrays(user_ids, item_ids)
+    users, inverse = np.unique(user_ids, return_inverse=True)
+    return self.score_users(users)[inverse.reshape(user_ids.shape), item_ids]
+
+  def recommend(self, id_user, n=1, new=True):
+    """Les n films de meilleur score pour l'utilisateur (hors films déjà notés si new=True)."""
+    return self.recommend_batch([id_user], n, new)[0]
+
+  def recommend_batch(self, user_ids, n=10, new=True, return_scores=False, block_size=1024):
+    """
+    Les n films de meilleur score pour chaque utilisateur de `user_ids` (tableau len(user_ids) x n),
+    hors films déjà notés si new=True ; avec return_scores=True, renvoie aussi les scores correspondants.
+    S'il reste moins de n films à recommander, les dernières positions valent -1 (voir topn.py).
+    Les scores sont calculés par blocs de `block_size` utilisateurs : la mémoire ne dépend pas de len(user_ids).
+    """
+    indices, values = self._top_n(np.asarray(user_ids), n, self.R_.mask[user_ids] if new else None, block_size)
+    return (indices, values) if return_scores else indices
+
+  def _top_n(self, user_ids, n, exclude, block_size=1024):
+    # top-n de chaque bloc d'utilisateurs, ajouté au résultat au fur et à mesure
+    indices = np.zeros((len(user_ids), min(n, self.R_.shape[1])), dtype=int)
+    values = np.zeros(indices.shape)
+    for start, (block, scores) in zip(range(0, len(user_ids), block_size), self.score_blocks(user_ids, block_size)):
+      stop = start + len(block)
+      indices[start:stop], values[start:stop] = top_n(scores, n, None if exclude is None else exclude[start:stop])
+    return indices, values
+
+  def update(self, users, items, rates):
+    """
+    Prend en compte des notes nouvelles ou modifiées (users[i], items[i], rates[i]) sans tout réapprendre ;
+    des indices au-delà de la taille courante ajoutent des utilisateurs ou des films. Renvoie le modèle.
+    Seule la partie de l'état appris touchée par ces notes est recalculée (voir `_update` de chaque modèle).
+    """
+    users, items, rates = np.atleast_1d(users), np.atleast_1d(items), np.atleast_1d(np.asarray(rates, dtype=float))
+    # un couple (utilisateur, film) présent plusieurs fois ne compte qu'une fois, avec sa dernière note
+    keys = users.astype(np.int64) * (max(self.R_.shape[1], items.max(initial=-1) + 1)) + items
+    last = np.sort(len(keys) - 1 - np.unique(keys[::-1], return_index=True)[1])
+    users, items, rates = users[last], items[last], rates[last]
+
+    R_old = self.R_
+    self.R_, old_rates = R_old.updated(users, items, rates)
+    self._update(R_old, users, items, rates, old_rates)
+    return self
+
+  def _update(self, R_old, users, items, rates, old_rates):
+    # par défaut : nouvel apprentissage complet
+    self._fit(self.R_)
+
+
+##============================================
+## PopularityRecommender
+##============================================
+class PopularityRecommender(Recommender):
+  """Note moyenne de chaque film (voir popularity.py)."""
+
+  def _fit(self, R):
+    # sommes et nombres de notes par film, tenus à jour par `update`
+    self.item_sums_ = np.asarray(R.csc.sum(axis=0)).ravel()
+    self.item_counts_ = R.item_counts().astype(R.csr.dtype)
+    self._set_means()
+
+  def _set_means(self):
+    with np.errstate(invalid='ignore', divide='ignore'):
+      self.item_means_ = self.item_sums_ / self.item_counts_
+
+  def _update(self, R_old, users, items, rates, old_rates):
+    # O(nombre de nouvelles notes) : seules les sommes des films concernés changent
+    new = np.isnan(old_rates)
+    self.item_sums_ = _grow(self.item_sums_, self.R_.shape[1])
+    self.item_counts_ = _grow(self.item_counts_, self.R_.shape[1])
+    np.add.at(self.item_sums_, items, rates - np.where(new, 0, old_rates))
+    np.add.at(self.item_counts_, items, new)
+    self._set_means()
+
+  def score_users(self, user_ids):
+    scores = np.nan_to_num(self.item_means_, nan=0.0)  # un film jamais noté reçoit 0, comme dans popularity.complete
+    M_scores = np.tile(scores, (len(user_ids), 1))
+    known = self.R_.csr[user_ids].tocoo()  # les notes déjà connues sont conservées
+    M_scores[known.row, known.col] = known.data
+    return M_scores
+
+  def _top_n(self, user_ids, n, exclude, block_size=1024):
+    # les films jamais notés ne sont pas recommandés (np.nanargmax dans popularity.recommend)
+    indices = np.zeros((len(user_ids), min(n, self.R_.shape[1])), dtype=int)
+    values = np.zeros(indices.shape)
+    for start in range(0, len(user_ids), block_size):
+      stop = min(start + block_size, len(user_ids))
+      indices[start:stop], values[start:stop] = top_n(np.tile(self.item_means_, (stop - start, 1)), n,
+                                                      None if exclude is None else exclude[start:stop])
+    return indices, values
+
+
+##============================================
+## KNNRecommender
+##============================================
+class KNNRecommender(Recommender):
+  """Filtrage collaboratif basé sur les k plus proches utilisateurs (voir knn.py)."""
+
+  def __init__(self, k=10):
+    self.k = k
+
+  def _fit(self, R):
+    # sommes des similarités (num_[a, b] = somme des r_a r_b, sq_[a, b] = somme des r_a² sur les films communs)
+    # et des notes par utilisateur, tenues à jour par `update`
+    self.num_, self.sq_, _ = knn.similarity_sums(R)
+    self.sims_ = knn._cosine(self.num_, self.sq_, self.sq_.T)
+    self.user_sums_ = np.asarray(R.csr.sum(axis=1)).ravel()
+    self.user_counts_ = R.user_counts().astype(R.csr.dtype)
+    self._set_means()
+
+  def _set_means(self):
+    with np.errstate(invalid='ignore', divide='ignore'):
+      self.user_means_ = self.user_sums_ / self.user_counts_
+    self.deviations_ = knn._deviations(self.R_, self.user_means_)
+
+  def _update(self, R_old, users, items, rates, old_rates):
+    # Une note (u, j) ne modifie que les sommes des couples (u, b) où b a noté j : coût proportionnel au nombre
+    # de ces couples. Les notes d'un même film sont prises l'une après l'autre (deux nouvelles notes du même film
+    # créent un nouveau film en commun).
+    n_users = self.R_.shape[0]
+    self.num_, self.sq_, self.sims_ = (_grow(_grow(A.T, n_users).T, n_users) for A in (self.num_, self.sq_, self.sims_))
+    new = np.isnan(old_rates)
+    old = np.where(new, 0, old_rates)
+
+    for id_item in np.unique(items):
+      col_users, col_rates = R_old.col(id_item) if id_item < R_old.shape[1] else (np.zeros(0, dtype=int), np.zeros(0))
+      for id_rate in np.where(items == id_item)[0]:
+        u, r, v = users[id_rate], rates[id_rate], old[id_rate]
+        others = col_users != u
+        b, r_b = col_users[others], col_rates[others]
+        self.num_[u, b] += (r - v) * r_b
+        self.num_[b, u] = self.num_[u, b]
+        self.sq_[u, b] += r**2 - v**2
+        if new[id_rate]:
+          self.sq_[b, u] += r_b**2
+        self.num_[u, u] += r**2 - v**2
+        self.sq_[u, u] += r**2 - v**2
+        col_users, col_rates = np.append(b, u), np.append(r_b, r)
+
+    # seules les similarités des utilisateurs concernés changent (la matrice est symétrique)
+    changed = np.unique(users)
+    self.sims_[changed] = knn._cosine(self.num_[changed], self.sq_[changed], self.sq_[:, changed].T)
+    self.sims_[:, changed] = self.sims_[changed].T
+
+    self.user_sums_ = _grow(self.user_sums_, n_users)
+    self.user_counts_ = _grow(self.user_counts_, n_users)
+    np.add.at(self.user_sums_, users, rates - old)
+    np.add.at(self.user_counts_, users, new)
+    self._set_means()
+
+  def score_users(self, user_ids):
+    return np.array([knn._complete_a_user(self.R_, id_user, self.k, self.sims_[id_user], self.user_means_, self.deviations_)
+                     for id_user in user_ids]).reshape(len(user_ids), self.R_.shape[1])
+
+
+##============================================
+## ItemKNNRecommender
+##============================================
+class ItemKNNRecommender(Recommender):
+  """Filtrage collaboratif basé sur les k films les plus similaires (voir knn_item_based.py)."""
+
+  def __init__(self, k=10, n_neighbors=None):
+    self.k = k
+    self.n_neighbors = n_neighbors
+
+  def _fit(self, R):
+    # sommes des similarités entre films (comme KNNRecommender sur la transposée), tenues à jour par `update`,
+    # et index des voisins qui s'en déduit (même index que knn_item_based.build_item_index)
+    self.num_, self.sq_, _ = knn.similarity_sums(R.T)
+    self._set_similarities(np.arange(R.shape[1]))
+    self.index_ = knn_item_based.index_from_similarities(self.sims_, self.n_neighbors)
+
+  def _set_similarities(self, items):
+    if len(items) == self.num_.shape[0]:
+      self.sims_ = knn._cosine(self.num_, self.sq_, self.sq_.T)
+    else:
+      self.sims_[items] = knn._cosine(self.num_[items], self.sq_[items], self.sq_[:, items].T)
+      self.sims_[:, items] = self.sims_[items].T
+    self.sims_[items, items] = 0  # un film n'est pas son propre voisin
+
+  def _update(self, R_old, users, items, rates, old_rates):
+    # Une note (u, j) ne modifie que les sommes des couples (j, b) où b est noté par u. Seules les similarités
+    # des films notés et les listes de voisins des films concernés (les films notés et ceux notés par les mêmes
+    # utilisateurs) sont recalculées ; les autres listes de l'index sont recopiées.
+    n_items = self.R_.shape[1]
+    self.num_, self.sq_, self.sims_ = (_grow(_grow(A.T, n_items).T, n_items) for A in (self.num_, self.sq_, self.sims_))
+    new = np.isnan(old_rates)
+    old = np.where(new, 0, old_rates)
+
+    for id_user in np.unique(users):
+      row_items, row_rates = R_old.row(id_user) if id_user < R_old.shape[0] else (np.zeros(0, dtype=int), np.zeros(0))
+      for id_rate in np.where(users == id_user)[0]:
+        j, r, v = items[id_rate], rates[id_rate], old[id_rate]
+        others = row_items != j
+        b, r_b = row_items[others], row_rates[others]
+        self.num_[j, b] += (r - v) * r_b
+        self.num_[b, j] = self.num_[j, b]
+        self.sq_[j, b] += r**2 - v**2
+        if new[id_rate]:
+          self.sq_[b, j] += r_b**2
+        self.num_[j, j] += r**2 - v**2
+        self.sq_[j, j] += r**2 - v**2
+        row_items, row_rates = np.append(b, j), np.append(r_b, r)
+
+    changed = np.unique(items)
+    self._set_similarities(changed)
+    affected = np.union1d(changed, self.R_.csr[np.unique(users)].indices)
+    self.index_ = knn_item_based.update_item_index(self.index_, self.sims_, affected)
+
+  def score_users(self, user_ids):
+    return np.array([knn_item_based.complete_a_user_item_based(self.R_, id_user, self.k, self.index_)
+                     for id_user in user_ids]).reshape(len(user_ids), self.R_.shape[1])
+
+
+##============================================
+## FactorRecommender : modèles de la forme M ≈ P Qᵀ
+##============================================
+class FactorRecommender(Recommender):
+  """Les scores sont des produits scalaires entre facteurs utilisateurs `user_factors_` et films `item_factors_`."""
+
+  def score_users(self, user_ids):
+    return self.user_factors_[user_ids] @ self.item_factors_.T
+
+  def predict(self, user_ids, item_ids):
+    user_ids, item_ids = np.broadcast_arrays(user_ids, item_ids)
+    return np.sum(self.user_factors_[user_ids] * self.item_factors_[item_ids], axis=-1)
+
+  def fit(self, M_train):
+    super().fit(M_train)
+    self.item_means_ = self.R_.item_means()  # scores de popularité, pour les utilisateurs ayant trop peu de notes
+    return self
+
+  def update(self, users, items, rates):
+    super().update(users, items, rates)
+    self.item_means_ = self.R_.item_means()
+    return self
+
+  def fold_in(self, items, rates):
+    """Facteurs (k,) d'un utilisateur absent de M_train à partir de ses notes, sans modifier le modèle."""
+    row = csr_matrix((np.asarray(rates, dtype=float), np.asarray(items), [0, len(items)]), shape=(1, self.R_.shape[1]))
+    row.sum_duplicates()
+    return self._fold_in(row)[0]
+
+  def recommend_new_user(self, items, rates, n=10, new=True, min_ratings=3, return_scores=False):
+    """
+    Les n films recommandés à un nouvel utilisateur (absent de M_train) qui a donné les notes `rates` aux films `items`.
+    Ses facteurs sont obtenus par `fold_in` ; s'il a moins de `min_ratings` notes, ce sont les films
+    de meilleure note moyenne qui sont recommandés (comme popularity.recommend).
+    """
+    items = np.asarray(items, dtype=int)
+    if len(items) < min_ratings:
+      scores = self.item_means_
+    else:
+      scores = self.item_factors_ @ self.fold_in(items, rates)
+    exclude = csr_matrix((np.ones(len(items), dtype=bool), items, [0, len(items)]), shape=(1, len(scores))) if new else None
+    indices, values = top_n(scores[None, :], n, exclude)
+    return (indices[0], values[0]) if return_scores else indices[0]
+
+  def build_ann_index(self, **index_params):
+    """Construit un index approximatif (ann.IVFIndex) sur les facteurs films, utilisé ensuite par recommend_batch."""
+    self.ann_index_ = IVFIndex(**index_params).fit(self.item_factors_)
+    return self.ann_index_
+
+  def _top_n(self, user_ids, n, exclude, block_size=1024):
+    if getattr(self, "ann_index_", None) is not None:
+      return self.ann_index_.search(self.user_factors_[user_ids], n, exclude, block_size=block_size)
+    return top_n_factors(self.user_factors_[user_ids], self.item_factors_, n, exclude, block_size)
+
+
+##============================================
+## SVDRecommender
+##============================================
+class SVDRecommender(FactorRecommender):
+  """SVD tronquée de la matrice remplie (voir svd.py) ; user_factors_ = U_k diag(S_k), item_factors_ = Vt_kᵀ."""
+
+  def __init__(self, k=10, replaceNA_fn=svd.replaceNA_with_zeros, solver=None, **solver_params):
+    self.k = k
+    self.replaceNA_fn = replaceNA_fn
+    self.solver = solver
+    self.solver_params = solver_params
+
+  def _fit(self, R):
+    self.ann_index_ = None
+    self.U_, self.S_, self.Vt_ = svd.factorize(R, self.k, self.replaceNA_fn, self.solver, **self.solver_params)
+    self.user_factors_ = self.U_ * self.S_
+    self.item_factors_ = self.Vt_.T
+    self.fill_ = svd.fill_values(R, self.replaceNA_fn)
+
+  def _fold_in(self, R_rows):
+    # projection des lignes remplies sur Vt_k
+    return svd.fold_in(R_rows, self.Vt_, self.fill_)
+
+  def _update(self, R_old, users, items, rates, old_rates):
+    # Projection (fold-in) sans refaire la SVD : les nouveaux films sur les facteurs utilisateurs U_k,
+    # puis les utilisateurs concernés sur les facteurs films Vt_k. Les valeurs de remplacement des notes manquantes
+    # (fill_) des films existants restent celles de l'apprentissage.
+    self.ann_index_ = None
+    n_users, n_items = self.R_.shape
+    n_old_items = len(self.fill_)
+    self.fill_ = np.concatenate([self.fill_, svd.fill_values(self.R_, self.replaceNA_fn)[n_old_items:]])
+    self.U_ = _grow(self.U_, n_users)
+    if n_items > n_old_items:
+      new_items = np.arange(n_old_items, n_items)
+      S_inv = np.divide(1, self.S_, out=np.zeros_like(self.S_), where=self.S_ != 0)
+      # colonne remplie = fill_j partout + écarts aux notes observées
+      deviations = self.R_.csc[:, new_items].T.tocsr()
+      deviations.data = deviations.data - np.repeat(self.fill_[new_items], np.diff(deviations.indptr))
+      Vt_new = (self.fill_[new_items, None] * self.U_.sum(axis=0) + deviations @ self.U_) * S_inv
+      self.Vt_ = np.hstack([self.Vt_, Vt_new.T])
+
+    changed = np.unique(users)
+    self.user_factors_ = _grow(self.user_factors_, n_users)
+    self.user_factors_[changed] = svd.fold_in(self.R_.csr[changed], self.Vt_, self.fill_)
+    S_inv = np.divide(1, self.S_, out=np.zeros_like(self.S_), where=self.S_ != 0)
+    self.U_[changed] = self.user_factors_[changed] * S_inv
+    self.item_factors_ = self.Vt_.T
+
+
+##============================================
+## ALSRecommender
+##============================================
+class ALSRecommender(FactorRecommender):
+  """Factorisation par moindres carrés alternés (voir als.py)."""
+
+  def __init__(self, k=10, n_iter=5, lambd=0.1, tol=None, n_jobs=None, random_state=None):
+    self.k = k
+    self.n_iter = n_iter
+    self.lambd = lambd
+    self.tol = tol
+    self.n_jobs = n_jobs
+    self.random_state = random_state
+
+  def _fit(self, R):
+    self.ann_index_ = None
+    self.user_factors_, self.item_factors_, self.losses_ = als.factorize(R, self.k, self.n_iter, self.lambd, self.tol, self.n_jobs,
+                                                                          random_state=self.random_state)
+
+  def _fold_in(self, R_rows):
+    # un système régularisé par utilisateur, facteurs films fixés (une demi-itération ALS)
+    return als.fold_in(R_rows, self.item_factors_, self.lambd)
+
+  def _update(self, R_old, users, items, rates, old_rates):
+    # Fold-in : seules les lignes concernées sont résolues à nouveau, les facteurs opposés restant fixés ;
+    # d'abord les utilisateurs (face aux facteurs films), puis les films (face aux facteurs utilisateurs mis à jour),
+    # puis à nouveau les utilisateurs s'il y a de nouveaux films. Les nouveaux utilisateurs et films partent de facteurs nuls.
+    self.ann_index_ = None
+    self.user_factors_ = _grow(self.user_factors_, self.R_.shape[0])
+    self.item_factors_ = _grow(self.item_factors_, self.R_.shape[1])
+    changed_users, changed_items = np.unique(users), np.unique(items)
+    self.user_factors_[changed_users] = als.fold_in(self.R_.csr[changed_users], self.item_factors_, self.lambd)
+    self.item_factors_[changed_items] = als.fold_in(self.R_.csc[:, changed_items].T.tocsr(), self.user_factors_, self.lambd)
+    if np.any(changed_items >= R_old.shape[1]):
+      # les utilisateurs ont d'abord été résolus face à des facteurs nuls pour les nouveaux films : une passe de plus
+      self.user_factors_[changed_users] = als.fold_in(self.R_.csr[changed_users], self.item_factors_, self.lambd)
+
+
+def _grow(A, n):
+  # A complété par des lignes nulles jusqu'à n lignes
+  if A.shape[0] >= n:
+    return A
+  return np.concatenate([A, np.zeros((n - A.shape[0],) + A.shape[1:], dtype=A.dtype)])
+
+
+##============================================
+## MODELS : les modèles par nom
+##============================================
+MODELS = {
+  "popularity": PopularityRecommender,
+  "knn": KNNRecommender,
+  "knn_item_based": ItemKNNRecommender,
+  "svd": SVDRecommender,
+  "als": ALSRecommender,
+}
+
@@ -0,0 +1,187 @@
+##============================================
+##============================================
+## exécution parallèle des calculs ligne par ligne
+##============================================
+##============================================
+
+# * effective_n_jobs(n_jobs)
+# * shared_empty(shape, dtype=float)
+# * parallel_for(fn, n, n_jobs=None, chunk_size=None, backend="processes", pool=None)
+# * WorkerPool(tasks, n_jobs=None, backend="processes")
+#
+# Les mises à jour ALS et les complétions KNN traitent chaque utilisateur (ou film) indépendamment :
+# `parallel_for` répartit des tranches de lignes entre plusieurs workers.
+# Avec le backend "processes", les workers sont créés par fork : ils héritent sans copie (copy-on-write)
+# de la matrice des notes et des facteurs, rien n'est sérialisé à l'aller. Les résultats volumineux
+# (facteurs, matrice complétée) sont écrits directement dans des tableaux en mémoire partagée
+# (`shared_empty`), visibles par le processus parent ; seules les petites valeurs de retour de `fn` sont renvoyées.
+#
+# Si le fork n'est pas disponible (Windows), le backend "threads" est utilisé : NumPy libère le GIL
+# pendant les produits matriciels et les résolutions de systèmes.
+# En mode parallèle, il vaut mieux limiter BLAS à un thread par worker (OMP_NUM_THREADS=1 par exemple).
+#
+# Un appel à parallel_for crée ses workers et les arrête à la fin. Quand les mêmes calculs sont relancés
+# de nombreuses fois (deux demi-itérations ALS par itération), un `WorkerPool` garde ses workers d'un appel
+# à l'autre : ses tâches sont fixées à sa création (les workers en héritent au fork), parallel_for(..., pool=pool)
+# n'envoie ensuite que l'indice de la tâche et les bornes des tranches. Rien ne passe par une variable globale :
+# plusieurs pools (dans des threads différents par exemple) coexistent sans interférer.
+
+
+import itertools
+import mmap
+import os
+import multiprocessing
+import multiprocessing.connection
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+
+##============================================
+## effective_n_jobs(n_jobs)
+##============================================
+def effective_n_jobs(n_jobs):
+  """Nombre de workers : None ou 1 -> exécution séquentielle, -1 -> tous les coeurs, -2 -> tous sauf un, etc."""
+  if n_jobs is None or n_jobs == 0:
+    return 1
+  if n_jobs < 0:
+    return max(1, (os.cpu_count() or 1) + 1 + n_jobs)
+  return n_jobs
+
+
+##============================================
+## shared_empty(shape, dtype=float)
+##============================================
+def shared_empty(shape, dtype=float):
+  """Tableau non initialisé en mémoire partagée (mmap anonyme), modifiable par les processus fils."""
+  size = int(np.prod(shape))
+  buffer = mmap.mmap(-1, max(1, size * np.dtype(dtype).itemsize))
+  return np.frombuffer(buffer, dtype=dtype, count=size).reshape(shape)
+
+
+##============================================
+## parallel_for(fn, n, n_jobs=None, chunk_size=None, backend="processes", pool=None)
+##============================================
+def parallel_for(fn, n, n_jobs=None, chunk_size=None, backend="processes", pool=None):
+  """
+  Appelle fn(start, stop) sur des tranches consécutives de range(n) et renvoie la liste des résultats (dans l'ordre).
+  Les tranches font au plus `chunk_size` lignes (par défaut, une tranche par worker).
+  pool : WorkerPool dont fn est l'une des tâches ; ses workers sont réutilisés (n_jobs et backend sont alors les siens).
+  Sinon, des workers sont créés pour cet appel seulement.
+  """
+  n_jobs = pool.n_jobs if pool is not None else effective_n_jobs(n_jobs)
+  if chunk_size is None:
+    chunk_size = max(1, -(-n // n_jobs))
+  chunks = [(start, min(start + chunk_size, n)) for start in range(0, n, chunk_size)]
+
+  if n_jobs == 1 or len(chunks) <= 1:
+    return [fn(*chunk) for chunk in chunks]
+  if pool is not None:
+    return pool.map(fn, chunks)
+  with WorkerPool([fn], min(n_jobs, len(chunks)), backend) as pool:
+    return pool.map(fn, chunks)
+
+
+##============================================
+## WorkerPool(tasks, n_jobs=None, backend="processes")
+##============================================
+class WorkerPool:
+  """
+  Workers réutilisables par plusieurs appels à parallel_for, le temps d'un bloc `with`.
+  tasks : fonctions fn(start, stop) que les workers pourront exécuter. Avec le backend "processes" (fork),
+  les workers sont créés à l'entrée du bloc et héritent alors des tâches et de tout ce qu'elles référencent ;
+  les tableaux qu'elles lisent ou écrivent et qui changent entre deux appels doivent donc être en mémoire
+  partagée (`shared_empty`). Une tâche ne doit pas être appelée par plusieurs threads à la fois sur le même pool.
+  """
+
+  def __init__(self, tasks, n_jobs=None, backend="processes"):
+    self.tasks = list(tasks)
+    self.n_jobs = effective_n_jobs(n_jobs)
+    self.backend = backend if backend == "threads" or "fork" in multiprocessing.get_all_start_methods() else "threads"
+    self._workers = None
+
+  def __enter__(self):
+    if self.n_jobs == 1:
+      return self
+    if self.backend == "threads":
+      self._workers = ThreadPoolExecutor(self.n_jobs)
+      return self
+    context = multiprocessing.get_context("fork")
+    self._workers = []
+    for _ in range(self.n_jobs):
+      parent_end, worker_end = context.Pipe()
+      # avec fork, la cible et ses arguments (les tâches) sont hérités tels quels, sans sérialisation
+      worker = context.Process(target=_serve, args=(self.tasks, worker_end), daemon=True)
+      worker.start()
+      worker_end.close()  # sinon la fin du worker ne serait pas visible (recv attendrait indéfiniment)
+      self._workers.append((worker, parent_end))
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+  def close(self):
+    """Arrête les workers."""
+    if self._workers is None:
+      return
+    if self.backend == "threads":
+      self._workers.shutdown()
+    else:
+      for worker, connection in self._workers:
+        try:
+          connection.send(None)
+        except OSError:
+          pass  # worker déjà arrêté
+        worker.join()
+        connection.close()
+    self._workers = None
+
+  def map(self, fn, chunks):
+    """Résultats de fn(start, stop) sur chaque tranche (start, stop) de `chunks`, dans l'ordre."""
+    if fn not in self.tasks:
+      raise ValueError("fn doit être l'une des tâches données à la création du WorkerPool")
+    if self._workers is None:
+      return [fn(*chunk) for chunk in chunks]
+    if self.backend == "threads":
+      return list(self._workers.map(lambda chunk: fn(*chunk), chunks))
+
+    # une tranche à la fois par worker : un worker libre reçoit la suivante (équilibrage des tranches inégales)
+    id_task = self.tasks.index(fn)
+    pending = iter(enumerate(chunks))
+    busy = set()
+
+    def dispatch(connection):
+      for id_chunk, (start, stop) in itertools.islice(pending, 1):
+        connection.send((id_task, id_chunk, start, stop))
+        busy.add(connection)
+
+    for _, connection in self._workers:
+      dispatch(connection)
+    results, error = [None] * len(chunks), None
+    while busy:
+      for connection in multiprocessing.connection.wait(busy):
+        busy.discard(connection)
+        try:
+          id_chunk, ok, value = connection.recv()
+        except EOFError:
+          raise RuntimeError("un worker de WorkerPool s'est arrêté") from None
+        if ok:
+          results[id_chunk] = value
+        elif error is None:
+          error = value
+        dispatch(connection)
+    if error is not None:
+      raise error
+    return results
+
+
+def _serve(tasks, connection):
+  # boucle d'un worker : (tâche, tranche, start, stop) -> (tranche, succès, résultat ou exception)
+  for id_task, id_chunk, start, stop in iter(connection.recv, None):
+    try:
+      message = (id_chunk, True, tasks[id_task](start, stop))
+    except Exception as error:
+      message = (id_chunk, False, error)
+    try:
+      connection.send(message)
+    except Exception as error:  # résultat ou exception impossible à sérialiser
+      connection.send((id_chunk, False, RuntimeError(f"résultat de la tranche {id_chunk} non transmissible : {error!r}")))
@@ -0,0 +1,191 @@
+##============================================
+##============================================
+## sauvegarde et chargement des modèles entraînés
+##============================================
+##============================================
+
+# * save_model(model, path, user_ids=None, item_ids=None)
+# * load_model(path, mmap_mode="c")
+#
+# Un modèle de models.py (popularity, knn, knn_item_based, svd, als) est sauvegardé dans un répertoire :
+#   meta.json       : version du format, nom du modèle (clé de models.MODELS), paramètres (attributs sans "_" final),
+#                     description de l'état appris (forme et type de chaque tableau) et identifiants bruts
+#   <attribut>.npy  : un fichier par tableau de l'état appris (attributs terminés par "_") : facteurs, similarités,
+#                     index des voisins, notes d'apprentissage R_ (CSR et CSC), index approximatif ann_index_, ...
+# meta.json est écrit en dernier (comme le cache de data.py) : un répertoire dont la sauvegarde a été interrompue
+# n'a pas de meta.json et est refusé par load_model.
+#
+# Au chargement, les tableaux sont memory-mappés : rien n'est lu avant d'être utilisé, un processus de service
+# démarre en quelques millisecondes quelle que soit la taille du modèle, et les processus qui chargent le même
+# répertoire partagent une seule copie des pages du modèle (cache de pages du système). Le mode par défaut "c"
+# (copy-on-write) laisse `update` possible : les pages modifiées deviennent privées au processus, les fichiers
+# ne changent jamais. mmap_mode=None lit tout en mémoire.
+#
+# user_ids / item_ids (par exemple ceux de data.ingest_ratings) donnent l'identifiant brut de chaque indice dense ;
+# load_model les rend dans model.user_ids_ / model.item_ids_ (None s'ils n'ont pas été donnés).
+#
+#   save_model(ALSRecommender(k=10).fit(M_train), "models/als")
+#   model = load_model("models/als")
+#   model.recommend_batch(user_ids, n=10)
+
+
+import importlib
+import json
+import os
+import numpy as np
+from scipy.sparse import csr_matrix, csc_matrix
+from data import SparseRatings
+from models import MODELS
+
+FORMAT_VERSION = 1
+
+# modules dont les classes et fonctions peuvent apparaître dans meta.json (index ann, fonction de remplissage de svd)
+_MODULES = {"ann", "svd", "models"}
+_IDS = ("user_ids_", "item_ids_")
+
+
+##============================================
+## save_model(model, path, user_ids=None, item_ids=None)
+##============================================
+def save_model(model, path, user_ids=None, item_ids=None):
+  """
+  Sauvegarde le modèle entraîné `model` dans le répertoire `path` (créé si besoin, remplacé s'il contient déjà
+  une sauvegarde). user_ids / item_ids : identifiants bruts des utilisateurs / films (par défaut ceux du modèle
+  chargé, model.user_ids_ / model.item_ids_). Renvoie `path`.
+  """
+  names = [name for name, cls in MODELS.items() if type(model) is cls]
+  if not names:
+    raise TypeError(f"{type(model).__name__} n'est pas un modèle de models.MODELS")
+  if not hasattr(model, "R_"):
+    raise ValueError("le modèle n'est pas entraîné (fit)")
+
+  os.makedirs(path, exist_ok=True)
+  meta_path = os.path.join(path, "meta.json")
+  if os.path.exists(meta_path):
+    os.remove(meta_path)  # l'ancienne sauvegarde n'est plus valide dès la première écriture
+
+  arrays = {}
+  ids = {"user_ids_": getattr(model, "user_ids_", None) if user_ids is None else np.asarray(user_ids),
+         "item_ids_": getattr(model, "item_ids_", None) if item_ids is None else np.asarray(item_ids)}
+  attributes = {name: value for name, value in vars(model).items() if name not in _IDS}
+  meta = {
+    "format_version": FORMAT_VERSION,
+    "model": names[0],
+    "params": {name: _encode(value, name, arrays) for name, value in attributes.items() if not name.endswith("_")},
+    "state": {name: _encode(value, name, arrays) for name, value in attributes.items() if name.endswith("_")},
+    "ids": {name: _encode(value, name, arrays) for name, value in ids.items()},
+  }
+
+  for name, array in arrays.items():
+    # écriture dans un fichier temporaire puis renommage : un modèle chargé depuis ce répertoire (memory-map
+    # des anciens fichiers) reste valide, même quand il est sauvegardé à sa propre place
+    file_name = os.path.join(path, name + ".npy")
+    with open(file_name + ".tmp", "wb") as f:
+      np.save(f, array)
+    os.replace(file_name + ".tmp", file_name)
+  for file_name in os.listdir(path):  # tableaux d'une sauvegarde précédente
+    if file_name.endswith(".npy") and file_name[:-4] not in arrays:
+      os.remove(os.path.join(path, file_name))
+  with open(meta_path, "w") as f:
+    json.dump(meta, f, indent=1)
+  return path
+
+
+def _encode(value, name, arrays):
+  # description JSON de `value` ; les tableaux sont ajoutés à `arrays` sous le nom de fichier `name`
+  if value is None or isinstance(value, (bool, int, float, str)):
+    return {"value": value}
+  if isinstance(value, np.generic):
+    return {"value": value.item()}
+  if isinstance(value, np.ndarray):
+    arrays[name] = value
+    return {"array": name, "shape": list(value.shape), "dtype": value.dtype.str}
+  if isinstance(value, SparseRatings):
+    return {"sparse_ratings": {
+      "shape": list(value.shape),
+      "csr": {part: _encode(getattr(value.csr, part), f"{name}.csr.{part}", arrays) for part in ("data", "indices", "indptr")},
+      "csc": {part: _encode(getattr(value.csc, part), f"{name}.csc.{part}", arrays) for part in ("data", "indices", "indptr")},
+    }}
+  if isinstance(value, dict):
+    return {"dict": {str(key): _encode(item, f"{name}.{key}", arrays) for key, item in value.items()}}
+  if isinstance(value, (list, tuple)):
+    return {"list": [_encode(item, f"{name}.{i}", arrays) for i, item in enumerate(value)]}
+  module = getattr(value, "__module__", None)
+  if callable(value) and hasattr(value, "__qualname__") and module in _MODULES:
+    return {"function": f"{module}.{value.__qualname__}"}
+  if type(value).__module__ in _MODULES:
+    return {"object": f"{type(value).__module__}.{type(value).__qualname__}",
+            "attributes": {key: _encode(item, f"{name}.{key}", arrays) for key, item in vars(value).items()}}
+  raise TypeError(f"l'attribut {name} ({type(value).__name__}) ne peut pas être sauvegardé")
+
+
+##============================================
+## load_model(path, mmap_mode="c")
+##============================================
+def load_model(path, mmap_mode="c"):
+  """
+  Modèle sauvegardé par `save_model` dans le répertoire `path`, prêt à predict / recommend / update.
+  Les tableaux sont memory-mappés selon `mmap_mode` ("c" : copy-on-write, "r" : lecture seule,
+  None : lus en mémoire). Lève ValueError si la sauvegarde est incomplète ou d'une version inconnue.
+  """
+  meta_path = os.path.join(path, "meta.json")
+  try:
+    with open(meta_path) as f:
+      meta = json.load(f)
+  except (OSError, ValueError) as error:
+    raise ValueError(f"{path} n'est pas une sauvegarde complète de modèle") from error
+  if meta.get("format_version") != FORMAT_VERSION:
+    raise ValueError(f"format de sauvegarde {meta.get('format_version')} non pris en charge (attendu : {FORMAT_VERSION})")
+  if meta.get("model") not in MODELS:
+    raise ValueError(f"modèle inconnu : {meta.get('model')}")
+
+  # pas d'appel au constructeur : les attributs sont ceux du modèle sauvegardé
+  model = MODELS[meta["model"]].__new__(MODELS[meta["model"]])
+  for section in ("params", "state", "ids"):
+    for name, description in meta[section].items():
+      setattr(model, name, _decode(description, path, mmap_mode))
+  return model
+
+
+def _decode(description, path, mmap_mode):
+  # inverse de _encode
+  if "value" in description:
+    return description["value"]
+  if "array" in description:
+    file_name = os.path.join(path, description["array"] + ".npy")
+    # un tableau vide ne peut pas être memory-mappé
+    array = np.load(file_name, mmap_mode=mmap_mode if np.prod(description["shape"]) > 0 else None)
+    if list(array.shape) != description["shape"] or array.dtype.str != description["dtype"]:
+      raise ValueError(f"{file_name} ne correspond pas à meta.json (forme {array.shape}, type {array.dtype})")
+    return array
+  if "sparse_ratings" in description:
+    parts = description["sparse_ratings"]
+    shape = tuple(parts["shape"])
+    csr, csc = ({part: _decode(parts[fmt][part], path, mmap_mode) for part in ("data", "indices", "indptr")}
+                for fmt in ("csr", "csc"))
+    return SparseRatings.from_arrays(csr_matrix((csr["data"], csr["indices"], csr["indptr"]), shape=shape),
+                                     csc_matrix((csc["data"], csc["indices"], csc["indptr"]), shape=shape))
+  if "dict" in description:
+    return {key: _decode(item, path, mmap_mode) for key, item in description["dict"].items()}
+  if "list" in description:
+    return [_decode(item, path, mmap_mode) for item in description["list"]]
+  if "function" in description:
+    return _resolve(description["function"])
+  if "object" in description:
+    cls = _resolve(description["object"])
+    value = cls.__new__(cls)
+    for name, item in description["attributes"].items():
+      setattr(value, name, _decode(item, path, mmap_mode))
+    return value
+  raise ValueError(f"description inconnue dans meta.json : {sorted(description)}")
+
+
+def _resolve(qualified_name):
+  # classe ou fonction "module.nom", limitée aux modules de _MODULES
+  module, _, name = qualified_name.partition(".")
+  if module not in _MODULES:
+    raise ValueError(f"{qualified_name} : module non autorisé dans une sauvegarde")
+  value = importlib.import_module(module)
+  for part in name.split("."):
+    value = getattr(value, part)
+  return value
@@ -1,4 +1,5 @@
 import numpy as np
+from data import SparseRatings
 
 ##============================================
 # Fonction de recommandation basée sur la popularité
@@ -6,12 +7,17 @@ import numpy as np
 def recommend(M_train, id_user, new=True):
     # Calcul de la moyenne des notes pour chaque film dans M_train, en ignorant les NaN
     # Cela permet d'obtenir une estimation de la popularité moyenne de chaque film
-    scores = np.nanmean(M_train, axis=0)  # Vecteur contenant la moyenne des notes par film
+    if isinstance(M_train, SparseRatings):
+        scores = M_train.item_means()  # Même calcul directement sur les notes observées
+        user_rates = M_train.dense_row(id_user)
+    else:
+        scores = np.nanmean(M_train, axis=0)  # Vecteur contenant la moyenne des notes par film
+        user_rates = M_train[id_user, :]
     
     if new:
         # Si "new=True", recommander un film que l'utilisateur n'a pas encore évalué
         # On identifie les indices des films non évalués par l'utilisateur (NaN dans M_train)
-        inds_unknown = np.where(np.isnan(M_train[id_user, :]))[0]  # Indices des films inconnus pour cet utilisateur
+        inds_unknown = np.where(np.isnan(user_rates))[0]  # Indices des films inconnus pour cet utilisateur
         
         # Sélection du film le plus populaire parmi ceux non évalués
         rec_ind_in_unknown = np.nanargmax(scores[inds_unknown])  # Trouve le film le plus populaire parmi ceux non vus
@@ -40,11 +46,21 @@ def recommend(M_train, id_user, new=True):
 def complete(M_train):
     # Calcul de la moyenne des notes par film, en ignorant les NaN
     # Cela permet d'estimer la popularité globale de chaque film
-    scores = np.nanmean(M_train, axis=0)  # Vecteur contenant la moyenne des notes de chaque film
+    if isinstance(M_train, SparseRatings):
+        scores = M_train.item_means()
+    else:
+        scores = np.nanmean(M_train, axis=0)  # Vecteur contenant la moyenne des notes de chaque film
     
     # Remplacement des NaN dans scores par 0 (si un film n'a aucune évaluation, on lui donne une note de 0)
     scores[np.isnan(scores)] = 0  # Permet d'éviter les erreurs de calcul sur les films non notés
     
+    if isinstance(M_train, SparseRatings):
+        # Matrice creuse : on part des moyennes et on replace les notes observées, sans densifier M_train
+        M_completed = np.tile(scores, (M_train.shape[0], 1))
+        users, items, rates = M_train.triplets()
+        M_completed[users, items] = rates
+        return M_completed
+
     # Création d'une matrice où chaque ligne (utilisateur) reçoit la moyenne des scores des films
     to_complete = np.ones((M_train.shape[0], 1)) @ scores.reshape((1, -1))  
     # Cette matrice contient les scores moyens des films dupliqués pour tous les utilisateurs
@@ -0,0 +1,388 @@
+##============================================
+##============================================
+## service local de recommandation (asyncio), requêtes regroupées en micro-lots
+##============================================
+##============================================
+
+# * RecommendationService(model, n=10, max_batch=64, max_delay=0.002, cache_size=10000)
+# * load_test(address, n_requests=2000, concurrency=32, n=10, n_users=None, user_exponent=1.0, random_state=0)
+# * tune_service(model, settings, **load_params)
+#
+# Le service charge un modèle entraîné (models.py, ou un répertoire de persist.save_model) et répond en HTTP/1.1,
+# sur un port TCP local ou une socket Unix :
+#   GET /recommend?user=12&n=10   ->  {"user": 12, "items": [...]}
+#   GET /stats                    ->  nombre de requêtes, de lots, taille moyenne des lots, taux de succès du cache
+# Une requête invalide reçoit une réponse 400, une erreur du modèle une réponse 500, avec un corps {"error": ...} ;
+# la connexion reste ouverte dans les deux cas.
+#
+# Les requêtes d'un seul utilisateur qui arrivent en même temps sont regroupées : le premier utilisateur en attente
+# ouvre un lot, complété pendant au plus `max_delay` secondes ou jusqu'à `max_batch` utilisateurs, puis tout le lot
+# est servi par un seul appel vectorisé model.recommend_batch (topn.py). Le calcul d'un lot se fait dans un thread
+# dédié : pendant ce temps la boucle asyncio continue d'accepter des requêtes, qui forment le lot suivant.
+# Les résultats récents sont gardés dans un cache LRU de `cache_size` entrées (utilisateur, n) : un utilisateur
+# redemandé est servi sans calcul. Le cache est à vider (clear_cache) après model.update.
+#
+# `load_test` est un générateur de charge : `concurrency` connexions persistantes envoient des requêtes pour des
+# utilisateurs tirés selon une loi de puissance (quelques utilisateurs très demandés), et mesure les latences
+# (p50, p99) et le débit. `tune_service` compare ainsi plusieurs réglages (max_batch, max_delay, cache_size).
+#
+# Utilisation en ligne de commande :
+#   python serve.py models/als --port 8000                  # modèle sauvegardé par persist.save_model
+#   python serve.py --fit als --unix /tmp/recsys.sock       # modèle appris sur load_data() au démarrage
+#   python serve.py models/als --load-test --max-batch 1 16 64 --cache-size 0 1000 --concurrency 64
+
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from urllib.parse import parse_qs, urlsplit
+import numpy as np
+import pandas as pd
+
+
+##============================================
+## RecommendationService
+##============================================
+class RecommendationService:
+  """Recommandations d'un modèle entraîné, servies par micro-lots avec un cache LRU des résultats."""
+
+  def __init__(self, model, n=10, max_batch=64, max_delay=0.002, cache_size=10000):
+    self.model = model
+    self.n = n
+    self.max_batch = max_batch
+    self.max_delay = max_delay
+    self.cache_size = cache_size
+    self._cache = OrderedDict()  # (utilisateur, n) -> liste des films, du moins au plus récemment utilisé
+    self._queue = None
+    self._executor = None
+    self._batcher = None
+    self.stats = dict.fromkeys(["requests", "cache hits", "batches", "batched users"], 0)
+
+  async def start(self):
+    """Démarre la constitution des lots (dans la boucle asyncio courante)."""
+    self._queue = asyncio.Queue()
+    self._executor = ThreadPoolExecutor(max_workers=1)  # un lot à la fois : le modèle n'est pas partagé entre threads
+    self._batcher = asyncio.create_task(self._run_batches())
+
+  async def stop(self):
+    self._batcher.cancel()
+    try:
+      await self._batcher
+    except asyncio.CancelledError:
+      pass
+    self._executor.shutdown()
+
+  def clear_cache(self):
+    self._cache.clear()
+
+  async def recommend(self, id_user, n=None):
+    """
+    Les films recommandés à l'utilisateur (liste d'au plus n indices : moins s'il reste moins de n films
+    qu'il n'a pas notés), depuis le cache ou par le prochain lot.
+    """
+    n = self._check(id_user, n)
+    self.stats["requests"] += 1
+    key = (id_user, n)
+    if key in self._cache:
+      self._cache.move_to_end(key)
+      self.stats["cache hits"] += 1
+      return self._cache[key]
+    future = asyncio.get_running_loop().create_future()
+    await self._queue.put((id_user, n, future))
+    return await future
+
+  def _check(self, id_user, n):
+    # n effectif de la requête ; ValueError si elle est invalide (réponse 400)
+    n = self.n if n is None else n
+    if not 0 <= id_user < self.model.R_.shape[0]:
+      raise ValueError(f"utilisateur inconnu : {id_user}")
+    if n <= 0:
+      raise ValueError("n doit être positif")
+    return n
+
+  async def _run_batches(self):
+    loop = asyncio.get_running_loop()
+    while True:
+      batch = [await self._queue.get()]
+      deadline = loop.time() + self.max_delay
+      while len(batch) < self.max_batch:
+        if not self._queue.empty():
+          batch.append(self._queue.get_nowait())
+          continue
+        timeout = deadline - loop.time()
+        if timeout <= 0:
+          break
+        try:
+          batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+        except asyncio.TimeoutError:
+          break
+
+      # un appel vectorisé par valeur de n, chaque utilisateur n'est calculé qu'une fois
+      for n in {n for _, n, _ in batch}:
+        requests = [(id_user, future) for id_user, n_request, future in batch if n_request == n]
+        users = np.unique([id_user for id_user, _ in requests])
+        try:
+          indices = await loop.run_in_executor(self._executor, self.model.recommend_batch, users, n)
+        except Exception as error:
+          for _, future in requests:
+            if not future.done():
+              future.set_exception(error)
+          continue
+        self.stats["batches"] += 1
+        self.stats["batched users"] += len(users)
+        results = {}
+        for id_user, items in zip(users.tolist(), indices.tolist()):
+          items = [item for item in items if item >= 0]  # -1 : moins de n films à recommander (topn.py)
+          results[id_user] = items
+          self._remember((id_user, n), items)
+        for id_user, future in requests:
+          if not future.done():
+            future.set_result(results[id_user])
+
+  def _remember(self, key, items):
+    if self.cache_size <= 0:
+      return
+    self._cache[key] = items
+    self._cache.move_to_end(key)
+    if len(self._cache) > self.cache_size:
+      self._cache.popitem(last=False)
+
+  def report(self):
+    """Statistiques du service : utilisateurs, requêtes, lots, taille moyenne des lots, taux de succès du cache."""
+    stats = {"n_users": self.model.R_.shape[0], **self.stats}
+    stats["mean batch size"] = stats["batched users"] / stats["batches"] if stats["batches"] else None
+    stats["cache hit rate"] = stats["cache hits"] / stats["requests"] if stats["requests"] else None
+    return stats
+
+  ##============================================
+  ## serveur HTTP
+  ##============================================
+  async def serve(self, host="127.0.0.1", port=8000, path=None):
+    """Démarre le serveur HTTP (socket Unix si `path` est donné, sinon TCP host:port) ; renvoie l'asyncio.Server."""
+    if self._queue is None:
+      await self.start()
+    if path is not None:
+      return await asyncio.start_unix_server(self._handle, path=path)
+    return await asyncio.start_server(self._handle, host, port)
+
+  async def _handle(self, reader, writer):
+    # connexion persistante (keep-alive) : une requête après l'autre jusqu'à sa fermeture par le client
+    try:
+      while True:
+        request_line = await reader.readline()
+        if not request_line:
+          break
+        headers = {}
+        while True:
+          line = await reader.readline()
+          if line in (b"\r\n", b"\n", b""):
+            break
+          name, _, value = line.decode("latin-1").partition(":")
+          headers[name.strip().lower()] = value.strip()
+        await reader.readexactly(int(headers.get("content-length", 0)))  # corps éventuel, ignoré
+        status, body = await self._respond(request_line.decode("latin-1"))
+        payload = json.dumps(body).encode()
+        close = headers.get("connection", "").lower() == "close"
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(payload)}\r\n"
+                     f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n".encode() + payload)
+        await writer.drain()
+        if close:
+          break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):  # client parti ou en-têtes invalides
+      pass
+    finally:
+      writer.close()
+
+  async def _respond(self, request_line):
+    # (statut, corps JSON) de la requête
+    try:
+      method, target, _ = request_line.split()
+    except ValueError:
+      return "400 Bad Request", {"error": "requête invalide"}
+    url = urlsplit(target)
+    query = parse_qs(url.query)
+    if method != "GET":
+      return "405 Method Not Allowed", {"error": "seule la méthode GET est acceptée"}
+    if url.path == "/stats":
+      return "200 OK", self.report()
+    if url.path != "/recommend":
+      return "404 Not Found", {"error": f"chemin inconnu : {url.path}"}
+    try:
+      id_user = int(query["user"][0])
+      n = int(query["n"][0]) if "n" in query else None
+      self._check(id_user, n)
+    except (KeyError, ValueError) as error:
+      return "400 Bad Request", {"error": str(error)}
+    try:
+      items = await self.recommend(id_user, n)
+    except Exception as error:  # erreur du modèle : la connexion reste utilisable
+      return "500 Internal Server Error", {"error": f"{type(error).__name__}: {error}"}
+    return "200 OK", {"user": id_user, "items": items}
+
+
+##============================================
+## load_test(address, n_requests=2000, concurrency=32, ...)
+##============================================
+async def load_test(address, n_requests=2000, concurrency=32, n=10, n_users=None, user_exponent=1.0, random_state=0):
+  """
+  Envoie `n_requests` requêtes /recommend au service d'adresse `address` ((host, port) ou chemin de socket Unix),
+  réparties sur `concurrency` connexions persistantes qui attendent chacune la réponse avant la requête suivante.
+  Les utilisateurs (parmi n_users, par défaut ceux du service) sont tirés avec une probabilité proportionnelle
+  à rang^-user_exponent : plus l'exposant est grand, plus les mêmes utilisateurs reviennent (succès du cache).
+
+  Retourne un dictionnaire : "requests", "concurrency", "throughput (req/s)", latences "p50 (ms)", "p99 (ms)",
+  "mean (ms)", "max (ms)" et les statistiques du service (/stats) à la fin de la charge.
+  """
+  if n_users is None:
+    n_users = (await _get(address, ["/stats"]))[0].get("n_users")
+  rng = np.random.default_rng(random_state)
+  p = np.arange(1, n_users + 1, dtype=np.float64) ** -user_exponent
+  users = rng.permutation(n_users)[rng.choice(n_users, size=n_requests, p=p / p.sum())]
+  targets = [f"/recommend?user={id_user}&n={n}" for id_user in users]
+
+  latencies = np.zeros(n_requests)
+  start = perf_counter()
+  await asyncio.gather(*(_client(address, targets, range(id_client, n_requests, concurrency), latencies)
+                         for id_client in range(min(concurrency, n_requests))))
+  duration = perf_counter() - start
+  stats = (await _get(address, ["/stats"]))[0]
+  return {
+    "requests": n_requests, "concurrency": concurrency,
+    "throughput (req/s)": n_requests / duration,
+    "p50 (ms)": 1000 * np.percentile(latencies, 50),
+    "p99 (ms)": 1000 * np.percentile(latencies, 99),
+    "mean (ms)": 1000 * np.mean(latencies),
+    "max (ms)": 1000 * np.max(latencies),
+    **{key: value for key, value in stats.items() if key in ("mean batch size", "cache hit rate")},
+  }
+
+
+async def _client(address, targets, ids, latencies):
+  # une connexion persistante, requêtes envoyées l'une après l'autre
+  reader, writer = await _connect(address)
+  try:
+    for id_request in ids:
+      start = perf_counter()
+      await _request(reader, writer, targets[id_request])
+      latencies[id_request] = perf_counter() - start
+  finally:
+    writer.close()
+
+
+async def _get(address, targets):
+  reader, writer = await _connect(address)
+  try:
+    return [await _request(reader, writer, target) for target in targets]
+  finally:
+    writer.close()
+
+
+async def _connect(address):
+  if isinstance(address, (str, os.PathLike)):
+    return await asyncio.open_unix_connection(address)
+  return await asyncio.open_connection(*address)
+
+
+async def _request(reader, writer, target):
+  writer.write(f"GET {target} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+  await writer.drain()
+  status = await reader.readline()
+  length = 0
+  while True:
+    line = await reader.readline()
+    if line in (b"\r\n", b"\n", b""):
+      break
+    name, _, value = line.decode("latin-1").partition(":")
+    if name.strip().lower() == "content-length":
+      length = int(value)
+  body = json.loads(await reader.readexactly(length))
+  if not status.startswith(b"HTTP/1.1 200"):
+    raise RuntimeError(f"{target} : {status.decode().strip()} {body}")
+  return body
+
+
+##============================================
+## tune_service(model, settings, **load_params)
+##============================================
+def tune_service(model, settings, **load_params):
+  """
+  Lance le service sur une socket Unix temporaire pour chaque réglage de `settings` (liste de dictionnaires
+  de paramètres de RecommendationService, ou dictionnaire {paramètre: liste de valeurs} dont on prend le produit)
+  et mesure sa tenue à la charge avec `load_test(**load_params)`. Retourne un DataFrame, une ligne par réglage.
+  """
+  if isinstance(settings, dict):
+    settings = [dict(zip(settings, values)) for values in itertools.product(*settings.values())]
+  rows = []
+  for setting in settings:
+    rows.append({**setting, **_run(_tune_one(model, setting, load_params))})
+  return pd.DataFrame(rows)
+
+
+def _run(coroutine):
+  # asyncio.run, y compris depuis un notebook (une boucle tourne déjà dans le thread principal)
+  try:
+    asyncio.get_running_loop()
+  except RuntimeError:
+    return asyncio.run(coroutine)
+  with ThreadPoolExecutor(max_workers=1) as executor:
+    return executor.submit(asyncio.run, coroutine).result()
+
+
+async def _tune_one(model, setting, load_params):
+  service = RecommendationService(model, **setting)
+  with tempfile.TemporaryDirectory() as directory:
+    path = os.path.join(directory, "service.sock")
+    server = await service.serve(path=path)
+    try:
+      return await load_test(path, n_users=model.R_.shape[0], **load_params)
+    finally:
+      server.close()
+      await server.wait_closed()
+      await service.stop()
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Service local de recommandation (HTTP, requêtes regroupées en lots).")
+  parser.add_argument("model", nargs="?", help="répertoire d'un modèle sauvegardé par persist.save_model")
+  parser.add_argument("--fit", help="nom du modèle (models.MODELS) à apprendre sur load_data() au lieu de le charger")
+  parser.add_argument("--host", default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=8000)
+  parser.add_argument("--unix", help="chemin d'une socket Unix (au lieu de host:port)")
+  parser.add_argument("-n", type=int, default=10, help="nombre de films par défaut")
+  parser.add_argument("--max-batch", type=int, nargs="+", default=[64], help="taille maximale d'un lot")
+  parser.add_argument("--max-delay", type=float, nargs="+", default=[0.002], help="attente maximale d'un lot (s)")
+  parser.add_argument("--cache-size", type=int, nargs="+", default=[10000], help="entrées du cache LRU")
+  parser.add_argument("--load-test", action="store_true", help="mesure les réglages donnés au lieu de servir")
+  parser.add_argument("--requests", type=int, default=2000, help="(load-test) nombre de requêtes")
+  parser.add_argument("--concurrency", type=int, default=32, help="(load-test) connexions simultanées")
+  parser.add_argument("--user-exponent", type=float, default=1.0, help="(load-test) concentration des utilisateurs demandés")
+  args = parser.parse_args()
+
+  if args.fit:
+    from data import load_data
+    from models import MODELS
+    model = MODELS[args.fit]().fit(load_data(sparse=True))
+  elif args.model:
+    from persist import load_model
+    model = load_model(args.model)
+  else:
+    parser.error("donner le répertoire d'un modèle sauvegardé ou --fit")
+
+  if args.load_test:
+    settings = {"n": [args.n], "max_batch": args.max_batch, "max_delay": args.max_delay, "cache_size": args.cache_size}
+    print(tune_service(model, settings, n_requests=args.requests, concurrency=args.concurrency, n=args.n,
+                       user_exponent=args.user_exponent).to_string(index=False))
+  else:
+    async def main():
+      service = RecommendationService(model, args.n, args.max_batch[0], args.max_delay[0], args.cache_size[0])
+      server = await service.serve(args.host, args.port, args.unix)
+      print(f"service sur {args.unix or f'http://{args.host}:{args.port}'}")
+      async with server:
+        await server.serve_forever()
+    asyncio.run(main())
@@ -0,0 +1,109 @@
+##============================================
+##============================================
+## découpages train / validation à partir des triplets de notes
+##============================================
+##============================================
+
+# * random_holdout(ratings, prop=0.8, random_state=0, shape=None)
+# * k_fold(ratings, n_folds=5, random_state=0, shape=None)
+# * leave_last_n(ratings, n=1, shape=None)
+#
+# `ratings` est soit un SparseRatings, soit des colonnes (user, item, rating[, timestamp]) : le dictionnaire
+# renvoyé par data.load_ratings() ou un DataFrame. Les découpages renvoient des SparseRatings (train, validation)
+# de même forme (par défaut : plus grand indice utilisateur / film + 1).
+#
+# Aucune matrice pleine n'est construite et il n'y a pas de boucle sur les utilisateurs : chaque note reçoit une clé
+# (aléatoire ou sa date), les notes sont triées par (utilisateur, clé) et le rang de chaque note parmi celles de
+# son utilisateur décide de son affectation. Le coût est celui d'un tri des notes (quelques secondes pour ML-20M).
+#
+# Comme eval.get_train_val, un utilisateur garde toujours au moins une note dans l'ensemble d'apprentissage.
+
+
+import numpy as np
+from data import DTYPES, SparseRatings
+
+
+##============================================
+## random_holdout(ratings, prop=0.8, random_state=0, shape=None)
+##============================================
+def random_holdout(ratings, prop=0.8, random_state=0, shape=None):
+  """
+  Pour chaque utilisateur, max(1, int(prop * nombre de notes)) notes tirées au hasard vont dans l'apprentissage,
+  les autres dans la validation (même règle que eval.get_train_val).
+  """
+  users, items, rates, _, shape = _columns(ratings, shape)
+  rng = np.random.default_rng(random_state)
+  rank, counts = _rank_in_user(users, rng.integers(2**32, size=len(users)))
+  n_train = np.maximum(1, (prop * counts).astype(int))
+  return _split(users, items, rates, shape, rank < n_train[users])
+
+
+##============================================
+## k_fold(ratings, n_folds=5, random_state=0, shape=None)
+##============================================
+def k_fold(ratings, n_folds=5, random_state=0, shape=None):
+  """
+  Itère sur les n_folds découpages (train, validation) : les notes de chaque utilisateur sont réparties au hasard
+  entre les n_folds blocs, chaque bloc sert une fois de validation.
+  Un utilisateur ayant une seule note la garde toujours dans l'apprentissage.
+  """
+  users, items, rates, _, shape = _columns(ratings, shape)
+  rng = np.random.default_rng(random_state)
+  rank, counts = _rank_in_user(users, rng.integers(2**32, size=len(users)))
+  # répartition équilibrée : le rang modulo n_folds, décalé d'un entier aléatoire par utilisateur
+  # (sinon les utilisateurs ayant peu de notes n'auraient de validation que dans les premiers blocs)
+  fold = (rank + rng.integers(n_folds, size=len(counts))[users]) % n_folds
+  for id_fold in range(n_folds):
+    yield _split(users, items, rates, shape, (fold != id_fold) | (counts[users] == 1))
+
+
+##============================================
+## leave_last_n(ratings, n=1, shape=None)
+##============================================
+def leave_last_n(ratings, n=1, shape=None):
+  """
+  Découpage temporel : les n notes les plus récentes de chaque utilisateur vont dans la validation
+  (au plus nombre de notes - 1, pour en garder une dans l'apprentissage). Nécessite la colonne timestamp.
+  """
+  users, items, rates, timestamps, shape = _columns(ratings, shape)
+  if timestamps is None:
+    raise ValueError("leave_last_n nécessite les dates des notes (colonne timestamp)")
+  # rang 0 = note la plus récente ; à date égale, l'ordre des notes dans les données départage (tri stable)
+  timestamps = np.asarray(timestamps, dtype=np.int64)
+  rank, counts = _rank_in_user(users, timestamps.max() - timestamps, stable=True)
+  return _split(users, items, rates, shape, rank >= np.minimum(n, counts - 1)[users])
+
+
+def _columns(ratings, shape):
+  # colonnes (users, items, rates, timestamps) et forme de la matrice
+  if isinstance(ratings, SparseRatings):
+    users, items, rates = ratings.triplets()
+    return users, items, rates, None, ratings.shape if shape is None else shape
+  users, items = np.asarray(ratings["user"]), np.asarray(ratings["item"])
+  rates = np.asarray(ratings["rating"], dtype=DTYPES["rating"])
+  timestamps = np.asarray(ratings["timestamp"]) if "timestamp" in ratings else None
+  if shape is None:
+    shape = (int(users.max()) + 1, int(items.max()) + 1)
+  return users, items, rates, timestamps, shape
+
+
+def _rank_in_user(users, key, stable=False):
+  # rang de chaque note parmi celles de son utilisateur, dans l'ordre croissant de `key` (entiers de 0 à 2**32 - 1) ;
+  # nombre de notes par utilisateur. Utilisateur et clé sont réunis en un seul entier 64 bits :
+  # un seul tri, bien plus rapide que np.lexsort
+  key = np.asarray(key, dtype=np.int64)
+  if len(key) and (key.min() < 0 or key.max() >= 2**32):
+    order = np.lexsort((key, users))
+  else:
+    order = np.argsort((np.asarray(users, dtype=np.int64) << 32) | key, kind="stable" if stable else None)
+  counts = np.bincount(users)
+  starts = np.cumsum(counts) - counts
+  rank = np.empty(len(users), dtype=np.int64)
+  rank[order] = np.arange(len(users)) - starts[users[order]]
+  return rank, counts
+
+
+def _split(users, items, rates, shape, in_train):
+  train = SparseRatings.from_triplets(users[in_train], items[in_train], rates[in_train], shape)
+  validation = SparseRatings.from_triplets(users[~in_train], items[~in_train], rates[~in_train], shape)
+  return train, validation
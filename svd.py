@@ -1,61 +1,183 @@
 import numpy as np 
+from scipy.sparse import issparse
+from scipy.sparse.linalg import LinearOperator, svds
+from data import DTYPES, SparseRatings, as_sparse
+from instrument import timer
 
 def replaceNA_with_zeros(M_train):
     """
     Remplace les valeurs manquantes (NaN) par des zéros pour permettre la factorisation.
+    Pour un SparseRatings, renvoie directement la matrice creuse des notes (les absents valent déjà 0).
     """
-    if M_train is None or M_train.size == 0:
+    if M_train is None or 0 in M_train.shape:
         raise ValueError("La matrice d'entrée est vide ou None.")
     
+    if isinstance(M_train, SparseRatings):
+        return M_train.csr
     return np.nan_to_num(M_train, nan=0.0)
 
 def replaceNA_with_mean(M_train):
     """
     Remplace les valeurs manquantes (NaN) par la moyenne de chaque colonne.
     Si la colonne est vide (toutes les valeurs sont NaN), elle est remplie avec 0.
+    Renvoie une nouvelle matrice : M_train n'est pas modifiée.
+    Pour un SparseRatings, la matrice remplie n'est pas construite : renvoie l'opérateur `mean_filled_operator`.
     """
-    if M_train is None or M_train.size == 0:
+    if M_train is None or 0 in M_train.shape:
         raise ValueError("La matrice d'entrée est vide ou None.")
     
+    if isinstance(M_train, SparseRatings):
+        return mean_filled_operator(M_train)
+    
     # Calculer la moyenne de chaque colonne, en ignorant les NaN
     col_mean = np.nanmean(M_train, axis=0)
     
     # Traiter les colonnes vides (toutes les valeurs sont NaN)
     col_mean[np.isnan(col_mean)] = 0  # Remplacer les moyennes NaN par 0
     
-    # Remplacer les NaN par la moyenne de la colonne correspondante
-    inds = np.isnan(M_train)
-    M_train[inds] = np.take(col_mean, np.where(inds)[1])
-    
-    return M_train
+    # Remplacer les NaN par la moyenne de la colonne correspondante (dans une copie)
+    return np.where(np.isnan(M_train), col_mean, M_train)
+
+def mean_filled_operator(M_train):
+    """
+    Matrice remplie par `replaceNA_with_mean`, sans jamais la construire : M_filled = D + 1 μᵀ, où μ est le vecteur
+    des moyennes des films et D la matrice creuse des écarts r_ij - μ_j aux notes observées (0 ailleurs).
+    Les produits M_filled @ X et M_filledᵀ @ Y, seuls utilisés par les solveurs "arpack" et "randomized",
+    se calculent en O(nnz * X.shape[1]) : la mémoire reste celle des notes observées.
+    Retourne un scipy.sparse.linalg.LinearOperator n_users x n_items.
+    """
+    R = as_sparse(M_train)
+    dtype = DTYPES["factor"]
+    col_mean = fill_values(R, replaceNA_with_mean).astype(dtype)
+    deviations = R.csr.astype(dtype)
+    deviations.data -= col_mean[deviations.indices]
+    deviations_T = deviations.T.tocsr()
+
+    def matmat(X):
+        return deviations @ X + col_mean @ X  # 1 μᵀ X : la ligne μᵀ X répétée sur chaque utilisateur
+
+    def rmatmat(Y):
+        return deviations_T @ Y + np.multiply.outer(col_mean, Y.sum(axis=0))
+
+    return LinearOperator(R.shape, matvec=matmat, rmatvec=rmatmat, matmat=matmat, rmatmat=rmatmat, dtype=dtype)
 
 
 
 
 
-def complete(M_train, k, replaceNA_fn=replaceNA_with_zeros):
+SOLVERS = ("full", "arpack", "randomized")
+
+def factorize(M_train, k, replaceNA_fn=replaceNA_with_zeros, solver=None, tol=0, n_power_iter=7, n_oversamples=10, random_state=0):
     """
-    Factorise la matrice M_train avec SVD après remplacement des NaN.
-    Retourne une matrice approximative en utilisant les k plus grandes valeurs singulières.
+    Calcule les k premiers facteurs singuliers de M_train après remplacement des NaN : M_filled ≈ U_k diag(S_k) Vt_k.
+    
+    - `solver="full"` : SVD complète de la matrice pleine (np.linalg.svd), puis troncature.
+    - `solver="arpack"` : méthode de Lanczos (scipy.sparse.linalg.svds), seuls k facteurs sont calculés (k < min(n, m)) ;
+      `tol` règle la précision (0 : précision machine).
+    - `solver="randomized"` : recherche aléatoire de l'image (Halko et al.) avec `n_oversamples` directions
+      supplémentaires et `n_power_iter` itérations de puissance (plus d'itérations = plus précis), graine `random_state`.
+    Par défaut, "full" pour une matrice remplie pleine et "arpack" pour une matrice creuse (remplissage par zéros
+    d'un SparseRatings), qui n'est alors jamais densifiée, sauf si k >= min(n, m) ("full", comme pour une matrice pleine).
+    Le remplissage par la moyenne d'un SparseRatings n'est pas construit non plus (`mean_filled_operator`) ;
+    "arpack" est alors le solveur par défaut, sauf si k >= min(n, m) ("full", seul cas où la matrice remplie est pleine).
+    
+    Retourne U_k (n x k), S_k (k,) en ordre décroissant et Vt_k (k x m).
     """
     if k <= 0:
         raise ValueError("k doit être un entier positif.")
+    implicit = replaceNA_fn is replaceNA_with_mean and isinstance(M_train, SparseRatings)
+    with timer("svd.imputation"):
+        if implicit:
+            M_filled = mean_filled_operator(M_train)
+        else:
+            M_filled = replaceNA_fn(M_train).astype(DTYPES["factor"], copy=False)
+    if solver is None:
+        # arpack ne calcule que k < min(n, m) facteurs : au-delà, SVD complète comme pour une matrice pleine
+        solver = "arpack" if (implicit or issparse(M_filled)) and k < min(M_filled.shape) else "full"
+    if solver not in SOLVERS:
+        raise ValueError(f"solver doit être parmi {SOLVERS}.")
 
-    M_filled = replaceNA_fn(M_train)
-    
     # Décomposition en valeurs singulières
-    U, S, Vt = np.linalg.svd(M_filled, full_matrices=False)
-    
+    if solver == "arpack" and k >= min(M_filled.shape):
+        raise ValueError("Avec solver='arpack', k doit être strictement inférieur à min(n, m).")
+    with timer("svd.decomposition"):
+        if solver == "full":
+            if implicit:
+                # la SVD complète travaille sur la matrice pleine : elle n'est construite qu'ici, par l'opérateur
+                M_dense = M_filled @ np.eye(M_filled.shape[1], dtype=M_filled.dtype)
+            else:
+                M_dense = M_filled.toarray() if issparse(M_filled) else M_filled
+            U, S, Vt = np.linalg.svd(M_dense, full_matrices=False)
+        elif solver == "arpack":
+            U, S, Vt = svds(M_filled, k=k, tol=tol, random_state=random_state)
+            order = np.argsort(-S)  # svds renvoie les valeurs singulières par ordre croissant
+            U, S, Vt = U[:, order], S[order], Vt[order, :]
+        else:
+            U, S, Vt = _randomized_svd(M_filled, k, n_power_iter, n_oversamples, random_state)
+
     # On tronque les matrices pour garder les k premiers composants
-    U_k = U[:, :k]
-    S_k = np.diag(S[:k])
-    Vt_k = Vt[:k, :]
+    return U[:, :k], S[:k], Vt[:k, :]
+
+def _randomized_svd(A, k, n_power_iter, n_oversamples, random_state):
+    # Base orthonormée Q de l'image de A estimée à partir de k + n_oversamples directions aléatoires,
+    # puis SVD exacte de la petite matrice Qᵀ A. A n'intervient que par des produits A @ X et Aᵀ @ Y.
+    rng = np.random.default_rng(random_state)
+    n_components = min(k + n_oversamples, min(A.shape))
+    Q, _ = np.linalg.qr(A @ rng.standard_normal((A.shape[1], n_components), dtype=A.dtype))
+    for _ in range(n_power_iter):
+        Q, _ = np.linalg.qr(A.T @ Q)
+        Q, _ = np.linalg.qr(A @ Q)
+    U_small, S, Vt = np.linalg.svd((A.T @ Q).T, full_matrices=False)
+    return Q @ U_small, S, Vt
+
+def fill_values(M_train, replaceNA_fn=replaceNA_with_zeros):
+    """
+    Valeur donnée par `replaceNA_fn` aux notes manquantes de chaque film (0, ou la moyenne du film).
+    Nécessaire pour projeter de nouvelles lignes (`fold_in`) comme les lignes de la matrice remplie.
+    """
+    if replaceNA_fn is replaceNA_with_zeros:
+        return np.zeros(M_train.shape[1])
+    if replaceNA_fn is replaceNA_with_mean:
+        col_mean = as_sparse(M_train).item_means()
+        col_mean[np.isnan(col_mean)] = 0
+        return col_mean
+    raise ValueError("fill_values ne connaît que replaceNA_with_zeros et replaceNA_with_mean.")
+
+def fold_in(R_rows, Vt_k, fill=None):
+    """
+    Facteurs de nouvelles lignes (nouveaux utilisateurs, ou utilisateurs dont les notes ont changé) sans refaire la SVD :
+    projection de leurs lignes remplies sur les facteurs films, m_filled @ Vt_kᵀ (= U_k diag(S_k) pour les lignes connues).
+
+    R_rows : notes observées de ces lignes (matrice creuse CSR, une ligne par utilisateur, Vt_k.shape[1] colonnes)
+    fill : valeurs des notes manquantes par film (voir `fill_values`), 0 par défaut
+
+    Retourne les facteurs len(R_rows) x k, à comparer aux lignes de U_k diag(S_k).
+    """
+    if fill is None:
+        fill = np.zeros(Vt_k.shape[1])
+    # ligne remplie = fill + écarts aux positions observées : seul le produit creux dépend de la ligne
+    deviations = R_rows.copy()
+    deviations.data = deviations.data - fill[deviations.indices]
+    return fill @ Vt_k.T + deviations @ Vt_k.T
+
+def complete(M_train, k, replaceNA_fn=replaceNA_with_zeros, solver=None, factors=False, **solver_params):
+    """
+    Factorise la matrice M_train avec SVD après remplacement des NaN.
+    Retourne une matrice approximative en utilisant les k plus grandes valeurs singulières.
+    `solver` et `solver_params` sont transmis à `factorize`.
+    factors=True : renvoie seulement les facteurs (P, Q) = (U_k diag(S_k), Vt_kᵀ), la matrice approximative valant P @ Qᵀ,
+    sans la construire (pour topn.top_n_factors, ou par blocs de lignes P[block] @ Qᵀ comme models.SVDRecommender).
+    """
+    U_k, S_k, Vt_k = factorize(M_train, k, replaceNA_fn, solver, **solver_params)
+    if factors:
+        return U_k * S_k, Vt_k.T
     
-    # Reconstruction de la matrice approximative
-    M_approx = U_k @ S_k @ Vt_k
+    # Reconstruction de la matrice approximative (diag(S_k) appliquée aux colonnes de U_k, sans matrice diagonale)
+    with timer("svd.reconstruction"):
+        M_approx = (U_k * S_k) @ Vt_k
     return M_approx
 
-def recommend(M_train, id_user, new=True, k=10, replaceNA_fn=replaceNA_with_zeros):
+def recommend(M_train, id_user, new=True, k=10, replaceNA_fn=replaceNA_with_zeros, solver=None, **solver_params):
     """
     Recommande des articles à un utilisateur donné en prédisant ses notes.
     
@@ -65,23 +187,21 @@ def recommend(M_train, id_user, new=True, k=10, replaceNA_fn=replaceNA_with_zero
     if id_user < 0 or id_user >= M_train.shape[0]:
         raise ValueError("id_user est hors des limites de la matrice.")
 
-    M_approx = complete(M_train, k, replaceNA_fn)
+    P, Q = complete(M_train, k, replaceNA_fn, solver, factors=True, **solver_params)
     
-    # Récupérer les prédictions de notation pour l'utilisateur
-    user_ratings = M_approx[id_user]
+    # Récupérer les prédictions de notation pour l'utilisateur (sa seule ligne de la matrice approximative)
+    user_ratings = Q @ P[id_user]
     
     if new:
         # Identifier les indices des articles non notés
-        user_original_ratings = M_train[id_user]
+        user_original_ratings = M_train.dense_row(id_user) if isinstance(M_train, SparseRatings) else M_train[id_user]
         unseen_items = np.where(np.isnan(user_original_ratings))[0]
 
         if unseen_items.size == 0:
             return []  # Aucun article à recommander
 
-        # Trier les prédictions par ordre décroissant
-        recommendations = unseen_items[np.argsort(user_ratings[unseen_items])[::-1]]
+        # Meilleure prédiction parmi les articles non notés (sans trier tout le catalogue)
+        return unseen_items[np.argmax(user_ratings[unseen_items])]
     else:
-        # Trier tous les articles selon les scores les plus élevés
-        recommendations = np.argsort(user_ratings)[::-1]
-    
-    return recommendations[0]
+        # Article de score le plus élevé
+        return np.argmax(user_ratings)
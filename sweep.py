@@ -0,0 +1,179 @@
+##============================================
+##============================================
+## balayage d'hyperparamètres avec partage des calculs
+##============================================
+##============================================
+
+# * sweep(scoring_fns, M_star, model, grid, params=None, prop=0_8, nrep=1, seed=0, n_jobs=None, warm_start=True)
+# * grid_points(grid)
+#
+# Balayer k avec eval.cross_validate entraîne chaque valeur de zéro. Ici, les points de la grille qui peuvent
+# partager leurs calculs sont regroupés en chaînes :
+# - svd : une seule décomposition au plus grand k, chaque k en reconstruit la troncature (U_k, S_k, Vt_k) ;
+# - knn : similarités calculées et voisins triés une fois par utilisateur, chaque k garde les k premiers
+#   (knn.complete_ks ; résultats identiques à knn.complete) ;
+# - knn_item_based : index des voisins triés construit une fois, chaque k en garde le début ;
+# - als : pour chaque k, les points sont parcourus par lambd décroissant puis n_iter croissant ; un point reprend
+#   les facteurs du précédent (démarrage à chaud). À k et lambd égaux (sans tol), seules les itérations
+#   supplémentaires sont calculées, comme si l'apprentissage précédent avait continué ; le premier point d'une
+#   chaîne part de facteurs tirés avec la graine du découpage (eval._job_seed), quel que soit le worker ;
+# - autres modèles : un apprentissage par point.
+# Les chaînes (et les découpages) sont indépendantes : elles sont réparties entre n_jobs workers (parallel.py).
+
+
+import inspect
+import itertools
+from time import time
+import numpy as np
+import pandas as pd
+from data import as_sparse
+from eval import _job_seed, get_train_val
+from models import MODELS
+from parallel import parallel_for
+import als
+import knn
+
+
+##============================================
+## grid_points(grid)
+##============================================
+def grid_points(grid):
+  """Points d'une grille {paramètre: liste de valeurs} (produit cartésien), ou liste de points telle quelle."""
+  if isinstance(grid, dict):
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+  return [dict(point) for point in grid]
+
+
+##============================================
+## sweep(scoring_fns, M_star, model, grid, params=None, prop=0_8, nrep=1, seed=0, n_jobs=None, warm_start=True)
+##============================================
+def sweep(scoring_fns, M_star, model, grid, params=None, prop=0.8, nrep=1, seed=0, n_jobs=None, warm_start=True):
+  """
+  Évalue le modèle `model` (nom dans models.MODELS) en chaque point de `grid` (voir `grid_points`), les paramètres
+  `params` étant communs à tous les points, sur les mêmes découpages que eval.cross_validate (graines seed, seed + 1, ...).
+  Comme dans cross_validate, les modèles qui ont un paramètre random_state reçoivent la graine du découpage
+  (sauf si params ou la grille la fixent) : les résultats ne dépendent pas de n_jobs.
+  Avec warm_start=False, ALS repart de facteurs aléatoires pour chaque lambd (les n_iter successifs restent partagés).
+
+  Retourne un DataFrame comme cross_validate, une ligne par point : "recommender", une colonne par paramètre
+  de la grille, "<métrique> (validation)", "<métrique> (training)" et "computation time" (temps propre au point :
+  un calcul partagé est compté pour le premier point de la chaîne qui l'utilise).
+  """
+  points = [{**(params or {}), **point} for point in grid_points(grid)]
+  groups = _groups(model, points)
+  splits = [tuple(as_sparse(M) for M in get_train_val(M_star, prop, random_state=seed + id_rep)) for id_rep in range(nrep)]
+  jobs = [(id_rep, group) for id_rep in range(nrep) for group in groups]
+  job_seeds = [_job_seed(seed + id_rep) for id_rep in range(nrep)]
+
+  def run(start, stop):
+    results = []
+    for id_rep, group in jobs[start:stop]:
+      M_train, M_validation = splits[id_rep]
+      for id_point, M_completed, computation_time in _completions(model, M_train, points, group, warm_start,
+                                                                  job_seeds[id_rep]):
+        results.append((id_rep, id_point,
+                        [scoring_fn(M_completed, M_validation) for scoring_fn in scoring_fns],
+                        [scoring_fn(M_completed, M_train) for scoring_fn in scoring_fns],
+                        computation_time))
+    return results
+
+  results = [result for chunk in parallel_for(run, len(jobs), n_jobs, chunk_size=1) for result in chunk]
+
+  scores = np.zeros((nrep, len(points), len(scoring_fns)))
+  scores_train = np.zeros((nrep, len(points), len(scoring_fns)))
+  computation_time = np.zeros((nrep, len(points)))
+  for id_rep, id_point, score, score_train, duration in results:
+    scores[id_rep, id_point], scores_train[id_rep, id_point], computation_time[id_rep, id_point] = score, score_train, duration
+
+  names = list(grid_points(grid)[0]) if points else []
+  df = pd.DataFrame({'recommender': [model + " " + " ".join(f"{name}={_label(point[name])}" for name in names)
+                                     for point in points]})
+  for name in names:
+    df[name] = [point[name] for point in points]
+  for id_fn, scoring_fn in enumerate(scoring_fns):
+    df[f'{scoring_fn.__name__} (validation)'] = np.mean(scores[:, :, id_fn], axis=0)
+    df[f'{scoring_fn.__name__} (training)'] = np.mean(scores_train[:, :, id_fn], axis=0)
+  df['computation time'] = np.mean(computation_time, axis=0)
+  return df
+
+
+def _label(value):
+  return getattr(value, '__name__', value)
+
+
+def _groups(model, points):
+  # chaînes de points partageant leurs calculs (listes d'indices de points) : mêmes paramètres hors de ceux balayés
+  # gratuitement (k pour svd et les knn, lambd et n_iter pour als)
+  free = {"svd": {"k"}, "knn": {"k"}, "knn_item_based": {"k"}, "als": {"lambd", "n_iter"}}.get(model)
+  if free is None:
+    return [[id_point] for id_point in range(len(points))]
+  groups = {}
+  for id_point, point in enumerate(points):
+    key = repr(sorted((name, _label(value)) for name, value in point.items() if name not in free))
+    groups.setdefault(key, []).append(id_point)
+  return list(groups.values())
+
+
+def _param(model, point, name):
+  # valeur du paramètre au point (valeur par défaut du modèle s'il n'est pas donné)
+  return getattr(MODELS[model](**point), name)
+
+
+def _seeded(model, point, random_state):
+  # paramètres du point, avec random_state si le modèle a ce paramètre et que le point ne le fixe pas
+  if 'random_state' in point or 'random_state' not in inspect.signature(MODELS[model]).parameters:
+    return point
+  return {**point, 'random_state': random_state}
+
+
+def _completions(model, R, points, group, warm_start, random_state=None):
+  # matrices complétées des points de la chaîne `group` : itère sur (indice du point, matrice, temps propre au point)
+  # random_state : graine des modèles qui en ont une (voir `_seeded`)
+  points = [_seeded(model, point, random_state) for point in points]
+  ptm = time()
+  if model == "svd":
+    ks = {id_point: _param(model, points[id_point], "k") for id_point in group}
+    fitted = MODELS["svd"](**{**points[group[0]], "k": max(ks.values())}).fit(R)
+    for id_point in sorted(group, key=ks.get):
+      k = ks[id_point]
+      M_completed = (fitted.U_[:, :k] * fitted.S_[:k]) @ fitted.Vt_[:k]
+      yield id_point, M_completed, time() - ptm
+      ptm = time()
+
+  elif model == "knn":
+    ks = [_param(model, points[id_point], "k") for id_point in group]
+    for id_point, M_completed in zip(group, knn.complete_ks(R, ks)):
+      yield id_point, M_completed, time() - ptm
+      ptm = time()
+
+  elif model == "knn_item_based":
+    fitted = MODELS["knn_item_based"](**points[group[0]]).fit(R)  # index des voisins commun aux valeurs de k
+    for id_point in group:
+      fitted.k = _param(model, points[id_point], "k")
+      yield id_point, fitted.complete(), time() - ptm
+      ptm = time()
+
+  elif model == "als":
+    chain = sorted(((MODELS["als"](**points[id_point]), id_point) for id_point in group),
+                   key=lambda item: (-item[0].lambd, item[0].n_iter))
+    previous = None  # (paramètres, U, V) du point précédent
+    for params, id_point in chain:
+      n_iter, init = params.n_iter, None
+      if previous is not None:
+        previous_params, init = previous[0], previous[1:]
+        if previous_params.lambd == params.lambd and previous_params.tol is None and params.tol is None \
+           and previous_params.n_iter <= params.n_iter:
+          # même problème, plus d'itérations : on continue l'apprentissage précédent
+          n_iter -= previous_params.n_iter
+        elif not warm_start:
+          init = None
+      U, V, _ = als.factorize(R, params.k, n_iter, params.lambd, params.tol, params.n_jobs, init, params.random_state)
+      previous = (params, U, V)
+      yield id_point, U @ V.T, time() - ptm
+      ptm = time()
+
+  else:
+    for id_point in group:
+      yield id_point, MODELS[model](**points[id_point]).fit(R).complete(), time() - ptm
+      ptm = time()
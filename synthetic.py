@@ -0,0 +1,113 @@
+##============================================
+##============================================
+## génération de grands jeux de notes synthétiques
+##============================================
+##============================================
+
+# * generate_ratings(n_users, n_items, n_ratings, rank=10, ..., random_state=0)
+# * as_ratings(columns, shape)
+#
+# Pour mesurer le passage à l'échelle sans télécharger de données (10⁶ à 10⁸ notes), `generate_ratings`
+# produit des notes ayant les propriétés principales des données MovieLens :
+# - activité des utilisateurs et popularité des films en loi de puissance (quelques utilisateurs très actifs,
+#   quelques films très notés, une longue traîne) : l'utilisateur (le film) de rang r est tiré avec une probabilité
+#   proportionnelle à r^-exposant, les rangs étant attribués dans un ordre aléatoire ;
+# - structure de rang faible connue : note = moyenne + biais utilisateur + biais film + u_i . v_j + bruit,
+#   arrondie et ramenée dans [1, 5] ; les facteurs plantés sont renvoyés pour comparer les facteurs appris.
+#
+# Les colonnes renvoyées sont celles de data.load_ratings (user, item int32 ; rating int8 ; timestamp int64),
+# `as_ratings` en fait un SparseRatings accepté par tous les modules. Tout est déterminé par random_state.
+
+
+import numpy as np
+from data import DTYPES, SparseRatings
+
+
+##============================================
+## generate_ratings(n_users, n_items, n_ratings, rank=10, ..., random_state=0)
+##============================================
+def generate_ratings(n_users, n_items, n_ratings, rank=10, user_exponent=0.8, item_exponent=1.0, noise=0.5,
+                     mean=3.5, bias_std=0.4, chunksize=10**7, random_state=0, sparse=False):
+  """
+  Notes synthétiques : n_ratings couples (utilisateur, film) distincts (moins si la matrice est presque pleine),
+  tirés selon les lois de puissance d'exposants user_exponent (activité) et item_exponent (popularité).
+  Les notes suivent le modèle de rang `rank` décrit en tête de module, avec un bruit gaussien d'écart-type `noise`.
+  Les notes sont générées par morceaux de `chunksize` : la mémoire reste proportionnelle au nombre de notes.
+
+  Retourne (ratings, truth) :
+  - ratings : dict de colonnes "user", "item", "rating", "timestamp" (comme data.load_ratings),
+    ou SparseRatings n_users x n_items si sparse=True ;
+  - truth : dict "user_factors" (n_users x rank), "item_factors" (n_items x rank), "user_bias", "item_bias", "mean",
+    et "expected" (note attendue avant bruit et arrondi, une par note, dans l'ordre des colonnes).
+  """
+  if n_ratings > n_users * n_items:
+    raise ValueError("n_ratings dépasse le nombre de couples (utilisateur, film)")
+  rng = np.random.default_rng(random_state)
+  user_p = _power_law(n_users, user_exponent, rng)
+  item_p = _power_law(n_items, item_exponent, rng)
+
+  # couples distincts : tirages successifs jusqu'à atteindre n_ratings (les doublons d'un tirage sont écartés),
+  # au plus quelques tours si les lois de puissance concentrent les tirages sur des couples déjà pris
+  keys = np.empty(0, dtype=np.int64)
+  for _ in range(20):
+    missing = n_ratings - len(keys)
+    if missing <= 0:
+      break
+    size = 2 * missing + 16
+    users = _sample(user_p, size, rng, chunksize)
+    items = _sample(item_p, size, rng, chunksize)
+    new_keys = users.astype(np.int64) * n_items + items
+    keys = np.concatenate([keys, new_keys])
+    _, first = np.unique(keys, return_index=True)
+    keys = keys[np.sort(first)][:n_ratings]  # ordre de tirage conservé : les premiers tirages sont gardés
+  users, items = (keys // n_items).astype(np.int32), (keys % n_items).astype(np.int32)
+  del keys
+
+  # modèle de rang faible planté, facteurs d'écart-type rank^-1/4 pour que u_i . v_j soit de variance 1
+  factor_dtype = DTYPES["factor"]
+  truth = {
+    "user_factors": (rng.standard_normal((n_users, rank)) / np.sqrt(np.sqrt(rank))).astype(factor_dtype),
+    "item_factors": (rng.standard_normal((n_items, rank)) / np.sqrt(np.sqrt(rank))).astype(factor_dtype),
+    "user_bias": (bias_std * rng.standard_normal(n_users)).astype(factor_dtype),
+    "item_bias": (bias_std * rng.standard_normal(n_items)).astype(factor_dtype),
+    "mean": mean,
+  }
+  expected = np.empty(len(users), dtype=factor_dtype)
+  rates = np.empty(len(users), dtype=np.int8)
+  for start in range(0, len(users), chunksize):
+    u, i = users[start:start + chunksize], items[start:start + chunksize]
+    expected[start:start + chunksize] = (mean + truth["user_bias"][u] + truth["item_bias"][i]
+                                         + np.einsum("nk,nk->n", truth["user_factors"][u], truth["item_factors"][i]))
+    noisy = expected[start:start + chunksize] + noise * rng.standard_normal(len(u))
+    rates[start:start + chunksize] = np.clip(np.rint(noisy), 1, 5)
+  truth["expected"] = expected
+
+  # dates : croissantes dans l'ordre de tirage, comme un journal de notes (utile à split.leave_last_n)
+  timestamps = 874_724_710 + np.sort(rng.integers(0, 10**8, size=len(users)))
+  ratings = {"user": users, "item": items, "rating": rates, "timestamp": timestamps}
+  return (as_ratings(ratings, (n_users, n_items)) if sparse else ratings), truth
+
+
+def _power_law(n, exponent, rng):
+  # probabilités proportionnelles à rang^-exposant, rangs répartis au hasard entre les indices
+  p = np.arange(1, n + 1, dtype=np.float64) ** -exponent
+  return rng.permutation(p / p.sum())
+
+
+def _sample(p, size, rng, chunksize):
+  # tirage de `size` indices selon p, par inversion de la fonction de répartition (par morceaux)
+  cdf = np.cumsum(p)
+  cdf /= cdf[-1]
+  out = np.empty(size, dtype=np.int32)
+  for start in range(0, size, chunksize):
+    stop = min(size, start + chunksize)
+    out[start:stop] = np.searchsorted(cdf, rng.random(stop - start), side="right")
+  return np.minimum(out, len(p) - 1, out=out)
+
+
+##============================================
+## as_ratings(columns, shape)
+##============================================
+def as_ratings(columns, shape):
+  """SparseRatings n_users x n_items des colonnes user / item / rating (celles de generate_ratings ou data.load_ratings)."""
+  return SparseRatings.from_triplets(columns["user"], columns["item"], columns["rating"].astype(DTYPES["rating"]), shape)
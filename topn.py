@@ -0,0 +1,83 @@
+##============================================
+##============================================
+## sélection des N meilleurs films pour plusieurs utilisateurs à la fois
+##============================================
+##============================================
+
+# * top_n(scores, n, exclude=None)
+# * top_n_factors(user_factors, item_factors, n, exclude=None, block_size=1024, item_block_size=None)
+#
+# Les N meilleurs films de chaque ligne sont obtenus par np.argpartition (coût linéaire en le nombre de films),
+# seuls ces N films sont ensuite triés. Les films à exclure (déjà notés par exemple) sont donnés par une matrice
+# creuse n_users x n_items (typiquement `R.mask[user_ids]` d'un SparseRatings) et masqués en une seule opération.
+# Si une ligne a moins de N films disponibles (films exclus, scores NaN ou -inf), les dernières positions valent -1
+# avec un score -inf, comme pour ann.IVFIndex.search : un indice -1 n'est jamais un film à recommander.
+# Pour un très grand catalogue, top_n_factors peut aussi parcourir les films par blocs : les N meilleurs de chaque
+# bloc sont fusionnés avec les N meilleurs courants (comme un tas de taille N), la mémoire ne dépend plus du catalogue.
+
+
+import numpy as np
+
+
+##============================================
+## top_n(scores, n, exclude=None)
+##============================================
+def top_n(scores, n, exclude=None):
+  """
+  Les n meilleurs scores de chaque ligne de `scores` (n_users x n_items), par ordre décroissant.
+
+  Retourne :
+  indices : tableau n_users x n des films sélectionnés (-1 pour les positions sans film disponible)
+  values : tableau n_users x n des scores correspondants (-inf pour ces positions)
+  """
+  scores = np.array(scores, dtype=float)  # copie : les films exclus et les NaN sont mis à -inf
+  scores[np.isnan(scores)] = -np.inf
+  if exclude is not None:
+    exclude = exclude.tocsr()
+    scores[np.repeat(np.arange(exclude.shape[0]), np.diff(exclude.indptr)), exclude.indices] = -np.inf
+
+  n = min(n, scores.shape[1])
+  if n <= 0:
+    return np.zeros((scores.shape[0], 0), dtype=int), np.zeros((scores.shape[0], 0))
+  indices = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+  values = np.take_along_axis(scores, indices, axis=1)
+
+  # tri des n films retenus seulement
+  order = np.argsort(-values, axis=1, kind="stable")
+  indices, values = np.take_along_axis(indices, order, axis=1), np.take_along_axis(values, order, axis=1)
+  indices[np.isneginf(values)] = -1
+  return indices, values
+
+
+##============================================
+## top_n_factors(user_factors, item_factors, n, exclude=None, block_size=1024, item_block_size=None)
+##============================================
+def top_n_factors(user_factors, item_factors, n, exclude=None, block_size=1024, item_block_size=None):
+  """
+  Même chose que top_n pour des scores de la forme user_factors @ item_factors.T,
+  calculés par blocs de `block_size` utilisateurs : la matrice de scores complète n'est jamais construite.
+  Avec item_block_size, chaque bloc d'utilisateurs parcourt aussi les films par blocs de item_block_size
+  (mémoire block_size x (item_block_size + n) au lieu de block_size x n_items).
+  """
+  n_users, n_items = user_factors.shape[0], item_factors.shape[0]
+  indices = np.zeros((n_users, min(n, n_items)), dtype=int)
+  values = np.zeros(indices.shape)
+  if exclude is not None:
+    exclude = exclude.tocsr()
+  for start in range(0, n_users, block_size):
+    stop = min(start + block_size, n_users)
+    exclude_block = None if exclude is None else exclude[start:stop]
+    if item_block_size is None or item_block_size >= n_items:
+      indices[start:stop], values[start:stop] = top_n(user_factors[start:stop] @ item_factors.T, n, exclude_block)
+      continue
+    best_indices, best_values = np.zeros((stop - start, 0), dtype=int), np.zeros((stop - start, 0))
+    for item_start in range(0, n_items, item_block_size):
+      item_stop = min(item_start + item_block_size, n_items)
+      block_indices, block_values = top_n(user_factors[start:stop] @ item_factors[item_start:item_stop].T, n,
+                                          None if exclude_block is None else exclude_block[:, item_start:item_stop])
+      # fusion avec les n meilleurs courants : les n meilleurs de l'union (candidats dans l'ordre des films)
+      candidates = np.hstack([best_indices, np.where(block_indices >= 0, block_indices + item_start, -1)])
+      selected, best_values = top_n(np.hstack([best_values, block_values]), n)
+      best_indices = np.where(selected >= 0, np.take_along_axis(candidates, np.maximum(selected, 0), axis=1), -1)
+    indices[start:stop], values[start:stop] = best_indices, best_values
+  return indices, values